@@ -1,7 +1,27 @@
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
 from django.db import models
-from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella
+from .cache import cache_risposte
+from .filters import in_catalogo, in_sottoalbero
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella, JobImportazione
+from .versioni import CHIAVE_STRUTTURA, leggi_versione
+
+# Scelte dei filtri lette dalla cache: la chiave contiene la versione della struttura,
+# che cambia a ogni modifica di cataloghi o categorie (vedi signals.py)
+def scelte_in_cache(nome, calcola):
+    versione, _ = leggi_versione(CHIAVE_STRUTTURA)
+    return cache_risposte().get_or_set(f'admin:scelte:{nome}:{versione}', calcola)
+
+
+# Id letto dal filtro: un valore non numerico riporta alla changelist con ?e=1 invece di un errore 500
+def id_filtro(filtro):
+    valore = filtro.value()
+    if valore and not valore.isdigit():
+        raise IncorrectLookupParameters(f'{filtro.parameter_name} non valido')
+    return valore
+
 
 # Filtro custom per Cataloghi
 class CatalogoFilter(SimpleListFilter):
@@ -9,19 +29,15 @@ class CatalogoFilter(SimpleListFilter):
     parameter_name = 'catalogo'
     
     def lookups(self, request, model_admin):
-        cataloghi = Catalogo.objects.all().order_by('nome_it')
-        return [(c.id, c.nome_it) for c in cataloghi]
+        return scelte_in_cache('cataloghi', lambda: list(
+            Catalogo.objects.order_by('nome_it').values_list('id', 'nome_it')
+        ))
     
     def queryset(self, request, queryset):
-        if self.value():
-            from django.db.models import Q
-            # Filtra cartelle che sono:
-            # 1. Associate direttamente al catalogo (root)
-            # 2. Associate a categorie di quel catalogo (incluse sottocategorie)
-            return queryset.filter(
-                Q(cataloghi__id=self.value()) |  # Root del catalogo
-                Q(categorie__catalogo_id=self.value())  # Categorie del catalogo
-            ).distinct()
+        catalogo_id = id_filtro(self)
+        if catalogo_id:
+            # Cartelle associate direttamente al catalogo (root) o a una sua categoria (incluse sottocategorie)
+            return queryset.filter(in_catalogo(catalogo_id))
         return queryset
 
 # Filtro custom per Categorie (dipendente dal Catalogo selezionato)
@@ -31,20 +47,27 @@ class CategoriaFilter(SimpleListFilter):
     
     def lookups(self, request, model_admin):
         # Prende il catalogo selezionato dal parametro URL
-        catalogo_id = request.GET.get('catalogo')
-        
+        catalogo_id = request.GET.get('catalogo', '')
+        if not catalogo_id.isdigit():
+            catalogo_id = ''
+        return scelte_in_cache(f'categorie:{catalogo_id}', lambda: self.calcola_scelte(catalogo_id))
+
+    # Categorie (del catalogo selezionato o tutte) col percorso completo, in ordine di albero
+    def calcola_scelte(self, catalogo_id):
+        categorie = Categoria.objects.select_related('catalogo')
         if catalogo_id:
-            # Se c'è un catalogo selezionato, mostra solo le sue categorie
-            categorie = Categoria.objects.filter(catalogo_id=catalogo_id).order_by('nome_it')
-        else:
-            # Altrimenti mostra tutte le categorie
-            categorie = Categoria.objects.all().order_by('nome_it')
-        
-        return [(c.id, c.nome_it) for c in categorie]
+            categorie = categorie.filter(catalogo_id=catalogo_id)
+        categorie = Categoria.carica_antenati(categorie)
+        return sorted(((c.id, c.get_full_path()) for c in categorie), key=lambda scelta: scelta[1].lower())
     
     def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(categorie__id=self.value()).distinct()
+        categoria_id = id_filtro(self)
+        if categoria_id:
+            # La categoria comprende le cartelle di tutte le sue sottocategorie
+            percorso = Categoria.leggi_percorso(categoria_id)
+            if not percorso:
+                return queryset.none()
+            return queryset.filter(in_sottoalbero(percorso))
         return queryset
 
 #creamo un inline admin per mostrare le cartelle associate a catalogo
@@ -159,7 +182,19 @@ class CategoriaAdmin(admin.ModelAdmin):
 
 
 from django import forms
-from filer.models import File
+from filer.models import File, Folder
+from .importazione import ESTENSIONI_IMMAGINE, anteprima_file_filer, cerca_file_filer
+from .jobs import crea_job, riprendi_job
+
+# Changelist delle cartelle: dopo aver letto la pagina carica in blocco gli antenati
+# di tutte le categorie precaricate, così la colonna 'posizione' non fa query per riga
+class CartelleChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        Categoria.carica_antenati(
+            categoria for cartella in self.result_list for categoria in cartella.categorie.all()
+        )
+
 
 # Form Custom per Cartelle (semplice, senza multipli)
 class CartelleForm(forms.ModelForm):
@@ -175,6 +210,7 @@ class CartelleAdmin(admin.ModelAdmin):
     list_display = ('nome_cartella', 'tipo_file', 'posizione', 'is_active', 'created_at', 'updated_by')
     list_display_links = ('nome_cartella',)
     list_filter = ('tipo_file', 'is_active', CatalogoFilter, CategoriaFilter)
+    list_select_related = ('updated_by',)
     search_fields = ('nome_cartella',)
     
     # Fieldsets per organizzare il form
@@ -198,9 +234,27 @@ class CartelleAdmin(admin.ModelAdmin):
             path('import-multipli/', 
                  self.admin_site.admin_view(self.import_multipli_view),
                  name='catalogo_cartelle_import_multipli'),
+            path('import-multipli/file/',
+                 self.admin_site.admin_view(self.file_import_view),
+                 name='catalogo_cartelle_import_file'),
+            path('import-multipli/file/<int:file_id>/anteprima/',
+                 self.admin_site.admin_view(self.anteprima_file_view, cacheable=True),
+                 name='catalogo_cartelle_import_anteprima'),
         ]
         return custom_urls + urls
     
+    # Cataloghi e categorie (col catalogo, per il percorso) precaricati per tutta la pagina:
+    # il numero di query della changelist non dipende da quante righe mostra
+    def get_queryset(self, request):
+        from django.db.models import Prefetch
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('cataloghi', queryset=Catalogo.objects.order_by('nome_it')),
+            Prefetch('categorie', queryset=Categoria.objects.select_related('catalogo').order_by('percorso')),
+        )
+
+    def get_changelist(self, request, **kwargs):
+        return CartelleChangeList
+
     def changelist_view(self, request, extra_context=None):
         """Override per aggiungere pulsante custom nella toolbar"""
         extra_context = extra_context or {}
@@ -227,50 +281,18 @@ class CartelleAdmin(admin.ModelAdmin):
                 return redirect('admin:catalogo_cartelle_changelist')
             
             if file_ids:
-                count = 0
-                for file_id in file_ids:
-                    try:
-                        file_obj = File.objects.get(pk=file_id)
-                        from pathlib import Path
-                        nome = Path(file_obj.name).stem
-                        
-                        # Crea la cartella
-                        cartella = Cartelle.objects.create(
-                            nome_cartella=nome,
-                            file_da_filer=file_obj,
-                            is_active=True,
-                            created_by=request.user,
-                            updated_by=request.user
-                        )
-                        
-                        # Collega a Catalogo
-                        CatalogoCartella.objects.create(
-                            catalogo_id=catalogo_id,
-                            cartella=cartella,
-                            ordine=count
-                        )
-                        
-                        # Collega a Categoria se selezionata
-                        if categoria_id:
-                            CategoriaCartella.objects.create(
-                                categoria_id=categoria_id,
-                                cartella=cartella,
-                                ordine=count
-                            )
-                        
-                        count += 1
-                    except Exception as e:
-                        messages.error(request, f'❌ Errore con file {file_id}: {str(e)}')
-                
-                messages.success(request, f'✅ {count} file importati con successo!')
+                # L'import gira in background a blocchi: si passa subito alla pagina di avanzamento
+                job = crea_job(file_ids, catalogo_id, categoria_id, utente=request.user)
+                messages.info(request, f'⏳ Import di {job.totale} file avviato in background')
+                return redirect('admin:catalogo_jobimportazione_avanzamento', job_id=job.pk)
             else:
                 messages.warning(request, '⚠️ Nessun file selezionato!')
             
             return redirect('admin:catalogo_cartelle_changelist')
         
-        # Mostra la pagina intermedia con la lista file
-        files = File.objects.select_related('folder').all().order_by('-uploaded_at')
+        # Mostra la pagina intermedia: la lista file è caricata a pagine da file_import_view
         cataloghi = Catalogo.objects.filter(is_active=True)
+        cartelle_filer = list(Folder.objects.order_by('name').values('id', 'name'))
         
         # Prepara categorie raggruppate per catalogo
         categorie_by_catalogo = {}
@@ -283,8 +305,8 @@ class CartelleAdmin(admin.ModelAdmin):
         context = {
             **self.admin_site.each_context(request),  # Contesto admin standard
             'title': 'Importa Multipli File da Filer',
-            'files': files,
             'cataloghi': cataloghi,
+            'cartelle_filer': cartelle_filer,
             'categorie_json': json.dumps(categorie_by_catalogo),
             'opts': self.model._meta,
             'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
@@ -293,15 +315,87 @@ class CartelleAdmin(admin.ModelAdmin):
         # Django cerca il template: templates/admin/catalogo/import_multipli_action.html
         return render(request, 'admin/catalogo/import_multipli_action.html', context)
     
+    def file_import_view(self, request):
+        """
+        Lista paginata in JSON dei file Filer per la pagina di import multiplo
+
+        GET ?page=N&page_size=M&q=testo&cartella_filer=ID|nessuna&solo_non_importati=1
+        """
+        import os
+        from django.core.paginator import Paginator
+        from django.core.exceptions import PermissionDenied
+        from django.http import JsonResponse
+        from django.urls import reverse
+
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        cartella_filer = request.GET.get('cartella_filer', '')
+        if cartella_filer != 'nessuna' and not cartella_filer.isdigit():
+            cartella_filer = None
+        files = cerca_file_filer(
+            testo=request.GET.get('q', '').strip(),
+            cartella_filer=cartella_filer,
+            solo_non_importati=request.GET.get('solo_non_importati') in ('1', 'true')
+        )
+
+        try:
+            page_size = min(max(int(request.GET.get('page_size', 50)), 1), 100)
+        except ValueError:
+            page_size = 50
+        pagina = Paginator(files, page_size).get_page(request.GET.get('page'))
+
+        risultati = []
+        for file_obj in pagina:
+            estensione = os.path.splitext(file_obj.file.name)[1].lower()
+            risultati.append({
+                'id': file_obj.id,
+                'nome': file_obj.label,
+                'estensione': estensione,
+                'dimensione': file_obj.size,
+                'uploaded_at': file_obj.uploaded_at.isoformat() if file_obj.uploaded_at else None,
+                'cartella_filer': file_obj.folder.name if file_obj.folder else None,
+                # Solo l'URL: la thumbnail viene letta (o generata) quando il browser mostra la riga
+                'anteprima_url': reverse('admin:catalogo_cartelle_import_anteprima', args=[file_obj.id])
+                    if estensione in ESTENSIONI_IMMAGINE else None,
+            })
+
+        return JsonResponse({
+            'count': pagina.paginator.count,
+            'page': pagina.number,
+            'num_pages': pagina.paginator.num_pages,
+            'results': risultati,
+        })
+
+    def anteprima_file_view(self, request, file_id):
+        """Redirect alla thumbnail 64px di un file Filer (quella delle icone Filer, se già generata)"""
+        from django.core.exceptions import PermissionDenied
+        from django.http import Http404
+        from django.shortcuts import get_object_or_404, redirect
+
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        file_obj = get_object_or_404(File, pk=file_id)
+        try:
+            url = anteprima_file_filer(file_obj)
+        except Exception:
+            # File mancante o non è un'immagine valida: il browser mostra l'icona generica
+            raise Http404('Anteprima non disponibile')
+
+        response = redirect(url)
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
     # Colonna unica che mostra dove si trova la cartella
     def posizione(self, obj):
         posizioni = []
         
-        # Controllo categorie
+        # Controllo categorie (percorso completo, antenati già caricati dalla changelist)
         categorie = obj.categorie.all()
         if categorie:
             for cat in categorie:
-                posizioni.append(f"{cat.nome_it}")
+                posizioni.append(cat.get_full_path())
         
         # Controllo cataloghi root
         cataloghi = obj.cataloghi.all()
@@ -338,4 +432,110 @@ class CartelleAdmin(admin.ModelAdmin):
         if categorie:
             return ", ".join([c.nome_it for c in categorie])
         return "-"
-    categorie_list.short_description = 'Categorie'
\ No newline at end of file
+    categorie_list.short_description = 'Categorie'
+
+
+# Job di import multiplo: lista, pagina di avanzamento con polling JSON e ripresa dei job falliti
+@admin.register(JobImportazione)
+class JobImportazioneAdmin(admin.ModelAdmin):
+    list_display = ('id', 'catalogo', 'categoria', 'stato', 'avanzamento', 'importati', 'num_errori', 'created_at', 'created_by')
+    list_display_links = ('id',)
+    list_filter = ('stato',)
+    list_select_related = ('catalogo', 'categoria', 'created_by')
+    exclude = ('file_ids',)  # Può contenere decine di migliaia di id
+    readonly_fields = (
+        'stato', 'catalogo', 'categoria', 'totale', 'elaborati', 'importati', 'errori', 'messaggio',
+        'created_at', 'avviato_il', 'completato_il', 'updated_at', 'created_by'
+    )
+    actions = ['riprendi_selezionati']
+
+    # I job si creano solo dalla pagina di import multiplo
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # Riprendere un job ne cambia lo stato: serve il permesso di modifica del modello
+    def has_riprendi_permission(self, request):
+        return super().has_change_permission(request)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('file_ids')
+
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path('<int:job_id>/avanzamento/',
+                 self.admin_site.admin_view(self.avanzamento_view),
+                 name='catalogo_jobimportazione_avanzamento'),
+            path('<int:job_id>/stato/',
+                 self.admin_site.admin_view(self.stato_view),
+                 name='catalogo_jobimportazione_stato'),
+            path('<int:job_id>/riprendi/',
+                 self.admin_site.admin_view(self.riprendi_view),
+                 name='catalogo_jobimportazione_riprendi'),
+        ]
+        return custom_urls + urls
+
+    def get_job(self, request, job_id):
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import get_object_or_404
+
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return get_object_or_404(self.get_queryset(request).select_related('catalogo', 'categoria'), pk=job_id)
+
+    def avanzamento_view(self, request, job_id):
+        """Pagina di avanzamento: legge lo stato dall'endpoint JSON finché il job non termina"""
+        from django.shortcuts import render
+
+        job = self.get_job(request, job_id)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Import #{job.pk}',
+            'job': job,
+            'puo_riprendere': self.has_riprendi_permission(request),
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/catalogo/job_importazione.html', context)
+
+    def stato_view(self, request, job_id):
+        """Stato del job in JSON (avanzamento, errori, riepilogo)"""
+        from django.http import JsonResponse
+
+        return JsonResponse(self.get_job(request, job_id).get_riepilogo())
+
+    def riprendi_view(self, request, job_id):
+        """Riprende un job fallito o interrotto (anche rimasto in coda) dal primo blocco non completato"""
+        from django.contrib import messages
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import redirect
+
+        job = self.get_job(request, job_id)
+        if not self.has_riprendi_permission(request):
+            raise PermissionDenied
+        if request.method == 'POST':
+            if riprendi_job(job):
+                messages.info(request, f'⏳ Import #{job.pk} ripreso da {job.elaborati}/{job.totale} file')
+            else:
+                messages.warning(request, '⚠️ Il job non può essere ripreso (completato o ancora in corso)')
+        return redirect('admin:catalogo_jobimportazione_avanzamento', job_id=job.pk)
+
+    def avanzamento(self, obj):
+        from django.urls import reverse
+        from django.utils.html import format_html
+
+        url = reverse('admin:catalogo_jobimportazione_avanzamento', args=[obj.pk])
+        return format_html('<a href="{}">{}/{} ({}%)</a>', url, obj.elaborati, obj.totale, obj.get_percentuale())
+    avanzamento.short_description = 'Avanzamento'
+
+    def num_errori(self, obj):
+        return len(obj.errori)
+    num_errori.short_description = 'Errori'
+
+    @admin.action(description='Riprendi i job selezionati (falliti o interrotti)', permissions=['riprendi'])
+    def riprendi_selezionati(self, request, queryset):
+        ripresi = sum(1 for job in queryset if riprendi_job(job))
+        self.message_user(request, f'{ripresi} job ripresi')
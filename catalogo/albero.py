@@ -0,0 +1,100 @@
+from django.db.models import Count, OuterRef, Subquery, IntegerField, prefetch_related_objects
+from django.db.models.functions import Coalesce
+
+from .models import Categoria, CatalogoCartella, CategoriaCartella
+
+
+#Subquery che conta le righe figlie di ogni categoria (evita JOIN multipli che moltiplicano le righe)
+def _conteggio(queryset, campo):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{campo: OuterRef('pk')})
+            .order_by()
+            .values(campo)
+            .annotate(totale=Count('pk'))
+            .values('totale'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+# Costruisce l'albero completo di un catalogo con un numero costante di query
+# Query: 1 per le categorie (con conteggi) + 4 se sono richieste le cartelle (righe ponte e relazioni M2M)
+def costruisci_albero(catalogo, profondita=None, includi_cartelle=False, context=None):
+    from .serializers import CartelleSerializer
+
+    # 1. Tutte le categorie attive del catalogo, entro la profondità richiesta
+    categorie = Categoria.objects.filter(catalogo=catalogo, is_active=True)
+    if profondita is not None:
+        categorie = categorie.filter(livello__lt=profondita)
+    categorie = categorie.annotate(
+        num_sottocategorie=_conteggio(Categoria.objects.filter(is_active=True), 'parent'),
+        num_cartelle=_conteggio(CategoriaCartella.objects.filter(cartella__is_active=True), 'categoria'),
+    ).order_by('livello', 'nome_it', 'id')
+
+    # Categorie create con bulk_create (livello 0, percorso vuoto): si ricalcolano i percorsi e si rilegge,
+    # altrimenti verrebbero messe fuori posto o scartate e la profondità non verrebbe rispettata
+    righe = list(categorie)
+    if any(not categoria.percorso for categoria in righe):
+        Categoria.ricalcola_percorsi()
+        righe = list(categorie.all())
+
+    # Con ?lang= (lingua nel context) ogni nodo ha solo il 'nome' nella lingua richiesta
+    lingua = (context or {}).get('lingua')
+    nodi = {}
+    radici = []
+    for categoria in righe:
+        # Le categorie sotto un parent disattivato (o fuori dall'albero) vengono scartate
+        if categoria.parent_id and categoria.parent_id not in nodi:
+            continue
+        nodo = {'id': categoria.id}
+        if lingua:
+            nodo['nome'] = categoria.get_nome(lingua)
+        else:
+            nodo.update({
+                'nome_it': categoria.nome_it,
+                'nome_en': categoria.nome_en,
+                'nome_fr': categoria.nome_fr,
+                'nome_es': categoria.nome_es,
+            })
+        nodo.update({
+            'slug': categoria.slug,
+            'livello': categoria.livello,
+            'num_sottocategorie': categoria.num_sottocategorie,
+            'num_cartelle': categoria.num_cartelle,
+            'sottocategorie': [],
+        })
+        nodi[categoria.id] = nodo
+        if categoria.parent_id:
+            nodi[categoria.parent_id]['sottocategorie'].append(nodo)
+        else:
+            radici.append(nodo)
+
+    albero = {'categorie': radici}
+
+    # 2. Cartelle ordinate di ogni nodo (e del catalogo root), serializzate in blocco
+    if includi_cartelle:
+        righe_root = list(
+            CatalogoCartella.objects.filter(catalogo=catalogo, cartella__is_active=True)
+            .select_related('cartella', 'cartella__file_da_filer')
+            .order_by('ordine', 'id')
+        )
+        righe_categorie = list(
+            CategoriaCartella.objects.filter(categoria_id__in=nodi.keys(), cartella__is_active=True)
+            .select_related('cartella', 'cartella__file_da_filer')
+            .order_by('categoria_id', 'ordine', 'id')
+        )
+
+        # Prefetch unico delle relazioni M2M usate dal serializer per tutte le cartelle
+        cartelle = [riga.cartella for riga in righe_root + righe_categorie]
+        prefetch_related_objects(cartelle, 'cataloghi', 'categorie')
+
+        serializer = CartelleSerializer(context=context or {})
+        albero['cartelle'] = [serializer.to_representation(riga.cartella) for riga in righe_root]
+        for nodo in nodi.values():
+            nodo['cartelle'] = []
+        for riga in righe_categorie:
+            nodi[riga.categoria_id]['cartelle'].append(serializer.to_representation(riga.cartella))
+
+    return albero
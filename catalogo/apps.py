@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CatalogoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalogo'
+
+    # Registra i receiver dei segnali (generazione thumbnail e marcatori di versione)
+    def ready(self):
+        from . import signals  # noqa: F401
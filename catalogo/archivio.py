@@ -0,0 +1,180 @@
+import logging
+import os
+import re
+import zipfile
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .media import CHUNK_SIZE
+from .models import Categoria, CatalogoCartella, CategoriaCartella
+
+logger = logging.getLogger(__name__)
+
+# Estensioni di file già compressi: salvati nello ZIP senza ricomprimerli (ZIP_STORED),
+# deflate costerebbe CPU per guadagnare pochi byte
+ESTENSIONI_COMPRESSE = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp4', '.mov', '.avi', '.wmv', '.flv', '.mkv', '.webm',
+    '.mp3', '.m4a', '.aac', '.ogg',
+    '.zip', '.rar', '.7z', '.gz', '.bz2', '.xz',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.pdf',
+}
+
+# Elenco dei file che non è stato possibile leggere, aggiunto in fondo all'archivio
+NOME_FILE_MANCANTI = 'FILE_MANCANTI.txt'
+
+# Caratteri non ammessi nei nomi di file e cartelle (Windows incluso)
+_CARATTERI_NON_VALIDI = re.compile(r'[\x00-\x1f<>:"/\\|?*]')
+
+
+def _nome_sicuro(nome):
+    nome = _CARATTERI_NON_VALIDI.sub('_', nome or '').strip().strip('.')
+    return nome or 'senza_nome'
+
+
+class _BufferScrittura:
+    """
+    Destinazione di ZipFile senza seek: i byte scritti restano qui finché il generatore non li consegna.
+    Senza seek() ZipFile scrive le dimensioni di ogni file in un data descriptor dopo i dati.
+    """
+    def __init__(self):
+        self.blocchi = []
+
+    def write(self, dati):
+        self.blocchi.append(bytes(dati))
+        return len(dati)
+
+    def flush(self):
+        pass
+
+    def svuota(self):
+        dati = b''.join(self.blocchi)
+        self.blocchi = []
+        return dati
+
+
+def _consegna(buffer):
+    dati = buffer.svuota()
+    if dati:
+        yield dati
+
+
+#Scrive nello ZIP le voci (percorso nell'archivio, cartella) leggendo i file a blocchi dallo storage
+#Ogni blocco letto è subito restituito compresso: in memoria c'è al più un blocco, niente archivio temporaneo
+def genera_zip(voci):
+    buffer = _BufferScrittura()
+    mancanti = []
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archivio:
+        for percorso, cartella in voci:
+            file = cartella.get_file()
+            try:
+                dimensione = file.storage.size(file.name)
+                sorgente = file.storage.open(file.name, 'rb')
+            except (OSError, ValueError):
+                logger.warning(f"ZIP: file della cartella {cartella.pk} non leggibile ({file.name})")
+                mancanti.append(f'{percorso} ({file.name})')
+                continue
+
+            info = zipfile.ZipInfo(percorso, date_time=timezone.localtime(cartella.updated_at).timetuple()[:6])
+            info.external_attr = 0o644 << 16
+            estensione = os.path.splitext(file.name)[1].lower()
+            info.compress_type = zipfile.ZIP_STORED if estensione in ESTENSIONI_COMPRESSE else zipfile.ZIP_DEFLATED
+            # Con la dimensione nota ZipFile passa da solo a ZIP64 per i file oltre 4 GB
+            info.file_size = dimensione
+
+            with sorgente, archivio.open(info, 'w') as destinazione:
+                for blocco in sorgente.chunks(CHUNK_SIZE):
+                    destinazione.write(blocco)
+                    yield from _consegna(buffer)
+            yield from _consegna(buffer)
+
+        if mancanti:
+            archivio.writestr(NOME_FILE_MANCANTI, '\n'.join(mancanti) + '\n')
+    # Directory centrale (ZIP64 se servono più di 65535 voci o offset oltre 4 GB), scritta alla chiusura
+    yield from _consegna(buffer)
+
+
+#Percorso nell'archivio: cartelle dai nomi del percorso completo, nome file dalla cartella
+#con l'estensione del file; i nomi ripetuti nella stessa cartella sono numerati
+def _percorso_zip(cartelle_zip, cartella, usati):
+    file = cartella.get_file()
+    estensione = os.path.splitext(file.name)[1].lower()
+    base = _nome_sicuro(cartella.nome_cartella or os.path.splitext(os.path.basename(file.name))[0])
+
+    percorso = f'{cartelle_zip}/{base}{estensione}'
+    contatore = 2
+    while percorso.lower() in usati:
+        percorso = f'{cartelle_zip}/{base} ({contatore}){estensione}'
+        contatore += 1
+    usati.add(percorso.lower())
+    return percorso
+
+
+#Voci di un elenco di righe ponte: cartelle attive con un file, nella cartella ZIP della loro categoria
+def _voci(righe, cartelle_zip, usati):
+    for riga in righe:
+        cartella_zip = cartelle_zip(riga)
+        if cartella_zip is None or riga.cartella.get_file() is None:
+            continue
+        yield _percorso_zip(cartella_zip, riga.cartella, usati), riga.cartella
+
+
+#Categorie attive del queryset con i percorsi ZIP, scartando (come l'albero) quelle sotto una categoria
+#disattivata; con percorso_radice contano solo gli antenati dentro quel sottoalbero
+def _cartelle_categorie(categorie, percorso_radice=''):
+    categorie = Categoria.carica_antenati(categorie.select_related('catalogo'))
+    return {
+        categoria.pk: '/'.join(_nome_sicuro(nome) for nome in categoria.get_path_parts())
+        for categoria in categorie
+        if all(
+            antenato.is_active or not antenato.percorso.startswith(percorso_radice)
+            for antenato in categoria._antenati_cache
+        )
+    }
+
+
+def _righe_categorie(filtro):
+    return CategoriaCartella.objects.filter(
+        filtro, cartella__is_active=True
+    ).select_related('cartella__file_da_filer').order_by(
+        'categoria__percorso', 'ordine', 'id'
+    ).iterator(chunk_size=500)
+
+
+#Voci dello ZIP di un catalogo: cartelle root nella cartella del catalogo, poi tutte le sue categorie attive
+def voci_catalogo(catalogo):
+    usati = set()
+    radice = _nome_sicuro(catalogo.nome_it)
+    righe_root = CatalogoCartella.objects.filter(
+        catalogo=catalogo, cartella__is_active=True
+    ).select_related('cartella__file_da_filer').order_by('ordine', 'id').iterator(chunk_size=500)
+    yield from _voci(righe_root, lambda riga: radice, usati)
+
+    cartelle_zip = _cartelle_categorie(Categoria.objects.filter(catalogo=catalogo, is_active=True))
+    righe = _righe_categorie(Q(categoria__catalogo=catalogo))
+    yield from _voci(righe, lambda riga: cartelle_zip.get(riga.categoria_id), usati)
+
+
+#Voci dello ZIP di una categoria e di tutto il suo sottoalbero
+def voci_categoria(categoria):
+    usati = set()
+    categoria.assicura_percorso()
+    cartelle_zip = _cartelle_categorie(
+        Categoria.objects.filter(Categoria.filtro_sottoalbero(categoria.percorso), is_active=True),
+        percorso_radice=categoria.percorso
+    )
+    righe = _righe_categorie(Categoria.filtro_sottoalbero(categoria.percorso, campo='categoria__percorso'))
+    yield from _voci(righe, lambda riga: cartelle_zip.get(riga.categoria_id), usati)
+
+
+#Risposta in streaming con l'archivio: nessuna Content-Length, i byte partono mentre i file vengono letti
+def risposta_zip(voci, nome_file):
+    response = StreamingHttpResponse(genera_zip(voci), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, f'{nome_file}.zip')
+    # Niente buffering del proxy (nginx) né cache: l'archivio va inoltrato man mano che viene scritto
+    response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'private, no-store'
+    return response
@@ -0,0 +1,43 @@
+from django.core.cache import caches
+
+# Alias della cache delle risposte API (vedi CACHES in config/settings.py)
+ALIAS_CACHE = 'catalogo'
+
+# Chiavi dei contatori hit/miss
+CHIAVE_HIT = 'statistiche:hit'
+CHIAVE_MISS = 'statistiche:miss'
+
+
+def cache_risposte():
+    return caches[ALIAS_CACHE]
+
+
+#Incrementa il contatore hit o miss (incr atomico sui backend che lo supportano, es. Redis)
+def registra_esito(hit):
+    cache = cache_risposte()
+    chiave = CHIAVE_HIT if hit else CHIAVE_MISS
+    try:
+        cache.incr(chiave)
+    except ValueError:
+        # Contatore non ancora presente (o rimosso dalla cache): riparte da 1
+        if not cache.add(chiave, 1, timeout=None):
+            cache.incr(chiave)
+
+
+#Contatori della cache delle risposte dall'avvio (o dall'ultimo azzeramento)
+def statistiche():
+    cache = cache_risposte()
+    valori = cache.get_many([CHIAVE_HIT, CHIAVE_MISS])
+    hit = valori.get(CHIAVE_HIT, 0)
+    miss = valori.get(CHIAVE_MISS, 0)
+    totale = hit + miss
+    return {
+        'hit': hit,
+        'miss': miss,
+        'richieste': totale,
+        'hit_ratio': round(hit / totale, 4) if totale else None,
+    }
+
+
+def azzera_statistiche():
+    cache_risposte().delete_many([CHIAVE_HIT, CHIAVE_MISS])
@@ -1,11 +1,48 @@
 import django_filters
-from django.db.models import Q
-from .models import Catalogo, Categoria
+from django.db.models import Exists, OuterRef
+from rest_framework.filters import OrderingFilter
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella
+from .ricerca import filtra_ricerca
+
+# Parametri di ricerca full-text (?q= ordinato per rilevanza, ?search= mantenuto per compatibilità)
+PARAMETRI_RICERCA = ('q', 'search')
+
+
+# Condizioni EXISTS sulle tabelle ponte, condivise con i filtri della changelist admin
+
+#Cartelle nella root del catalogo o in una delle sue categorie (incluse sottocategorie)
+def in_catalogo(catalogo_id):
+    nella_root = CatalogoCartella.objects.filter(cartella=OuterRef('pk'), catalogo_id=catalogo_id)
+    in_categoria = CategoriaCartella.objects.filter(cartella=OuterRef('pk'), categoria__catalogo_id=catalogo_id)
+    return Exists(nella_root) | Exists(in_categoria)
+
+
+#Cartelle della categoria
+def in_categoria(categoria_id):
+    return Exists(CategoriaCartella.objects.filter(cartella=OuterRef('pk'), categoria_id=categoria_id))
+
+
+#Cartelle di una qualsiasi categoria del sottoalbero con questo percorso (categoria compresa)
+def in_sottoalbero(percorso):
+    return Exists(CategoriaCartella.objects.filter(
+        Categoria.filtro_sottoalbero(percorso, 'categoria__percorso'), cartella=OuterRef('pk')
+    ))
+
+
+class RilevanzaOrderingFilter(OrderingFilter):
+    """OrderingFilter che con una ricerca attiva e senza ?ordering= lascia i risultati ordinati per rilevanza"""
+
+    def get_ordering(self, request, queryset, view):
+        ricerca = any(request.query_params.get(parametro) for parametro in PARAMETRI_RICERCA)
+        if ricerca and not request.query_params.get(self.ordering_param):
+            return None
+        return super().get_ordering(request, queryset, view)
 
 class CatalogoFilter(django_filters.FilterSet):
     """Filtri avanzati per Catalogo"""
     
-    # Ricerca testuale in tutti i campi nome multilingua
+    # Ricerca testuale in tutti i campi nome multilingua (indice full-text)
+    q = django_filters.CharFilter(method='search_filter')
     search = django_filters.CharFilter(method='search_filter')
     
     # Filtri esatti
@@ -26,20 +63,15 @@ class CatalogoFilter(django_filters.FilterSet):
         fields = ['is_active']
     
     def search_filter(self, queryset, name, value):
-        """Ricerca in tutti i campi nome multilingua"""
-        return queryset.filter(
-            Q(nome_it__icontains=value) |
-            Q(nome_en__icontains=value) |
-            Q(nome_fr__icontains=value) |
-            Q(nome_es__icontains=value) |
-            Q(slug__icontains=value)
-        )
+        """Ricerca full-text indicizzata in nomi multilingua e slug, ordinata per rilevanza"""
+        return filtra_ricerca(queryset, value)
 
 
 class CategoriaFilter(django_filters.FilterSet):
     """Filtri per Categoria"""
     
-    # Ricerca testuale in tutti i campi nome multilingua
+    # Ricerca testuale in tutti i campi nome multilingua (indice full-text)
+    q = django_filters.CharFilter(method='search_filter')
     search = django_filters.CharFilter(method='search_filter')
     
     # Filtro per catalogo
@@ -56,17 +88,78 @@ class CategoriaFilter(django_filters.FilterSet):
         fields = ['catalogo', 'parent', 'is_active']
     
     def search_filter(self, queryset, name, value):
-        """Ricerca in tutti i campi nome multilingua"""
-        return queryset.filter(
-            Q(nome_it__icontains=value) |
-            Q(nome_en__icontains=value) |
-            Q(nome_fr__icontains=value) |
-            Q(nome_es__icontains=value) |
-            Q(slug__icontains=value)
-        )
+        """Ricerca full-text indicizzata in nomi multilingua e slug, ordinata per rilevanza"""
+        return filtra_ricerca(queryset, value)
     
     def filter_has_parent(self, queryset, name, value):
         """Filtra categorie con/senza parent (top-level o sottocategorie)"""
         if value:
             return queryset.exclude(parent__isnull=True)
-        return queryset.filter(parent__isnull=True)
\ No newline at end of file
+        return queryset.filter(parent__isnull=True)
+
+
+class CartelleFilter(django_filters.FilterSet):
+    """
+    Filtri per Cartelle.
+
+    I filtri su catalogo e categoria usano sottoquery EXISTS sulle tabelle ponte invece di JOIN + distinct():
+    ogni cartella compare una sola volta e la ricerca resta sugli indici delle tabelle ponte.
+    """
+
+    # Ricerca testuale nel nome della cartella (indice full-text)
+    q = django_filters.CharFilter(method='search_filter')
+    search = django_filters.CharFilter(method='search_filter')
+
+    # Cartelle del catalogo: nella root o in una qualsiasi sua categoria
+    catalogo = django_filters.NumberFilter(method='filter_catalogo')
+
+    # Cartelle della categoria; con sottocategorie=true anche di tutte le categorie discendenti
+    categoria = django_filters.NumberFilter(method='filter_categoria')
+    sottocategorie = django_filters.BooleanFilter(method='filter_sottocategorie')
+
+    # Filtri esatti
+    tipo_file = django_filters.CharFilter(field_name='tipo_file')
+    is_active = django_filters.BooleanFilter(field_name='is_active')
+
+    # Filtri di range per data creazione e modifica
+    created_after = django_filters.DateFilter(
+        field_name='created_at',
+        lookup_expr='gte'
+    )
+    created_before = django_filters.DateFilter(
+        field_name='created_at',
+        lookup_expr='lte'
+    )
+    updated_after = django_filters.DateFilter(
+        field_name='updated_at',
+        lookup_expr='gte'
+    )
+    updated_before = django_filters.DateFilter(
+        field_name='updated_at',
+        lookup_expr='lte'
+    )
+
+    class Meta:
+        model = Cartelle
+        fields = ['tipo_file', 'is_active']
+
+    def search_filter(self, queryset, name, value):
+        """Ricerca full-text indicizzata nel nome della cartella, ordinata per rilevanza"""
+        return filtra_ricerca(queryset, value)
+
+    def filter_catalogo(self, queryset, name, value):
+        """Cartelle nella root del catalogo o in una delle sue categorie (incluse sottocategorie)"""
+        return queryset.filter(in_catalogo(value))
+
+    def filter_categoria(self, queryset, name, value):
+        """Cartelle della categoria (e dei discendenti se sottocategorie=true)"""
+        if not self.form.cleaned_data.get('sottocategorie'):
+            return queryset.filter(in_categoria(value))
+        percorso = Categoria.leggi_percorso(value)
+        if not percorso:
+            return queryset.none()
+        return queryset.filter(in_sottoalbero(percorso))
+
+    def filter_sottocategorie(self, queryset, name, value):
+        """Opzione letta da filter_categoria: da solo non filtra"""
+        return queryset
@@ -0,0 +1,124 @@
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from filer.models import File
+
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella
+from .sync import registra_modifiche
+from .thumbnails import accoda_thumbnail
+from .versioni import segna_modifica
+
+
+#Id unici nell'ordine di selezione, scartando valori non numerici
+def normalizza_file_ids(file_ids):
+    ids = []
+    for file_id in file_ids:
+        try:
+            file_id = int(file_id)
+        except (TypeError, ValueError):
+            continue
+        if file_id not in ids:
+            ids.append(file_id)
+    return ids
+
+
+# Estensioni per cui il selettore file mostra l'anteprima (come Cartelle.get_file_type)
+ESTENSIONI_IMMAGINE = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
+
+# Anteprima con le stesse opzioni dell'icona 64px dell'admin Filer: riusa la thumbnail già generata da Filer
+OPZIONI_ANTEPRIMA = {'size': (64, 64), 'crop': True, 'upscale': True}
+
+
+# File Filer per il selettore della pagina di import, dal più recente
+# cartella_filer: id della cartella Filer, 'nessuna' per i file senza cartella
+# solo_non_importati: esclude (anti-join NOT EXISTS) i file già usati da una Cartella
+def cerca_file_filer(testo='', cartella_filer=None, solo_non_importati=False):
+    files = File.objects.non_polymorphic().select_related('folder')
+    if testo:
+        files = files.filter(Q(original_filename__icontains=testo) | Q(name__icontains=testo))
+    if cartella_filer == 'nessuna':
+        files = files.filter(folder__isnull=True)
+    elif cartella_filer:
+        files = files.filter(folder_id=cartella_filer)
+    if solo_non_importati:
+        files = files.filter(~Exists(Cartelle.objects.filter(file_da_filer=OuterRef('pk'))))
+    return files.order_by('-uploaded_at', '-id')
+
+
+#Url dell'anteprima di un file Filer immagine (generata solo se Filer non l'ha già creata)
+def anteprima_file_filer(file_obj):
+    opzioni = dict(OPZIONI_ANTEPRIMA, subject_location=getattr(file_obj, 'subject_location', None))
+    return file_obj.file.get_thumbnail(opzioni).url
+
+
+#Primo valore di 'ordine' libero in coda alle righe già presenti
+def _prossimo_ordine(queryset):
+    massimo = queryset.aggregate(massimo=Max('ordine'))['massimo']
+    return 0 if massimo is None else massimo + 1
+
+
+# Importa file di Filer come Cartelle collegate al catalogo (root) e all'eventuale categoria
+# Tutto in una transazione: cartelle e righe ponte create con bulk_create, 'ordine' in coda all'esistente
+# Ritorna (cartelle create, errori) dove errori è una lista di (file_id, messaggio) per i file scartati
+def importa_file_filer(file_ids, catalogo_id, categoria_id=None, utente=None):
+    ids = normalizza_file_ids(file_ids)
+    files = File.objects.in_bulk(ids)
+    errori = [(file_id, 'File non trovato') for file_id in ids if file_id not in files]
+
+    cartelle = []
+    for file_id in ids:
+        file_obj = files.get(file_id)
+        if file_obj is None:
+            continue
+        cartella = Cartelle(
+            nome_cartella=Path(file_obj.name).stem,
+            file_da_filer=file_obj,
+            is_active=True,
+            created_by=utente,
+            updated_by=utente
+        )
+        cartella.calcola_campi_derivati()
+        cartelle.append(cartella)
+
+    with transaction.atomic():
+        # Lock su catalogo e categoria: import concorrenti sugli stessi non calcolano lo stesso 'ordine'
+        catalogo = Catalogo.objects.select_for_update().filter(pk=catalogo_id).first()
+        if catalogo is None:
+            raise ValueError('Catalogo non trovato')
+        categoria = None
+        if categoria_id:
+            categoria = Categoria.objects.select_for_update().filter(pk=categoria_id).first()
+            if categoria is None:
+                raise ValueError('Categoria non trovata')
+
+        if not cartelle:
+            return [], errori
+
+        cartelle = Cartelle.objects.bulk_create(cartelle)
+
+        inizio = _prossimo_ordine(CatalogoCartella.objects.filter(catalogo=catalogo))
+        righe = CatalogoCartella.objects.bulk_create([
+            CatalogoCartella(catalogo=catalogo, cartella=cartella, ordine=inizio + i)
+            for i, cartella in enumerate(cartelle)
+        ])
+
+        righe_categoria = []
+        if categoria is not None:
+            inizio = _prossimo_ordine(CategoriaCartella.objects.filter(categoria=categoria))
+            righe_categoria = CategoriaCartella.objects.bulk_create([
+                CategoriaCartella(categoria=categoria, cartella=cartella, ordine=inizio + i)
+                for i, cartella in enumerate(cartelle)
+            ])
+
+        # bulk_create non invia segnali: versioni, registro delle modifiche e thumbnail vanno aggiornati qui
+        # (nel registro le cartelle precedono le righe ponte che le collegano)
+        registra_modifiche(Cartelle, [cartella.pk for cartella in cartelle])
+        registra_modifiche(CatalogoCartella, [riga.pk for riga in righe])
+        registra_modifiche(CategoriaCartella, [riga.pk for riga in righe_categoria])
+        cataloghi = [catalogo.pk, categoria.catalogo_id if categoria else None]
+        immagini = [cartella.pk for cartella in cartelle if cartella.thumbnail_stato == Cartelle.THUMBNAIL_IN_ATTESA]
+        transaction.on_commit(lambda: segna_modifica(cataloghi))
+        transaction.on_commit(lambda: accoda_thumbnail(immagini), robust=True)
+
+    return cartelle, errori
@@ -0,0 +1,145 @@
+import logging
+import threading
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from .importazione import importa_file_filer, normalizza_file_ids
+from .models import JobImportazione
+
+logger = logging.getLogger(__name__)
+
+# Scheduler condiviso, avviato al primo job: un import alla volta per processo ('default')
+# e una ricostruzione di snapshot alla volta su un esecutore separato, che non aspetta gli import
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BackgroundScheduler(
+                executors={
+                    'default': ThreadPoolExecutor(max_workers=1),
+                    'snapshot': ThreadPoolExecutor(max_workers=1),
+                },
+                job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': None}
+            )
+            _scheduler.start()
+    return _scheduler
+
+
+#Crea il job per i file selezionati e lo mette in coda
+def crea_job(file_ids, catalogo_id, categoria_id=None, utente=None):
+    ids = normalizza_file_ids(file_ids)
+    job = JobImportazione.objects.create(
+        catalogo_id=catalogo_id,
+        categoria_id=categoria_id or None,
+        file_ids=ids,
+        totale=len(ids),
+        created_by=utente
+    )
+    accoda_job(job)
+    return job
+
+
+#Avvia il job in background dopo il commit (in sincrono se CATALOGO_IMPORT_ASYNC=False)
+def accoda_job(job):
+    if not settings.CATALOGO_IMPORT_ASYNC:
+        transaction.on_commit(lambda: esegui_job(job.pk))
+        return
+    transaction.on_commit(lambda: get_scheduler().add_job(
+        _esegui_in_background, args=[job.pk], id=f'import-{job.pk}', replace_existing=True
+    ))
+
+
+# Il thread dello scheduler apre connessioni proprie: vanno chiuse a fine job
+def _esegui_in_background(job_id):
+    close_old_connections()
+    try:
+        esegui_job(job_id)
+    finally:
+        close_old_connections()
+
+
+#Rimette in coda un job fallito o interrotto: riparte dal primo blocco non completato
+def riprendi_job(job):
+    if not job.is_riprendibile():
+        return False
+    aggiornati = JobImportazione.objects.filter(pk=job.pk, stato=job.stato).update(
+        stato=JobImportazione.STATO_IN_CODA,
+        messaggio='',
+        updated_at=timezone.now()
+    )
+    if aggiornati:
+        accoda_job(job)
+    return bool(aggiornati)
+
+
+# Ogni blocco è importato nella stessa transazione che salva l'avanzamento,
+# quindi dopo un errore il job riprende esattamente dal blocco non completato
+def esegui_job(job_id):
+    try:
+        # Prende in carico il job solo se è ancora in coda (evita due esecuzioni parallele)
+        presi = JobImportazione.objects.filter(pk=job_id, stato=JobImportazione.STATO_IN_CODA).update(
+            stato=JobImportazione.STATO_IN_CORSO,
+            avviato_il=timezone.now(),
+            updated_at=timezone.now()
+        )
+        if not presi:
+            return
+
+        job = JobImportazione.objects.select_related('created_by').get(pk=job_id)
+        while job.elaborati < job.totale:
+            blocco = job.file_ids[job.elaborati:job.elaborati + settings.CATALOGO_IMPORT_BATCH]
+            _importa_blocco(job, blocco)
+
+        job.stato = JobImportazione.STATO_COMPLETATO
+        job.completato_il = timezone.now()
+        job.messaggio = f'{job.importati} file importati su {job.totale}, {len(job.errori)} errori'
+        job.save(update_fields=['stato', 'completato_il', 'messaggio', 'updated_at'])
+    except Exception as e:
+        logger.exception(f"Job di importazione {job_id} interrotto")
+        JobImportazione.objects.filter(pk=job_id).update(
+            stato=JobImportazione.STATO_ERRORE,
+            messaggio=str(e),
+            updated_at=timezone.now()
+        )
+
+
+def _importa_blocco(job, blocco):
+    try:
+        with transaction.atomic():
+            cartelle, errori = importa_file_filer(blocco, job.catalogo_id, job.categoria_id, utente=job.created_by)
+            _salva_avanzamento(job, len(blocco), len(cartelle), errori)
+        return
+    except DatabaseError:
+        logger.warning(f"Job {job.pk}: blocco fallito, nuovo tentativo file per file", exc_info=True)
+        job.refresh_from_db()
+
+    # Il blocco è fallito per intero: riprova un file alla volta per isolare quelli che causano l'errore
+    with transaction.atomic():
+        importati = 0
+        errori = []
+        for file_id in blocco:
+            try:
+                with transaction.atomic():
+                    cartelle, errori_file = importa_file_filer(
+                        [file_id], job.catalogo_id, job.categoria_id, utente=job.created_by
+                    )
+            except DatabaseError as e:
+                cartelle, errori_file = [], [(file_id, str(e))]
+            importati += len(cartelle)
+            errori.extend(errori_file)
+        _salva_avanzamento(job, len(blocco), importati, errori)
+
+
+def _salva_avanzamento(job, elaborati, importati, errori):
+    job.elaborati += elaborati
+    job.importati += importati
+    job.errori = job.errori + [{'file_id': file_id, 'errore': errore} for file_id, errore in errori]
+    job.save(update_fields=['elaborati', 'importati', 'errori', 'updated_at'])
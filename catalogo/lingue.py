@@ -0,0 +1,35 @@
+from django.utils.translation.trans_real import parse_accept_lang_header
+from rest_framework.exceptions import ValidationError
+
+# Lingue dei campi nome_* (vedi get_nome di Catalogo e Categoria)
+LINGUE = ('it', 'en', 'fr', 'es')
+LINGUA_DEFAULT = 'it'
+
+# Valore di ?lang= che sceglie la lingua dall'header Accept-Language
+LINGUA_AUTO = 'auto'
+
+
+#Prima lingua supportata tra quelle di Accept-Language (in ordine di preferenza), italiano se nessuna
+def lingua_da_accept_language(header):
+    for codice, _ in parse_accept_lang_header(header or ''):
+        lingua = codice.split('-')[0]
+        if lingua in LINGUE:
+            return lingua
+    return LINGUA_DEFAULT
+
+
+#Lingua del payload compatto richiesta con ?lang=it|en|fr|es (o ?lang=auto per usare Accept-Language)
+#None senza ?lang=: la risposta mantiene i quattro campi nome_*
+def lingua_richiesta(request):
+    if not hasattr(request, '_lingua_catalogo'):
+        valore = request.query_params.get('lang', '').strip().lower()
+        if not valore:
+            lingua = None
+        elif valore == LINGUA_AUTO:
+            lingua = lingua_da_accept_language(request.META.get('HTTP_ACCEPT_LANGUAGE'))
+        elif valore in LINGUE:
+            lingua = valore
+        else:
+            raise ValidationError({'lang': f"Lingua non supportata: usa {', '.join(LINGUE)} oppure {LINGUA_AUTO}."})
+        request._lingua_catalogo = lingua
+    return request._lingua_catalogo
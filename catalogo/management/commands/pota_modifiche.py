@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from catalogo.sync import pota_modifiche
+
+
+class Command(BaseCommand):
+    """
+    Elimina dal registro delle modifiche le righe più vecchie del periodo mantenuto.
+    I client con un cursore precedente riceveranno 410 da /api/sync/ e riscaricheranno tutto.
+
+    Uso:
+        python manage.py pota_modifiche              → mantiene CATALOGO_SYNC_GIORNI giorni
+        python manage.py pota_modifiche --giorni 30  → mantiene 30 giorni
+    """
+    help = 'Elimina le righe vecchie del registro delle modifiche usato da /api/sync/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--giorni', type=int, default=None, help='Giorni da mantenere (default: CATALOGO_SYNC_GIORNI)')
+
+    def handle(self, *args, **options):
+        giorni = options['giorni'] if options['giorni'] is not None else settings.CATALOGO_SYNC_GIORNI
+        eliminate = pota_modifiche(timezone.now() - timedelta(days=giorni))
+        self.stdout.write(self.style.SUCCESS(f"Eliminate {eliminate} modifiche più vecchie di {giorni} giorni"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from catalogo.models import Catalogo
+from catalogo.snapshot import costruisci_snapshot, elimina_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Ricostruisce subito gli snapshot compressi dei cataloghi attivi (es. dopo un deploy o un restore).
+
+    Uso:
+        python manage.py rigenera_snapshot          → solo quelli non aggiornati
+        python manage.py rigenera_snapshot --forza  → tutti
+    """
+    help = 'Ricostruisce gli snapshot compressi dei cataloghi attivi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forza', action='store_true', help='Ricostruisce anche gli snapshot già aggiornati')
+
+    def handle(self, *args, **options):
+        for catalogo_id, is_active in Catalogo.objects.order_by('pk').values_list('pk', 'is_active'):
+            if not is_active:
+                elimina_snapshot(catalogo_id)
+                continue
+            if options['forza']:
+                elimina_snapshot(catalogo_id)
+            indice = costruisci_snapshot(catalogo_id)
+            if indice is not None:
+                self.stdout.write(f"Catalogo {catalogo_id}: v{indice['versione']}, {indice['dimensione']} byte")
+
+        self.stdout.write(self.style.SUCCESS('Snapshot aggiornati'))
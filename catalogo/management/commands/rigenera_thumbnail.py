@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from catalogo.models import Cartelle
+from catalogo.thumbnails import crea_pool
+from catalogo.worker import genera_thumbnail
+
+
+class Command(BaseCommand):
+    """
+    Rigenera le thumbnail di tutte le cartelle immagine in parallelo su più processi.
+
+    Uso:
+        python manage.py rigenera_thumbnail                 → genera solo le mancanti
+        python manage.py rigenera_thumbnail --forza         → rigenera tutte
+        python manage.py rigenera_thumbnail --workers 8     → numero di processi (default: tutte le CPU)
+    """
+    help = 'Rigenera in parallelo le thumbnail delle cartelle immagine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forza', action='store_true', help='Rigenera anche le thumbnail già esistenti')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Numero di processi (default: tutte le CPU)')
+
+    def handle(self, *args, **options):
+        forza = options['forza']
+        cartelle = Cartelle.objects.filter(tipo_file='Immagine')
+        if not forza:
+            cartelle = cartelle.exclude(thumbnail_stato=Cartelle.THUMBNAIL_PRONTA)
+        ids = list(cartelle.order_by('pk').values_list('pk', flat=True))
+        totale = len(ids)
+        self.stdout.write(f"Thumbnail da elaborare: {totale}")
+
+        generate = 0
+        with crea_pool(options['workers']) as pool:
+            risultati = pool.map(genera_thumbnail, ids, [forza] * totale, chunksize=20)
+            for numero, (cartella_id, ok) in enumerate(risultati, start=1):
+                if ok:
+                    generate += 1
+                else:
+                    self.stderr.write(f"Thumbnail non generata per cartella {cartella_id}")
+                if numero % 100 == 0:
+                    self.stdout.write(f"{numero}/{totale} elaborate")
+
+        self.stdout.write(self.style.SUCCESS(f"Completato: {generate}/{totale} thumbnail pronte"))
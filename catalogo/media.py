@@ -0,0 +1,222 @@
+import mimetypes
+import os
+import time
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date, parse_http_date_safe
+
+# Dimensione dei blocchi letti dal disco per le risposte parziali
+CHUNK_SIZE = 64 * 1024
+
+# URL base dei file protetti (vedi catalogo/urls.py)
+URL_PROTECTED_MEDIA = '/api/protected-media/'
+
+# Salt della firma HMAC degli URL firmati (separa queste firme da altri usi di SECRET_KEY)
+SALT_URL_FIRMATI = 'catalogo.media.url_firmato'
+
+# Mapping dell'encoding restituito da mimetypes (es. file .gz) come fa FileResponse
+ENCODING_CONTENT_TYPE = {
+    'bzip2': 'application/x-bzip',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+
+#Ritorna il percorso assoluto del file richiesto sotto MEDIA_ROOT, solleva 404 se fuori da MEDIA_ROOT o inesistente
+def risolvi_percorso(file_path):
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    full_path = os.path.abspath(os.path.join(media_root, file_path))
+
+    # Verifica che il percorso sia sicuro (previene path traversal attacks)
+    if os.path.commonpath([media_root, full_path]) != media_root:
+        raise Http404("Accesso negato")
+
+    # Verifica che il file esista
+    if not os.path.isfile(full_path):
+        raise Http404("File non trovato")
+
+    return full_path
+
+
+#Content-Type dall'estensione del file (default: binario generico)
+def get_content_type(full_path):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    if encoding:
+        return ENCODING_CONTENT_TYPE.get(encoding, 'application/octet-stream')
+    return content_type or 'application/octet-stream'
+
+
+#Validatore forte del file: cambia se cambia la dimensione o la data di modifica
+def get_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+#Interpreta l'header Range per un singolo intervallo di byte
+#Ritorna (inizio, fine) inclusivi, 'non_soddisfacibile', oppure None se va servito il file intero
+def parse_range(header, size):
+    if not header or not header.startswith('bytes='):
+        return None
+
+    intervalli = header[len('bytes='):].split(',')
+    # Più intervalli: si risponde con il file intero (consentito dalla RFC 9110)
+    if len(intervalli) != 1:
+        return None
+
+    inizio, separatore, fine = intervalli[0].strip().partition('-')
+    if not separatore:
+        return None
+    try:
+        if inizio == '':
+            # Suffisso: "bytes=-500" → ultimi 500 byte
+            lunghezza = int(fine)
+            if lunghezza <= 0:
+                return 'non_soddisfacibile'
+            return max(size - lunghezza, 0), size - 1
+
+        inizio = int(inizio)
+        fine = int(fine) if fine else size - 1
+    except ValueError:
+        return None
+
+    if inizio >= size:
+        return 'non_soddisfacibile'
+    if inizio > fine:
+        return None
+    return inizio, min(fine, size - 1)
+
+
+#Firma HMAC-SHA256 (chiave derivata da SECRET_KEY) di percorso + scadenza
+def firma_url(file_path, scadenza):
+    return salted_hmac(SALT_URL_FIRMATI, f"{file_path}:{scadenza}", algorithm='sha256').hexdigest()
+
+
+#Costruisce l'URL di un file protetto; con PROTECTED_MEDIA_SIGNED_URLS aggiunge scadenza e firma
+#La scadenza è arrotondata a finestre di PROTECTED_MEDIA_URL_TTL secondi: tutte le risposte della
+#stessa finestra contengono lo stesso URL, così browser e proxy possono tenerlo in cache
+#firma=False forza l'URL senza firma (es. snapshot su disco, che devono restare validi senza scadenza)
+def costruisci_url_protetto(file_path, request=None, firma=None):
+    url = f"{URL_PROTECTED_MEDIA}{file_path}"
+
+    if firma is None:
+        firma = settings.PROTECTED_MEDIA_SIGNED_URLS
+    if firma:
+        durata = settings.PROTECTED_MEDIA_URL_TTL
+        # Valido per almeno 'durata' secondi e al massimo il doppio
+        scadenza = (int(time.time()) // durata + 2) * durata
+        url += '?' + urlencode({'scadenza': scadenza, 'firma': firma_url(file_path, scadenza)})
+
+    return request.build_absolute_uri(url) if request else url
+
+
+#Verifica un URL firmato senza accedere al DB
+#Ritorna i secondi di validità rimanenti, oppure None se la firma è assente, errata o scaduta
+def verifica_url_firmato(file_path, parametri):
+    firma = parametri.get('firma')
+    try:
+        scadenza = int(parametri.get('scadenza', ''))
+    except ValueError:
+        return None
+
+    if not firma or not constant_time_compare(firma, firma_url(file_path, scadenza)):
+        return None
+
+    rimanenti = scadenza - int(time.time())
+    return rimanenti if rimanenti > 0 else None
+
+
+#Legge dal file solo l'intervallo richiesto, a blocchi, chiudendo il file alla fine
+def _leggi_intervallo(file, inizio, lunghezza):
+    try:
+        file.seek(inizio)
+        rimanenti = lunghezza
+        while rimanenti > 0:
+            blocco = file.read(min(CHUNK_SIZE, rimanenti))
+            if not blocco:
+                break
+            rimanenti -= len(blocco)
+            yield blocco
+    finally:
+        file.close()
+
+
+#Costruisce la risposta per un file protetto gestendo richieste condizionali e Range
+#- If-None-Match / If-Modified-Since → 304 senza leggere il file
+#- Range: bytes=X-Y (con eventuale If-Range) → 206 con il solo intervallo richiesto
+#- intervallo oltre la fine del file → 416
+#cache_control: 'private, no-cache' per le richieste autenticate, 'public, max-age=N' per gli URL firmati
+def risposta_file(request, full_path, cache_control='private, no-cache'):
+    stat = os.stat(full_path)
+    size = stat.st_size
+    etag = get_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+
+    def aggiungi_validatori(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = cache_control
+        return response
+
+    # Richieste condizionali (304 Not Modified / 412 Precondition Failed)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return aggiungi_validatori(response)
+
+    content_type = get_content_type(full_path)
+    intervallo = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    # If-Range: il Range vale solo se il client ha ancora la stessa versione del file
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if intervallo is not None and if_range:
+        data_if_range = parse_http_date_safe(if_range)
+        if if_range != etag and (data_if_range is None or data_if_range < int(stat.st_mtime)):
+            intervallo = None
+
+    if intervallo == 'non_soddisfacibile':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return aggiungi_validatori(response)
+
+    if intervallo is None:
+        return aggiungi_validatori(FileResponse(open(full_path, 'rb'), content_type=content_type))
+
+    inizio, fine = intervallo
+    lunghezza = fine - inizio + 1
+    response = StreamingHttpResponse(
+        _leggi_intervallo(open(full_path, 'rb'), inizio, lunghezza),
+        status=206,
+        content_type=content_type
+    )
+    response['Content-Length'] = str(lunghezza)
+    response['Content-Range'] = f'bytes {inizio}-{fine}/{size}'
+    return aggiungi_validatori(response)
+
+
+#Delega l'invio del file al web server (nginx X-Accel-Redirect / Apache X-Sendfile) se configurato
+#Django fa solo i controlli di autenticazione e percorso; Range, ETag e 304 li gestisce il web server
+#Ritorna None se PROTECTED_MEDIA_OFFLOAD è vuoto (il file viene servito da Python)
+#cache_control come in risposta_file: il web server inoltra l'header al client insieme al file
+def risposta_offload(full_path, cache_control='private, no-cache'):
+    modalita = settings.PROTECTED_MEDIA_OFFLOAD
+    if not modalita:
+        return None
+
+    response = HttpResponse(content_type=get_content_type(full_path))
+    response['Cache-Control'] = cache_control
+
+    if modalita == 'x-accel-redirect':
+        # Location interna di nginx che punta a MEDIA_ROOT (dichiarata "internal" nella config)
+        relativo = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = settings.PROTECTED_MEDIA_INTERNAL_URL.rstrip('/') + '/' + quote(relativo)
+    elif modalita == 'x-sendfile':
+        response['X-Sendfile'] = full_path
+    else:
+        raise ImproperlyConfigured(
+            f"PROTECTED_MEDIA_OFFLOAD non valido: '{modalita}' (usa '', 'x-accel-redirect' o 'x-sendfile')"
+        )
+    return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+# Calcola percorso e livello delle categorie esistenti partendo dalle radici
+def popola_percorsi(apps, schema_editor):
+    Categoria = apps.get_model('catalogo', 'Categoria')
+    parent_di = dict(Categoria.objects.values_list('id', 'parent_id'))
+    percorsi = {}
+
+    def calcola(pk):
+        if pk not in percorsi:
+            parent_id = parent_di[pk]
+            percorsi[pk] = f"{calcola(parent_id)}{pk}/" if parent_id else f"/{pk}/"
+        return percorsi[pk]
+
+    categorie = list(Categoria.objects.only('id', 'percorso', 'livello'))
+    for categoria in categorie:
+        categoria.percorso = calcola(categoria.pk)
+        categoria.livello = categoria.percorso.count('/') - 2
+    Categoria.objects.bulk_update(categorie, ['percorso', 'livello'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0002_alter_cartelle_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoria',
+            name='livello',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Livello'),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='percorso',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='Percorso Albero'),
+        ),
+        migrations.RunPython(popola_percorsi, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+# Le immagini esistenti restano in attesa finché non si lancia "python manage.py rigenera_thumbnail"
+def segna_immagini_in_attesa(apps, schema_editor):
+    Cartelle = apps.get_model('catalogo', 'Cartelle')
+    Cartelle.objects.filter(tipo_file='Immagine').update(thumbnail_stato='in_attesa')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0003_categoria_percorso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartelle',
+            name='thumbnail_altezza',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Altezza Thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='cartelle',
+            name='thumbnail_larghezza',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Larghezza Thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='cartelle',
+            name='thumbnail_percorso',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Percorso Thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='cartelle',
+            name='thumbnail_stato',
+            field=models.CharField(blank=True, choices=[('in_attesa', 'In attesa'), ('pronta', 'Pronta'), ('errore', 'Errore')], editable=False, max_length=10, verbose_name='Stato Thumbnail'),
+        ),
+        migrations.RunPython(segna_immagini_in_attesa, migrations.RunPython.noop),
+    ]
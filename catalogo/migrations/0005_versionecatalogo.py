@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0004_cartelle_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersioneCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chiave', models.CharField(max_length=50, unique=True, verbose_name='Chiave')),
+                ('versione', models.PositiveBigIntegerField(default=0, verbose_name='Versione')),
+                ('aggiornato_il', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Ultima Modifica')),
+            ],
+            options={
+                'verbose_name': 'Versione Catalogo',
+                'verbose_name_plural': 'Versioni Catalogo',
+            },
+        ),
+    ]
@@ -0,0 +1,130 @@
+from django.db import migrations
+
+
+# Indice full-text su nomi multilingua, slug e nome_cartella (FTS5 su SQLite, GIN tsvector su PostgreSQL)
+# SQL scritto qui per intero: la migration non deve cambiare se cambia catalogo.ricerca
+
+# SQLite: tabella FTS5 "external content" per ogni tabella e trigger che la tengono allineata
+SQL_SQLITE = [
+    # Cataloghi
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalogo_catalogo_fts
+       USING fts5(nome_it, nome_en, nome_fr, nome_es, slug, content='catalogo_catalogo',
+                  content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_catalogo_fts_ai AFTER INSERT ON catalogo_catalogo BEGIN
+           INSERT INTO catalogo_catalogo_fts(rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES (new.id, new.nome_it, new.nome_en, new.nome_fr, new.nome_es, new.slug);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_catalogo_fts_ad AFTER DELETE ON catalogo_catalogo BEGIN
+           INSERT INTO catalogo_catalogo_fts(catalogo_catalogo_fts, rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES ('delete', old.id, old.nome_it, old.nome_en, old.nome_fr, old.nome_es, old.slug);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_catalogo_fts_au
+       AFTER UPDATE OF nome_it, nome_en, nome_fr, nome_es, slug ON catalogo_catalogo BEGIN
+           INSERT INTO catalogo_catalogo_fts(catalogo_catalogo_fts, rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES ('delete', old.id, old.nome_it, old.nome_en, old.nome_fr, old.nome_es, old.slug);
+           INSERT INTO catalogo_catalogo_fts(rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES (new.id, new.nome_it, new.nome_en, new.nome_fr, new.nome_es, new.slug);
+       END""",
+    "INSERT INTO catalogo_catalogo_fts(catalogo_catalogo_fts) VALUES ('rebuild')",
+
+    # Categorie
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalogo_categoria_fts
+       USING fts5(nome_it, nome_en, nome_fr, nome_es, slug, content='catalogo_categoria',
+                  content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_categoria_fts_ai AFTER INSERT ON catalogo_categoria BEGIN
+           INSERT INTO catalogo_categoria_fts(rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES (new.id, new.nome_it, new.nome_en, new.nome_fr, new.nome_es, new.slug);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_categoria_fts_ad AFTER DELETE ON catalogo_categoria BEGIN
+           INSERT INTO catalogo_categoria_fts(catalogo_categoria_fts, rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES ('delete', old.id, old.nome_it, old.nome_en, old.nome_fr, old.nome_es, old.slug);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_categoria_fts_au
+       AFTER UPDATE OF nome_it, nome_en, nome_fr, nome_es, slug ON catalogo_categoria BEGIN
+           INSERT INTO catalogo_categoria_fts(catalogo_categoria_fts, rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES ('delete', old.id, old.nome_it, old.nome_en, old.nome_fr, old.nome_es, old.slug);
+           INSERT INTO catalogo_categoria_fts(rowid, nome_it, nome_en, nome_fr, nome_es, slug)
+           VALUES (new.id, new.nome_it, new.nome_en, new.nome_fr, new.nome_es, new.slug);
+       END""",
+    "INSERT INTO catalogo_categoria_fts(catalogo_categoria_fts) VALUES ('rebuild')",
+
+    # Cartelle
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalogo_cartelle_fts
+       USING fts5(nome_cartella, content='catalogo_cartelle',
+                  content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_cartelle_fts_ai AFTER INSERT ON catalogo_cartelle BEGIN
+           INSERT INTO catalogo_cartelle_fts(rowid, nome_cartella) VALUES (new.id, new.nome_cartella);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_cartelle_fts_ad AFTER DELETE ON catalogo_cartelle BEGIN
+           INSERT INTO catalogo_cartelle_fts(catalogo_cartelle_fts, rowid, nome_cartella)
+           VALUES ('delete', old.id, old.nome_cartella);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS catalogo_cartelle_fts_au AFTER UPDATE OF nome_cartella ON catalogo_cartelle BEGIN
+           INSERT INTO catalogo_cartelle_fts(catalogo_cartelle_fts, rowid, nome_cartella)
+           VALUES ('delete', old.id, old.nome_cartella);
+           INSERT INTO catalogo_cartelle_fts(rowid, nome_cartella) VALUES (new.id, new.nome_cartella);
+       END""",
+    "INSERT INTO catalogo_cartelle_fts(catalogo_cartelle_fts) VALUES ('rebuild')",
+]
+
+SQL_SQLITE_INVERSO = [
+    "DROP TRIGGER IF EXISTS catalogo_catalogo_fts_ai",
+    "DROP TRIGGER IF EXISTS catalogo_catalogo_fts_ad",
+    "DROP TRIGGER IF EXISTS catalogo_catalogo_fts_au",
+    "DROP TABLE IF EXISTS catalogo_catalogo_fts",
+    "DROP TRIGGER IF EXISTS catalogo_categoria_fts_ai",
+    "DROP TRIGGER IF EXISTS catalogo_categoria_fts_ad",
+    "DROP TRIGGER IF EXISTS catalogo_categoria_fts_au",
+    "DROP TABLE IF EXISTS catalogo_categoria_fts",
+    "DROP TRIGGER IF EXISTS catalogo_cartelle_fts_ai",
+    "DROP TRIGGER IF EXISTS catalogo_cartelle_fts_ad",
+    "DROP TRIGGER IF EXISTS catalogo_cartelle_fts_au",
+    "DROP TABLE IF EXISTS catalogo_cartelle_fts",
+]
+
+# PostgreSQL: indice GIN sul tsvector (configurazione 'simple', la stessa usata dalle query di ricerca)
+SQL_POSTGRESQL = [
+    """CREATE INDEX IF NOT EXISTS catalogo_catalogo_ricerca_idx ON catalogo_catalogo USING gin (
+           to_tsvector('simple', coalesce(nome_it, '') || ' ' || coalesce(nome_en, '') || ' ' ||
+                       coalesce(nome_fr, '') || ' ' || coalesce(nome_es, '') || ' ' || coalesce(slug, ''))
+       )""",
+    """CREATE INDEX IF NOT EXISTS catalogo_categoria_ricerca_idx ON catalogo_categoria USING gin (
+           to_tsvector('simple', coalesce(nome_it, '') || ' ' || coalesce(nome_en, '') || ' ' ||
+                       coalesce(nome_fr, '') || ' ' || coalesce(nome_es, '') || ' ' || coalesce(slug, ''))
+       )""",
+    """CREATE INDEX IF NOT EXISTS catalogo_cartelle_ricerca_idx ON catalogo_cartelle USING gin (
+           to_tsvector('simple', coalesce(nome_cartella, ''))
+       )""",
+]
+
+SQL_POSTGRESQL_INVERSO = [
+    "DROP INDEX IF EXISTS catalogo_catalogo_ricerca_idx",
+    "DROP INDEX IF EXISTS catalogo_categoria_ricerca_idx",
+    "DROP INDEX IF EXISTS catalogo_cartelle_ricerca_idx",
+]
+
+
+# Esegue le istruzioni del database in uso (altri database: nessun indice, ricerca per sottostringa)
+def _esegui(schema_editor, sqlite, postgresql):
+    istruzioni = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+    for sql in istruzioni:
+        schema_editor.execute(sql, params=None)
+
+
+def crea_indice(apps, schema_editor):
+    _esegui(schema_editor, SQL_SQLITE, SQL_POSTGRESQL)
+
+
+def elimina_indice(apps, schema_editor):
+    _esegui(schema_editor, SQL_SQLITE_INVERSO, SQL_POSTGRESQL_INVERSO)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0005_versionecatalogo'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice, elimina_indice),
+    ]
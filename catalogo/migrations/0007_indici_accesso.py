@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0006_indice_ricerca'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartelle',
+            index=models.Index(fields=['nome_cartella_sort', 'id'], name='cartelle_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartelle',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['nome_cartella_sort', 'id'], name='cartelle_attive_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartelle',
+            index=models.Index(fields=['tipo_file', 'nome_cartella_sort'], name='cartelle_tipo_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogocartella',
+            index=models.Index(fields=['catalogo', 'ordine', 'id'], name='catalogocartella_ordine_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='categoria',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['catalogo', 'livello', 'nome_it', 'id'], name='categoria_albero_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='categoriacartella',
+            index=models.Index(fields=['categoria', 'ordine', 'id'], name='categoriacartella_ordine_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0007_indici_accesso'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobImportazione',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stato', models.CharField(choices=[('in_coda', 'In coda'), ('in_corso', 'In corso'), ('completato', 'Completato'), ('errore', 'Errore')], db_index=True, default='in_coda', max_length=20, verbose_name='Stato')),
+                ('file_ids', models.JSONField(default=list, verbose_name='File da importare')),
+                ('totale', models.PositiveIntegerField(default=0, verbose_name='Totale file')),
+                ('elaborati', models.PositiveIntegerField(default=0, verbose_name='File elaborati')),
+                ('importati', models.PositiveIntegerField(default=0, verbose_name='File importati')),
+                ('errori', models.JSONField(blank=True, default=list, verbose_name='Errori')),
+                ('messaggio', models.TextField(blank=True, verbose_name='Messaggio')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Data Creazione')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Ultimo Avanzamento')),
+                ('avviato_il', models.DateTimeField(blank=True, null=True, verbose_name='Avviato il')),
+                ('completato_il', models.DateTimeField(blank=True, null=True, verbose_name='Completato il')),
+                ('catalogo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='job_importazione', to='catalogo.catalogo', verbose_name='Catalogo')),
+                ('categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='job_importazione', to='catalogo.categoria', verbose_name='Categoria')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='job_importazione_creati', to=settings.AUTH_USER_MODEL, verbose_name='Creato da')),
+            ],
+            options={
+                'verbose_name': 'Job di Importazione',
+                'verbose_name_plural': 'Job di Importazione',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0008_jobimportazione'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Modifica',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('modello', models.CharField(max_length=30, verbose_name='Modello')),
+                ('oggetto_id', models.PositiveBigIntegerField(verbose_name='Id oggetto')),
+                ('operazione', models.CharField(choices=[('salvato', 'Creato o modificato'), ('eliminato', 'Eliminato')], max_length=10, verbose_name='Operazione')),
+                ('creato_il', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Data')),
+            ],
+            options={
+                'verbose_name': 'Modifica',
+                'verbose_name_plural': 'Registro Modifiche',
+            },
+        ),
+    ]
@@ -0,0 +1,189 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.translation import get_language_from_request
+from rest_framework.response import Response
+
+from .cache import cache_risposte, registra_esito
+from .lingue import LINGUA_AUTO, lingua_richiesta
+from .versioni import CHIAVE_GLOBALE, leggi_versione
+
+
+class RispostaAnticipata(Exception):
+    """Interrompe la richiesta prima dell'esecuzione della view restituendo una risposta già pronta"""
+    def __init__(self, response):
+        self.response = response
+
+
+class RispostaCondizionaleMixin:
+    """
+    GET condizionali per i ViewSet del catalogo.
+
+    ETag e Last-Modified derivano dal marcatore di versione (VersioneCatalogo) restituito da
+    get_chiave_versione(): se il client invia If-None-Match / If-Modified-Since ancora validi
+    la risposta è un 304 ottenuto con una sola query, senza eseguire query e serializer della view.
+    """
+    azioni_condizionali = ('list', 'retrieve')
+
+    # Marcatore da controllare per la richiesta corrente (default: versione globale)
+    def get_chiave_versione(self):
+        return CHIAVE_GLOBALE
+
+    def get_validatori(self, request):
+        versione, aggiornato_il = leggi_versione(self.get_chiave_versione())
+        ultima_modifica = int(aggiornato_il.timestamp()) if aggiornato_il else None
+
+        # La stessa versione produce risposte diverse per URL, host (URL assoluti), formato richiesto
+        # e lingua del payload compatto (con ?lang=auto dipende da Accept-Language, non dall'URL)
+        seme = [
+            str(versione), request.get_full_path(), request.get_host(), request.META.get('HTTP_ACCEPT', ''),
+            str(lingua_richiesta(request))
+        ]
+
+        if settings.PROTECTED_MEDIA_SIGNED_URLS:
+            # Gli URL firmati cambiano a ogni finestra di validità anche senza modifiche ai dati
+            finestra = int(time.time()) // settings.PROTECTED_MEDIA_URL_TTL
+            seme.append(str(finestra))
+            ultima_modifica = max(ultima_modifica or 0, finestra * settings.PROTECTED_MEDIA_URL_TTL)
+
+        etag = '"%s"' % hashlib.md5('|'.join(seme).encode('utf-8'), usedforsecurity=False).hexdigest()
+        return etag, ultima_modifica
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        # Dopo autenticazione e permessi: 304 se il client ha già la versione aggiornata
+        self.validatori = None
+        if request.method in ('GET', 'HEAD') and self.action in self.azioni_condizionali:
+            self.validatori = self.get_validatori(request)
+            etag, ultima_modifica = self.validatori
+            response = get_conditional_response(request, etag=etag, last_modified=ultima_modifica)
+            if response is not None:
+                raise RispostaAnticipata(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, RispostaAnticipata):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        validatori = getattr(self, 'validatori', None)
+        if validatori and response.status_code in (200, 304):
+            etag, ultima_modifica = validatori
+            response['ETag'] = etag
+            if ultima_modifica is not None:
+                response['Last-Modified'] = http_date(ultima_modifica)
+            # Il client può tenere la risposta ma deve sempre rivalidarla (304 se nulla è cambiato)
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class CacheRispostaMixin(RispostaCondizionaleMixin):
+    """
+    Cache lato server delle risposte JSON delle GET condizionali (alias di cache 'catalogo').
+
+    La chiave parte dall'ETag (versione, URL completo, host, Accept) e aggiunge lingua e tipo di
+    utente: quando i segnali aggiornano la versione del catalogo le vecchie voci non vengono più
+    lette, senza bisogno di cancellarle. Un hit costa solo la query della versione.
+    L'header X-Cache indica HIT o MISS.
+    """
+
+    def get_classe_utente(self, request):
+        utente = request.user
+        if not utente or not utente.is_authenticated:
+            return 'anonimo'
+        return 'staff' if utente.is_staff else 'utente'
+
+    def get_chiave_cache(self, request):
+        etag, _ = self.validatori
+        seme = '|'.join([etag, get_language_from_request(request), self.get_classe_utente(request)])
+        return 'risposta:' + hashlib.md5(seme.encode('utf-8'), usedforsecurity=False).hexdigest()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.chiave_cache = None
+        if self.validatori and settings.CATALOGO_CACHE_RISPOSTE:
+            self.chiave_cache = self.get_chiave_cache(request)
+            salvata = cache_risposte().get(self.chiave_cache)
+            registra_esito(hit=salvata is not None)
+            if salvata is not None:
+                contenuto, content_type = salvata
+                response = HttpResponse(contenuto, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                raise RispostaAnticipata(response)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        # Salva solo le risposte 200 renderizzate in JSON (l'API navigabile contiene dati dell'utente)
+        if (
+            getattr(self, 'chiave_cache', None)
+            and isinstance(response, Response)
+            and response.status_code == 200
+            and response.accepted_renderer.format == 'json'
+        ):
+            response.render()
+            cache_risposte().set(self.chiave_cache, (response.content, response['Content-Type']))
+            response['X-Cache'] = 'MISS'
+        return response
+
+
+class LinguaMixin:
+    """
+    Payload compatti per i client che mostrano una sola lingua.
+
+    Con ?lang=it|en|fr|es (o ?lang=auto, lingua scelta da Accept-Language) la lingua finisce nel
+    context dei serializer, che restituiscono un solo 'nome' al posto dei quattro nome_*.
+    Solo in lettura: le scritture continuano a usare (e restituire) tutti i campi.
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method in ('GET', 'HEAD'):
+            context['lingua'] = lingua_richiesta(self.request)
+        return context
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.query_params.get('lang', '').strip().lower() == LINGUA_AUTO:
+            patch_vary_headers(response, ['Accept-Language'])
+        return response
+
+
+#Campi e espansioni richiesti con ?fields=a,b e ?expand=c (liste separate da virgola)
+def campi_richiesti(request):
+    def lista(parametro):
+        return [nome.strip() for nome in request.query_params.get(parametro, '').split(',') if nome.strip()]
+    return {'campi': lista('fields') or None, 'espansioni': lista('expand')}
+
+
+class CampiRichiestiMixin:
+    """
+    ?fields= e ?expand= sulle GET di lista e dettaglio (vedi CampiDinamiciMixin dei serializer).
+
+    Il queryset carica solo le relazioni dei campi effettivamente restituiti: una lista con
+    ?fields=id,nome_cartella non fa JOIN, prefetch né calcolo degli URL di file e thumbnail.
+    """
+    azioni_campi = ('list', 'retrieve')
+
+    def _usa_campi_richiesti(self):
+        return self.request.method in ('GET', 'HEAD') and self.action in self.azioni_campi
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self._usa_campi_richiesti():
+            context.update(campi_richiesti(self.request))
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self._usa_campi_richiesti():
+            queryset = self.get_serializer().ottimizza_queryset(queryset)
+        return queryset
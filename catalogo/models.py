@@ -1,4 +1,8 @@
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User #serve per sapere chi ha caricato cosa
 from django.utils.text import slugify
 import re #serve per manipolare i pattern di testo -> nel nostro caso per la funzionare che padda i numeri
@@ -32,6 +36,41 @@ def cartella_upload_path(instance, filename):
     # 6. Percorso finale
     return os.path.join('file_catalogo', new_filename)  # "file_catalogo/A31 Perle_20251012_143520.jpg"
 
+#metodo che assegna uno slug univoco a Catalogo/Categoria senza slug, usabile sia dal save che prima di un bulk_create
+#Per ogni slug base fa UNA sola query (tutti gli slug che iniziano con la base) e sceglie in memoria il primo suffisso libero
+#Esempio: base "accessori" con "accessori", "accessori-1" già presenti -> "accessori-2"
+
+def assegna_slug(istanze):
+    # Un solo insieme per tutte le basi: "varie-1" riservato per la base "varie" è occupato anche per la base "varie-1"
+    occupati = {}  # {slug: pk proprietario}
+    basi_lette = set()
+
+    for istanza in istanze:
+        if istanza.slug:
+            continue
+
+        base = istanza.get_slug_base()
+        if base not in basi_lette:
+            basi_lette.add(base)
+            for slug, pk in type(istanza).objects.filter(slug__startswith=base).values_list('slug', 'pk'):
+                occupati.setdefault(slug, pk)
+
+        # Uno slug è libero se non esiste o appartiene all'istanza stessa
+        def libero(slug):
+            return slug not in occupati or (istanza.pk is not None and occupati[slug] == istanza.pk)
+
+        slug = base
+        counter = 1
+        while not libero(slug):
+            slug = f"{base}-{counter}"
+            counter += 1
+
+        istanza.slug = slug
+        # Riserva lo slug per le istanze successive dello stesso blocco (non ancora salvate)
+        occupati[slug] = istanza.pk if istanza.pk is not None else object()
+
+    return istanze
+
 class Catalogo(models.Model):
     #Campi per il nome in 4 lingue diverse
     nome_it = models.CharField(
@@ -142,18 +181,15 @@ class Catalogo(models.Model):
         }
         return nomi.get(lingua, self.nome_it)
     
+    #Slug base generato dal nome in italiano
+    def get_slug_base(self):
+        return slugify(self.nome_it)
+
     #Ovverride del metodo save per creare in automatico lo slug in italiano
     def save(self, *args, **kwargs):
         if not self.slug: #se slug è vuoto
-            #prende il nome in italiano e genera slug
-            self.slug = slugify(self.nome_it)
-
-            #Gestione duplicati - inserisce numero
-            original_slug = self.slug
-            counter = 1
-            while Catalogo.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
+            #prende il nome in italiano e genera slug, gestendo i duplicati con un numero
+            assegna_slug([self])
         
         super().save(*args, **kwargs)
 
@@ -201,6 +237,25 @@ class Categoria(models.Model):
     verbose_name='Categoria Padre'
     )
 
+    #percorso materializzato dell'albero: id degli antenati seguiti dall'id della categoria -> Es: "/3/17/42/"
+    #mantenuto in automatico dal save, permette di leggere antenati e discendenti con una sola query indicizzata
+    #bulk_create non chiama save(): dopo un bulk_create va chiamato Categoria.ricalcola_percorsi(); le letture
+    #che trovano un percorso vuoto lo ricalcolano comunque al bisogno (vedi assicura_percorso)
+    percorso = models.CharField(
+        max_length=255,
+        editable=False,
+        blank=True,
+        db_index=True,
+        verbose_name='Percorso Albero'
+    )
+
+    #profondità nell'albero (0 = categoria di primo livello)
+    livello = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Livello'
+    )
+
     created_by = models.ForeignKey(
     User,
     on_delete=models.SET_NULL,
@@ -249,12 +304,54 @@ class Categoria(models.Model):
         verbose_name = 'Categoria'
         verbose_name_plural = 'Categorie'
         ordering = ['catalogo__nome_it', 'nome_it']
+        indexes = [
+            # Albero del catalogo: categorie attive per catalogo, ordinate per livello e nome
+            models.Index(
+                fields=['catalogo', 'livello', 'nome_it', 'id'],
+                condition=Q(is_active=True),
+                name='categoria_albero_idx'
+            ),
+        ]
 
     #Mostra il percorso completo della categoria
     def __str__(self):
-        if self.parent:
-            return f"{self.catalogo.nome_it} > {self.parent.nome_it} > {self.nome_it}"
-        return f"{self.catalogo.nome_it} > {self.nome_it}"
+        return self.get_full_path()
+
+    #Salva parent e catalogo letti dal DB per capire nel save se la categoria è stata spostata
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._parent_id_originale = instance.__dict__.get('parent_id')
+        instance._catalogo_id_originale = instance.__dict__.get('catalogo_id')
+        return instance
+
+    #Errore (messaggio) se il parent rende l'albero non valido, None se va bene: ciclo (parent uguale alla
+    #categoria o a una sua sottocategoria) o parent di un altro catalogo. Legge il parent dal DB (percorso aggiornato)
+    @classmethod
+    def errore_parent(cls, pk, parent_id, catalogo_id):
+        if not parent_id:
+            return None
+        parent = cls.objects.filter(pk=parent_id).values_list('percorso', 'catalogo_id').first()
+        if parent is None:
+            return None
+        parent_percorso, parent_catalogo_id = parent
+        if not parent_percorso:
+            # Parent creato con bulk_create: senza percorso il controllo dei cicli non vedrebbe gli antenati
+            cls.ricalcola_percorsi()
+            parent_percorso = cls.objects.filter(pk=parent_id).values_list('percorso', flat=True).first()
+        if pk and (parent_id == pk or f"/{pk}/" in parent_percorso):
+            return 'La categoria padre non può essere la categoria stessa o una sua sottocategoria.'
+        if parent_catalogo_id != catalogo_id:
+            return 'La categoria padre deve appartenere allo stesso catalogo.'
+        return None
+
+    def clean(self):
+        """Validazione: impedisce cicli nell'albero e parent di un altro catalogo"""
+        from django.core.exceptions import ValidationError
+
+        errore = Categoria.errore_parent(self.pk, self.parent_id, self.catalogo_id)
+        if errore:
+            raise ValidationError({'parent': errore})
     
     def get_nome(self, lingua='it'):
         nomi = {
@@ -265,45 +362,206 @@ class Categoria(models.Model):
         }
         return nomi.get(lingua, self.nome_it)
     
+    #Slug base dal nome italiano che mostri la gerarchia
+    def get_slug_base(self):
+        base_slug = slugify(self.nome_it)
+
+        # Se ha parent, lo mette come prefisso dello slug
+        if self.parent:
+            return f"{self.parent.slug}-{base_slug}"
+        return base_slug
+
     #Genera slug automaticamente da nome italiano che mostri la gerarchia
     def save(self, *args, **kwargs):
         if not self.slug: # Solo se slug è vuoto
-            # Genera slug base del nome italiano
-            base_slug = slugify(self.nome_it)
-            
-            # Se ha parent, lo mette come prefisso dello slug
-            if self.parent:
-                self.slug = f"{self.parent.slug}-{base_slug}"
-            else:
-                self.slug = base_slug
-            
-            # Gestisce duplicati
-            original_slug = self.slug
-            counter = 1
-            while Categoria.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
-        
-        super().save(*args, **kwargs)
+            # Genera slug e gestisce duplicati
+            assegna_slug([self])
 
-    # Ritorna path completo della categoria -Es: "Swarovski > Catena strass > Catena oro"
-    def get_full_path(self, lingua='it'):
+        # Il percorso va ricalcolato solo per categorie nuove o spostate (altro parent o altro catalogo)
+        catalogo_id_originale = getattr(self, '_catalogo_id_originale', self.catalogo_id)
+        spostata = (
+            not self.percorso
+            or self.parent_id != getattr(self, '_parent_id_originale', self.parent_id)
+            or self.catalogo_id != catalogo_id_originale
+        )
+
+        with transaction.atomic():
+            # Controllo anche qui e non solo in clean(): API e codice salvano senza full_clean()
+            if spostata:
+                errore = Categoria.errore_parent(self.pk, self.parent_id, self.catalogo_id)
+                if errore:
+                    from django.core.exceptions import ValidationError
+                    raise ValidationError({'parent': errore})
+            super().save(*args, **kwargs)
+            if spostata:
+                self._aggiorna_percorso(catalogo_id_originale)
+
+        self._parent_id_originale = self.parent_id
+        self._catalogo_id_originale = self.catalogo_id
+
+    #Ricalcola percorso e livello della categoria e, se è stata spostata, di tutto il suo sottoalbero
+    #Se la categoria è passata a un altro catalogo anche i discendenti lo seguono (stessa UPDATE)
+    def _aggiorna_percorso(self, catalogo_id_originale=None):
+        # Legge dal DB i valori aggiornati di categoria e parent (l'istanza in memoria potrebbe essere vecchia)
+        correnti = dict(
+            (pk, (percorso, livello))
+            for pk, percorso, livello in Categoria.objects.filter(
+                pk__in=[self.pk, self.parent_id]
+            ).values_list('pk', 'percorso', 'livello')
+        )
+        vecchio_percorso, vecchio_livello = correnti[self.pk]
+
+        if self.parent_id:
+            parent_percorso, parent_livello = correnti[self.parent_id]
+            if not parent_percorso:
+                # Parent creato con bulk_create: prima si calcola il suo percorso
+                parent = Categoria.objects.get(pk=self.parent_id)
+                parent._aggiorna_percorso()
+                parent_percorso, parent_livello = parent.percorso, parent.livello
+            nuovo_percorso = f"{parent_percorso}{self.pk}/"
+            nuovo_livello = parent_livello + 1
+        else:
+            nuovo_percorso = f"/{self.pk}/"
+            nuovo_livello = 0
+
+        cambio_catalogo = catalogo_id_originale is not None and catalogo_id_originale != self.catalogo_id
+        if nuovo_percorso != vecchio_percorso or cambio_catalogo:
+            Categoria.objects.filter(pk=self.pk).update(percorso=nuovo_percorso, livello=nuovo_livello)
+
+            # Sposta i discendenti sostituendo il prefisso del percorso con una sola UPDATE
+            if vecchio_percorso:
+                discendenti = Categoria.objects.filter(percorso__startswith=vecchio_percorso).exclude(pk=self.pk)
+                if cambio_catalogo:
+                    # update() non invia segnali: il registro della sincronizzazione va aggiornato qui
+                    from .sync import registra_modifiche
+                    registra_modifiche(Categoria, list(discendenti.values_list('pk', flat=True)))
+                discendenti.update(
+                    percorso=Concat(Value(nuovo_percorso), Substr('percorso', len(vecchio_percorso) + 1)),
+                    livello=F('livello') + (nuovo_livello - vecchio_livello),
+                    catalogo_id=self.catalogo_id
+                )
+
+        self.percorso = nuovo_percorso
+        self.livello = nuovo_livello
+        self.__dict__.pop('_antenati_cache', None)
+
+    #Ricalcola percorso e livello delle categorie rimaste col percorso vuoto (create con bulk_create), partendo
+    #dalle radici come la migrazione 0003. Ritorna quante categorie sono state aggiornate
+    @classmethod
+    def ricalcola_percorsi(cls):
+        vuote = list(cls.objects.filter(percorso='').only('id', 'percorso', 'livello'))
+        if not vuote:
+            return 0
+
+        parent_di = {}
+        percorsi = {}
+        for pk, parent_id, percorso in cls.objects.values_list('id', 'parent_id', 'percorso'):
+            parent_di[pk] = parent_id
+            if percorso:
+                percorsi[pk] = percorso
+
+        def calcola(pk):
+            if pk not in percorsi:
+                parent_id = parent_di[pk]
+                percorsi[pk] = f"{calcola(parent_id)}{pk}/" if parent_id else f"/{pk}/"
+            return percorsi[pk]
+
+        for categoria in vuote:
+            categoria.percorso = calcola(categoria.pk)
+            categoria.livello = categoria.percorso.count('/') - 2
+        cls.objects.bulk_update(vuote, ['percorso', 'livello'], batch_size=500)
+        return len(vuote)
+
+    #Se la categoria è stata creata con bulk_create calcola ora il suo percorso (e quello delle altre rimaste vuote)
+    def assicura_percorso(self):
+        if self.percorso or not self.pk:
+            return
+        Categoria.ricalcola_percorsi()
+        self.percorso, self.livello = Categoria.objects.filter(pk=self.pk).values_list('percorso', 'livello').get()
+        self.__dict__.pop('_antenati_cache', None)
+
+    #Percorso della categoria con questo id letto dal DB (ricalcolato se vuoto), None se la categoria non esiste
+    @classmethod
+    def leggi_percorso(cls, pk):
+        percorso = cls.objects.filter(pk=pk).values_list('percorso', flat=True).first()
+        if percorso == '':
+            cls.ricalcola_percorsi()
+            percorso = cls.objects.filter(pk=pk).values_list('percorso', flat=True).first()
+        return percorso
 
-        # Lista per raccogliere i nomi
-        path_parts = [self.get_nome(lingua)]
+    # Ritorna gli id degli antenati letti dal percorso, dalla radice al parent diretto
+    def get_antenati_ids(self):
+        self.assicura_percorso()
+        if not self.percorso:
+            return []
+        return [int(pk) for pk in self.percorso.strip('/').split('/')[:-1]]
 
-        # Risale la gerarchia parent
-        current = self.parent
-        while current:
-            path_parts.insert(0, current.get_nome(lingua))
-            current = current.parent
+    # Ritorna gli antenati dalla radice al parent diretto con una sola query
+    def get_antenati(self):
+        return Categoria.objects.filter(pk__in=self.get_antenati_ids()).order_by('livello')
+
+    # Filtro sul sottoalbero di un percorso: equivale a startswith ma come intervallo
+    # [percorso, percorso con l'ultimo '/' sostituito da '0'), utilizzabile dall'indice anche su SQLite
+    # Il percorso non può essere vuoto: va letto con leggi_percorso o dopo assicura_percorso
+    @staticmethod
+    def filtro_sottoalbero(percorso, campo='percorso'):
+        fine = percorso[:-1] + chr(ord(percorso[-1]) + 1)
+        return Q(**{f'{campo}__gte': percorso, f'{campo}__lt': fine})
+
+    # Ritorna tutto il sottoalbero della categoria con una sola query sull'indice del percorso
+    def get_discendenti(self, include_self=False):
+        self.assicura_percorso()
+        discendenti = Categoria.objects.filter(Categoria.filtro_sottoalbero(self.percorso))
+        if not include_self:
+            discendenti = discendenti.exclude(pk=self.pk)
+        return discendenti
+
+    #Precarica gli antenati di una lista di categorie con una sola query (per breadcrumb nelle liste)
+    @classmethod
+    def carica_antenati(cls, categorie):
+        categorie = list(categorie)
+
+        # Categorie create con bulk_create: percorsi ricalcolati una volta sola per tutta la lista
+        vuote = {categoria.pk: categoria for categoria in categorie if not categoria.percorso and categoria.pk}
+        if vuote:
+            cls.ricalcola_percorsi()
+            for pk, percorso, livello in cls.objects.filter(pk__in=vuote).values_list('pk', 'percorso', 'livello'):
+                vuote[pk].percorso, vuote[pk].livello = percorso, livello
+
+        ids = set()
+        for categoria in categorie:
+            ids.update(categoria.get_antenati_ids())
+
+        antenati = cls.objects.in_bulk(ids) if ids else {}
+        for categoria in categorie:
+            categoria._antenati_cache = [
+                antenati[pk] for pk in categoria.get_antenati_ids() if pk in antenati
+            ]
+        return categorie
+
+    # Ritorna i nomi dal catalogo alla categoria stessa -Es: ["Swarovski", "Catena strass", "Catena oro"]
+    def get_path_parts(self, lingua='it'):
+
+        # Antenati letti dal percorso materializzato (una query, oppure nessuna se già precaricati)
+        if not hasattr(self, '_antenati_cache'):
+            Categoria.carica_antenati([self])
+
+        # Lista per raccogliere i nomi, dalla radice alla categoria stessa
+        path_parts = [antenato.get_nome(lingua) for antenato in self._antenati_cache]
+        path_parts.append(self.get_nome(lingua))
         
         # Aggiungi catalogo all'inizio
         path_parts.insert(0, self.catalogo.get_nome(lingua))
-        
-        # Unisci con " > "
-        return " > ".join(path_parts)
+        return path_parts
+
+    # Ritorna path completo della categoria -Es: "Swarovski > Catena strass > Catena oro"
+    def get_full_path(self, lingua='it'):
+        return " > ".join(self.get_path_parts(lingua))
     
+#Padda i numeri a 10 cifre per l'ordinamento naturale dei nomi (A2 prima di A10)
+def pad_numbers(text):
+    return re.sub(r'(\d+)', lambda m: m.group(1).zfill(10), text)
+
 # Modello per gestire file del catalogo -> Supporta upload diretto o selezione da Filer
 class Cartelle(models.Model):
 
@@ -349,6 +607,46 @@ class Cartelle(models.Model):
         verbose_name='Tipo File'
     )
 
+    #Thumbnail API (300x300px, vedi catalogo.thumbnails) salvata dal worker dopo la generazione
+    #così la serializzazione delle liste non tocca né il disco né le tabelle di easy_thumbnails
+    #Si salva solo questa: le API non usano gli alias di THUMBNAIL_ALIASES (generarli tutti costerebbe
+    #lavoro al pool per immagini mai servite); un nuovo formato nelle API richiede i suoi campi qui
+    THUMBNAIL_IN_ATTESA = 'in_attesa'
+    THUMBNAIL_PRONTA = 'pronta'
+    THUMBNAIL_ERRORE = 'errore'
+    THUMBNAIL_STATI = [
+        (THUMBNAIL_IN_ATTESA, 'In attesa'),
+        (THUMBNAIL_PRONTA, 'Pronta'),
+        (THUMBNAIL_ERRORE, 'Errore'),
+    ]
+
+    thumbnail_stato = models.CharField(
+        max_length=10,
+        choices=THUMBNAIL_STATI,
+        editable=False,
+        blank=True,
+        verbose_name='Stato Thumbnail'
+    )
+
+    thumbnail_percorso = models.CharField(
+        max_length=255,
+        editable=False,
+        blank=True,
+        verbose_name='Percorso Thumbnail'
+    )
+
+    thumbnail_larghezza = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Larghezza Thumbnail'
+    )
+
+    thumbnail_altezza = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Altezza Thumbnail'
+    )
+
     is_active = models.BooleanField(
         default=True,
         verbose_name='Attivo'
@@ -386,10 +684,42 @@ class Cartelle(models.Model):
         verbose_name = 'Cartella'
         verbose_name_plural = 'Cartelle'
         ordering = [ 'nome_cartella_sort']
+        indexes = [
+            # Liste ordinate alfabeticamente e paginazione a cursore su (nome_cartella_sort, id)
+            models.Index(fields=['nome_cartella_sort', 'id'], name='cartelle_sort_idx'),
+            # Stesso ordinamento sulle sole cartelle attive (indice parziale, più piccolo)
+            models.Index(
+                fields=['nome_cartella_sort', 'id'],
+                condition=Q(is_active=True),
+                name='cartelle_attive_sort_idx'
+            ),
+            # Filtro per tipo file con ordinamento alfabetico
+            models.Index(fields=['tipo_file', 'nome_cartella_sort'], name='cartelle_tipo_sort_idx'),
+        ]
 
     # stampa il percorso completo della cartella   
     def __str__(self):
         return self.nome_cartella
+
+    #Salva il file letto dal DB per capire nel save se è stato sostituito
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._file_originale = instance.get_file_chiave()
+        return instance
+
+    #Identifica il file effettivo: (nome upload diretto, id file Filer)
+    def get_file_chiave(self):
+        file_upload = self.__dict__.get('file_upload_diretto')
+        nome_upload = getattr(file_upload, 'name', file_upload) or ''
+        return (nome_upload, self.__dict__.get('file_da_filer_id'))
+
+    #Azzera la thumbnail salvata: le immagini tornano in coda per la generazione
+    def invalida_thumbnail(self):
+        self.thumbnail_percorso = ''
+        self.thumbnail_larghezza = None
+        self.thumbnail_altezza = None
+        self.thumbnail_stato = self.THUMBNAIL_IN_ATTESA if self.tipo_file == 'Immagine' else ''
     
     def clean(self):
         """Validazione: obbliga un solo metodo di upload"""
@@ -443,8 +773,9 @@ class Cartelle(models.Model):
         else:
             return 'Altro'
         
-    #Metodo che ordina le cartelle in base al nome cartella sort e all'import re per paddare numeri
-    def save(self, *args, **kwargs):
+    #Calcola i campi derivati da nome e file (nome_cartella, nome_cartella_sort, tipo_file, stato thumbnail)
+    #Usato da save() e dagli import con bulk_create, che non chiamano save()
+    def calcola_campi_derivati(self):
         # Auto-popola nome_cartella se vuoto
         if not self.nome_cartella:
             # Accedi direttamente ai campi invece di usare get_file()
@@ -455,16 +786,23 @@ class Cartelle(models.Model):
         
         # Genera nome_cartella_sort paddando numeri
         if self.nome_cartella:  # Solo se nome_cartella esiste
-            def pad_numbers(text):
-                return re.sub(r'(\d+)', lambda m: m.group(1).zfill(10), text)
-            
             self.nome_cartella_sort = pad_numbers(self.nome_cartella.lower())
         
         # Determina tipo_file
         self.tipo_file = self.get_file_type()
+
+        # Nuovo file (o nuova cartella): la thumbnail salvata non è più valida
+        if self.get_file_chiave() != getattr(self, '_file_originale', None):
+            self.invalida_thumbnail()
+
+    #Metodo che ordina le cartelle in base al nome cartella sort e all'import re per paddare numeri
+    def save(self, *args, **kwargs):
+        self.calcola_campi_derivati()
         
         super().save(*args, **kwargs)
 
+        self._file_originale = self.get_file_chiave()
+
 # Ponte tra Catalogo e Cartelle (nuova tabella DB per relazione molti a molti)
 class CatalogoCartella(models.Model):
     catalogo = models.ForeignKey(
@@ -493,6 +831,10 @@ class CatalogoCartella(models.Model):
         verbose_name_plural = 'Catalogo-Cartelle'
         unique_together = [['catalogo', 'cartella']] #impedisce duplicati della stessa associazione
         ordering = ['catalogo', 'ordine']
+        indexes = [
+            # Cartelle root di un catalogo nell'ordine scelto (anche paginazione a cursore su ordine, id)
+            models.Index(fields=['catalogo', 'ordine', 'id'], name='catalogocartella_ordine_idx'),
+        ]
     
     #Mostra il collegamento tra catalogo e cartella
     def __str__(self):
@@ -526,7 +868,221 @@ class CategoriaCartella(models.Model):
         verbose_name_plural = 'Categoria-Cartelle'
         unique_together = [['categoria', 'cartella']]
         ordering = ['categoria', 'ordine']
+        indexes = [
+            # Cartelle di una categoria nell'ordine scelto
+            models.Index(fields=['categoria', 'ordine', 'id'], name='categoriacartella_ordine_idx'),
+        ]
     
     #Mostra il collegamento tra categoria e cartella
     def __str__(self):
-        return f"{self.categoria.nome_it} → {self.cartella.nome_cartella}"
\ No newline at end of file
+        return f"{self.categoria.nome_it} → {self.cartella.nome_cartella}"
+
+# Marcatore di versione per le richieste condizionali (ETag / Last-Modified) delle API
+# Una riga globale + una per catalogo, incrementate a ogni salvataggio/eliminazione di
+# Catalogo, Categoria, Cartelle e tabelle ponte (vedi catalogo.versioni e catalogo.signals)
+class VersioneCatalogo(models.Model):
+    # 'globale' oppure 'catalogo:<id>'
+    chiave = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name='Chiave'
+    )
+
+    versione = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Versione'
+    )
+
+    aggiornato_il = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Ultima Modifica'
+    )
+
+    class Meta:
+        verbose_name = 'Versione Catalogo'
+        verbose_name_plural = 'Versioni Catalogo'
+
+    def __str__(self):
+        return f"{self.chiave} v{self.versione}"
+
+# Registro delle modifiche per la sincronizzazione incrementale (GET /api/sync/, vedi catalogo.sync)
+# Una riga per ogni salvataggio o eliminazione: l'id autoincrementale è il cursore dei client
+class Modifica(models.Model):
+    OPERAZIONE_SALVATAGGIO = 'salvato'
+    OPERAZIONE_ELIMINAZIONE = 'eliminato'
+    OPERAZIONI = [
+        (OPERAZIONE_SALVATAGGIO, 'Creato o modificato'),
+        (OPERAZIONE_ELIMINAZIONE, 'Eliminato'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+
+    # Nome del modello in minuscolo (catalogo, categoria, cartelle, catalogocartella, categoriacartella)
+    modello = models.CharField(
+        max_length=30,
+        verbose_name='Modello'
+    )
+
+    oggetto_id = models.PositiveBigIntegerField(
+        verbose_name='Id oggetto'
+    )
+
+    operazione = models.CharField(
+        max_length=10,
+        choices=OPERAZIONI,
+        verbose_name='Operazione'
+    )
+
+    creato_il = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='Data'
+    )
+
+    class Meta:
+        verbose_name = 'Modifica'
+        verbose_name_plural = 'Registro Modifiche'
+
+    def __str__(self):
+        return f"#{self.pk} {self.modello}:{self.oggetto_id} {self.operazione}"
+
+# Job di import in background dei file Filer (vedi catalogo.jobs)
+# Il job avanza a blocchi: 'elaborati' è la posizione in file_ids da cui riprende dopo un errore
+class JobImportazione(models.Model):
+    STATO_IN_CODA = 'in_coda'
+    STATO_IN_CORSO = 'in_corso'
+    STATO_COMPLETATO = 'completato'
+    STATO_ERRORE = 'errore'
+    STATI = [
+        (STATO_IN_CODA, 'In coda'),
+        (STATO_IN_CORSO, 'In corso'),
+        (STATO_COMPLETATO, 'Completato'),
+        (STATO_ERRORE, 'Errore'),
+    ]
+
+    stato = models.CharField(
+        max_length=20,
+        choices=STATI,
+        default=STATO_IN_CODA,
+        db_index=True,
+        verbose_name='Stato'
+    )
+
+    catalogo = models.ForeignKey(
+        Catalogo,
+        on_delete=models.CASCADE,
+        related_name='job_importazione',
+        verbose_name='Catalogo'
+    )
+
+    categoria = models.ForeignKey(
+        Categoria,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='job_importazione',
+        verbose_name='Categoria'
+    )
+
+    # Id dei file Filer da importare, nell'ordine di selezione
+    file_ids = models.JSONField(
+        default=list,
+        verbose_name='File da importare'
+    )
+
+    totale = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Totale file'
+    )
+
+    elaborati = models.PositiveIntegerField(
+        default=0,
+        verbose_name='File elaborati'
+    )
+
+    importati = models.PositiveIntegerField(
+        default=0,
+        verbose_name='File importati'
+    )
+
+    # Errori sui singoli file: [{'file_id': 12, 'errore': 'File non trovato'}, ...]
+    errori = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Errori'
+    )
+
+    # Riepilogo finale o errore che ha interrotto il job
+    messaggio = models.TextField(
+        blank=True,
+        verbose_name='Messaggio'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Data Creazione'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Ultimo Avanzamento'
+    )
+
+    avviato_il = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Avviato il'
+    )
+
+    completato_il = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Completato il'
+    )
+
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='job_importazione_creati',
+        verbose_name='Creato da'
+    )
+
+    class Meta:
+        verbose_name = 'Job di Importazione'
+        verbose_name_plural = 'Job di Importazione'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import #{self.pk} → {self.catalogo.nome_it} ({self.get_stato_display()})"
+
+    def get_percentuale(self):
+        return round(self.elaborati * 100 / self.totale) if self.totale else 100
+
+    # Job in corso o in coda fermo da più di CATALOGO_IMPORT_TIMEOUT secondi: processo terminato a metà,
+    # oppure riavviato prima di eseguirlo (la coda dello scheduler è solo in memoria)
+    def is_interrotto(self):
+        limite = timezone.now() - timedelta(seconds=settings.CATALOGO_IMPORT_TIMEOUT)
+        return self.stato in (self.STATO_IN_CODA, self.STATO_IN_CORSO) and self.updated_at < limite
+
+    def is_riprendibile(self):
+        return self.stato == self.STATO_ERRORE or self.is_interrotto()
+
+    # Stato del job in formato JSON per la pagina di avanzamento
+    def get_riepilogo(self):
+        return {
+            'id': self.pk,
+            'stato': self.stato,
+            'stato_display': self.get_stato_display(),
+            'totale': self.totale,
+            'elaborati': self.elaborati,
+            'importati': self.importati,
+            'percentuale': self.get_percentuale(),
+            'num_errori': len(self.errori),
+            'errori': self.errori[-100:],  # Solo gli ultimi: la lista completa è nell'admin
+            'messaggio': self.messaggio,
+            'riprendibile': self.is_riprendibile(),
+            'avviato_il': self.avviato_il.isoformat() if self.avviato_il else None,
+            'completato_il': self.completato_il.isoformat() if self.completato_il else None,
+        }
@@ -0,0 +1,207 @@
+import base64
+import binascii
+import json
+
+from django.core.paginator import Page
+from django.db.models import Count, Q, Window
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginazione a cursore (keyset) su una coppia di campi (campo di ordinamento, id).
+
+    Invece di OFFSET + COUNT(*) filtra con WHERE (campo, id) > (ultimo valore, ultimo id),
+    quindi il costo di una pagina non cresce con la profondità e sfrutta l'indice sui due campi.
+    Solo navigazione in avanti: la risposta contiene 'next' (null sull'ultima pagina) e 'results'.
+    """
+    ordering = ('id',)  # (campo ordinamento, campo univoco di spareggio)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursore non valido.'
+    tipo_valore = str  # Tipo del valore del campo di ordinamento salvato nel cursore
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        campo, campo_id = self.ordering
+
+        queryset = queryset.order_by(*self.ordering)
+
+        # Riparte dalla posizione codificata nel cursore (ultima riga della pagina precedente)
+        posizione = self.decode_cursor(request)
+        if posizione is not None:
+            valore, pk = posizione
+            queryset = queryset.filter(
+                Q(**{f'{campo}__gt': valore}) | Q(**{campo: valore, f'{campo_id}__gt': pk})
+            )
+
+        # Legge una riga in più per sapere se esiste una pagina successiva senza COUNT(*)
+        risultati = list(queryset[:self.page_size + 1])
+        self.has_next = len(risultati) > self.page_size
+        risultati = risultati[:self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            ultimo = risultati[-1]
+            self.next_position = (getattr(ultimo, campo), getattr(ultimo, campo_id))
+
+        return risultati
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def decode_cursor(self, request):
+        cursore = request.query_params.get(self.cursor_query_param)
+        if not cursore:
+            return None
+        try:
+            posizione = json.loads(base64.urlsafe_b64decode(cursore.encode('ascii')))
+        except (TypeError, ValueError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Il cursore arriva dal client: struttura e tipi vanno controllati prima di finire nel filtro
+        if not isinstance(posizione, list) or len(posizione) != 2:
+            raise NotFound(self.invalid_cursor_message)
+        valore, pk = posizione
+        if not self._valido(valore, self.tipo_valore) or not self._valido(pk, int):
+            raise NotFound(self.invalid_cursor_message)
+        return valore, pk
+
+    @staticmethod
+    def _valido(valore, tipo):
+        # bool è una sottoclasse di int; gli interi fuori da 64 bit non entrano nelle colonne del DB
+        if isinstance(valore, bool) or not isinstance(valore, tipo):
+            return False
+        return tipo is not int or -2 ** 63 <= valore < 2 ** 63
+
+    def encode_cursor(self, posizione):
+        return base64.urlsafe_b64encode(json.dumps(list(posizione)).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+# Cartelle ordinate alfabeticamente (A1 < A2 < A10) come il Meta.ordering del modello
+class CartelleKeysetPagination(KeysetPagination):
+    ordering = ('nome_cartella_sort', 'id')
+
+
+# Righe delle tabelle ponte CatalogoCartella/CategoriaCartella ordinate per 'ordine'
+class OrdineKeysetPagination(KeysetPagination):
+    ordering = ('ordine', 'id')
+    tipo_valore = int
+
+
+class ConteggioFinestraPagination(PageNumberPagination):
+    """
+    Paginazione a numero di pagina che legge il totale nella stessa query della pagina.
+
+    Il totale arriva da COUNT(*) OVER () (calcolato prima del LIMIT) invece che da una
+    SELECT COUNT(*) separata; solo oltre l'ultima pagina serve una query di conteggio.
+    La risposta ha lo stesso formato di PageNumberPagination (count, next, previous, results).
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+
+        # 'last' richiede il totale prima di sapere quali righe leggere
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+
+        try:
+            numero = int(page_number)
+            if numero < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='Numero di pagina non valido.'
+            ))
+
+        inizio = (numero - 1) * page_size
+        righe = list(
+            queryset.annotate(totale_righe=Window(expression=Count('pk')))[inizio:inizio + page_size]
+        )
+
+        if righe:
+            paginator.count = righe[0].totale_righe
+        elif numero > 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='Pagina senza risultati.'
+            ))
+        else:
+            paginator.count = 0
+
+        self.page = Page(righe, numero, paginator)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+
+        return righe
+
+
+class PaginazioneSelezionabileMixin:
+    """
+    Permette al client di scegliere la paginazione per singola richiesta:
+    - default                → pagination_class del ViewSet (numero di pagina)
+    - ?paginazione=cursor    → cursor_pagination_class (keyset, consigliata per liste grandi)
+    """
+    paginazione_query_param = 'paginazione'
+    cursor_pagination_class = None
+
+    def usa_paginazione_cursor(self):
+        return (
+            self.request is not None
+            and self.request.query_params.get(self.paginazione_query_param) == 'cursor'
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.cursor_pagination_class is not None and self.usa_paginazione_cursor():
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -0,0 +1,114 @@
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Colonne indicizzate per tabella: tabella FTS5 "<tabella>_fts" su SQLite, indice GIN su PostgreSQL
+CAMPI_NOMI = ('nome_it', 'nome_en', 'nome_fr', 'nome_es', 'slug')
+CAMPI_RICERCA = {
+    'catalogo_catalogo': CAMPI_NOMI,
+    'catalogo_categoria': CAMPI_NOMI,
+    'catalogo_cartelle': ('nome_cartella',),
+}
+
+# Configurazione PostgreSQL senza stemming: i nomi sono in quattro lingue
+CONFIGURAZIONE_PG = 'simple'
+
+
+def _tabella_fts(tabella):
+    return f'{tabella}_fts'
+
+
+#Documento tsvector di una riga (stessa espressione nell'indice e nelle query, altrimenti l'indice non viene usato)
+def _documento_pg(campi):
+    colonne = " || ' ' || ".join(f"coalesce({campo}, '')" for campo in campi)
+    return f"to_tsvector('{CONFIGURAZIONE_PG}', {colonne})"
+
+
+#Tabella FTS5 "external content" (legge i testi dalla tabella del modello) e trigger che la tengono
+#allineata a ogni INSERT/UPDATE/DELETE, compresi bulk_create e update() che non inviano segnali
+#Stesso SQL della migration 0006, che lo riporta per intero: se cambia qui serve una nuova migration
+def _sql_sqlite(tabella, campi):
+    fts = _tabella_fts(tabella)
+    colonne = ', '.join(campi)
+    nuovi = ', '.join(f'new.{campo}' for campo in campi)
+    vecchi = ', '.join(f'old.{campo}' for campo in campi)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({colonne}, content='{tabella}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabella} BEGIN "
+        f"INSERT INTO {fts}(rowid, {colonne}) VALUES (new.id, {nuovi}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabella} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {colonne}) VALUES ('delete', old.id, {vecchi}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {colonne} ON {tabella} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {colonne}) VALUES ('delete', old.id, {vecchi}); "
+        f"INSERT INTO {fts}(rowid, {colonne}) VALUES (new.id, {nuovi}); END",
+    ]
+
+
+def _trigger_sqlite(tabella):
+    fts = _tabella_fts(tabella)
+    return {f'{fts}_ai', f'{fts}_ad', f'{fts}_au'}
+
+
+#SQLite ricrea la tabella (perdendo i trigger) quando una migration modifica una colonna:
+#dopo ogni migrate reinstalla i trigger mancanti e ricostruisce l'indice di quella tabella
+def ripara_indice_ricerca(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        esistenti = {riga[0] for riga in cursor.fetchall()}
+        for tabella, campi in CAMPI_RICERCA.items():
+            fts = _tabella_fts(tabella)
+            # Indice mai installato (o rimosso tornando indietro con le migration): nulla da riparare
+            if fts not in esistenti or tabella not in esistenti:
+                continue
+            if _trigger_sqlite(tabella) <= esistenti:
+                continue
+            for sql in _sql_sqlite(tabella, campi):
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+#Filtra il queryset sui termini cercati (tutti presenti, anche come prefisso) e lo ordina per rilevanza
+#Aggiunge l'annotazione 'rilevanza' (più alta = più pertinente)
+def filtra_ricerca(queryset, testo):
+    termini = re.findall(r'\w+', testo)
+    if not termini:
+        return queryset
+
+    tabella = queryset.model._meta.db_table
+    campi = CAMPI_RICERCA[tabella]
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'sqlite':
+        fts = _tabella_fts(tabella)
+        # "termine"* = prefisso; termini separati da spazio = AND
+        espressione = ' '.join(f'"{termine}"*' for termine in termini)
+        corrispondenti = RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (espressione,))
+        # bm25() è negativo e più basso per i risultati migliori
+        rilevanza = RawSQL(
+            f'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = "{tabella}"."id"',
+            (espressione,),
+            output_field=FloatField()
+        )
+    elif vendor == 'postgresql':
+        espressione = ' & '.join(f'{termine}:*' for termine in termini)
+        documento = _documento_pg(campi)
+        query = f"to_tsquery('{CONFIGURAZIONE_PG}', %s)"
+        corrispondenti = RawSQL(f"SELECT id FROM {tabella} WHERE {documento} @@ {query}", (espressione,))
+        rilevanza = RawSQL(
+            f'SELECT ts_rank({documento}, {query}) FROM {tabella} AS r WHERE r.id = "{tabella}"."id"',
+            (espressione,),
+            output_field=FloatField()
+        )
+    else:
+        # Altri database: ricerca per sottostringa senza indice né ordinamento per rilevanza
+        filtro = Q()
+        for campo in campi:
+            filtro |= Q(**{f'{campo}__icontains': testo})
+        return queryset.filter(filtro).annotate(rilevanza=Value(0.0, output_field=FloatField()))
+
+    return queryset.filter(pk__in=corrispondenti).annotate(rilevanza=rilevanza).order_by('-rilevanza', 'pk')
@@ -1,10 +1,94 @@
 from rest_framework import serializers
-from .models import Catalogo, Categoria, Cartelle
-from easy_thumbnails.files import get_thumbnailer
-from easy_thumbnails.exceptions import InvalidImageFormatError
+from rest_framework.exceptions import ValidationError
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella
+from .media import costruisci_url_protetto
+from .lingue import LINGUE, LINGUA_DEFAULT
+
+
+# Nome di un oggetto (Catalogo o Categoria) nella lingua del context, con il fallback di get_nome()
+class NomeLinguaField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return value.get_nome(self.context.get('lingua') or LINGUA_DEFAULT)
+
+
+# Con una lingua nel context (?lang=) i quattro campi nome_* diventano un solo 'nome'
+class NomeLinguaMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('lingua'):
+            return fields
+        compatti = {}
+        for nome, field in fields.items():
+            if nome == 'nome_it':
+                compatti['nome'] = NomeLinguaField(source='*')
+            elif nome not in {f'nome_{lingua}' for lingua in LINGUE}:
+                compatti[nome] = field
+        return compatti
+
+# Campi a richiesta dal context 'campi' e 'espansioni' (?fields= e ?expand=, vedi CampiRichiestiMixin):
+# ?fields=id,nome_it restituisce solo quei campi, ?expand=catalogo aggiunge la relazione serializzata per intero
+# (al posto dell'id se il campo esiste già). Vale solo per il serializer principale, non per quelli annidati
+class CampiDinamiciMixin:
+    # Nome espansione -> funzione che crea il serializer annidato
+    espansioni = {}
+    # Nome campo -> relazioni da caricare (select_related / prefetch_related) solo se il campo è nella risposta
+    select_related_campi = {}
+    prefetch_related_campi = {}
+
+    def _is_principale(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_principale():
+            return fields
+
+        espansioni = self.context.get('espansioni') or []
+        sconosciute = [nome for nome in espansioni if nome not in self.espansioni]
+        if sconosciute:
+            raise ValidationError({'expand': f"Espansioni non disponibili: {', '.join(sconosciute)}."})
+        for nome in espansioni:
+            fields[nome] = self.espansioni[nome]()
+
+        campi = self.context.get('campi')
+        if campi:
+            sconosciuti = [nome for nome in campi if nome not in fields]
+            if sconosciuti:
+                raise ValidationError({'fields': f"Campi non disponibili: {', '.join(sconosciuti)}."})
+            fields = {nome: field for nome, field in fields.items() if nome in campi or nome in espansioni}
+        return fields
+
+    #Aggiunge al queryset solo le relazioni usate dai campi restituiti
+    #prefisso: percorso del modello nel queryset (es. 'cartella__' partendo dalle righe ponte)
+    def ottimizza_queryset(self, queryset, prefisso=''):
+        select_related, prefetch_related = set(), set()
+        for nome in self.fields:
+            select_related.update(self.select_related_campi.get(nome, ()))
+            prefetch_related.update(self.prefetch_related_campi.get(nome, ()))
+        if select_related:
+            queryset = queryset.select_related(*(prefisso + relazione for relazione in sorted(select_related)))
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*(prefisso + relazione for relazione in sorted(prefetch_related)))
+        return queryset
+
 
 # Serializer per il modello Catalogo genera automaticamente i campi basandosi sul modello
-class CatalogoSerializer(serializers.ModelSerializer):
+class CatalogoSerializer(CampiDinamiciMixin, NomeLinguaMixin, serializers.ModelSerializer):
+    # ?expand=categorie: tutte le categorie del catalogo
+    espansioni = {
+        'categorie': lambda: CategoriaSerializer(many=True, read_only=True),
+    }
+    prefetch_related_campi = {
+        'categorie': ('categorie__catalogo', 'categorie__parent'),
+    }
+
     class Meta:
         model = Catalogo
 
@@ -26,12 +110,24 @@ class CatalogoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
 
 # Serializer per il modello Categoria genera automaticamente i campi basandosi sul modello
-class CategoriaSerializer(serializers.ModelSerializer):
+class CategoriaSerializer(CampiDinamiciMixin, NomeLinguaMixin, serializers.ModelSerializer):
+    # ?expand=catalogo / ?expand=parent: oggetti completi al posto degli id
+    espansioni = {
+        'catalogo': lambda: CatalogoSerializer(read_only=True),
+        'parent': lambda: CategoriaSerializer(read_only=True, allow_null=True),
+    }
+    select_related_campi = {
+        'catalogo': ('catalogo',),
+        'catalogo_nome': ('catalogo',),
+        'parent': ('parent__catalogo', 'parent__parent'),
+        'parent_nome': ('parent',),
+    }
+
     # Include nome catalogo e path completo
     # Campi da aggiungere alla risposta
     # Prende il nome del catalogo associato e del parent per una visualizzazione più leggibile
-    catalogo_nome = serializers.CharField(source='catalogo.nome_it', read_only=True)
-    parent_nome = serializers.CharField(source='parent.nome_it', read_only=True, allow_null=True)
+    catalogo_nome = NomeLinguaField(source='catalogo')
+    parent_nome = NomeLinguaField(source='parent', allow_null=True)
     
     class Meta:
         model = Categoria
@@ -53,14 +149,46 @@ class CategoriaSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at', 'catalogo_nome', 'parent_nome']
 
+    # Stessi controlli dell'albero di Categoria.clean(): il save() da API non passa da full_clean()
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        parent = attrs.get('parent', self.instance.parent if self.instance else None)
+        catalogo = attrs.get('catalogo', self.instance.catalogo if self.instance else None)
+        errore = Categoria.errore_parent(
+            self.instance.pk if self.instance else None,
+            parent.pk if parent else None,
+            catalogo.pk if catalogo else None
+        )
+        if errore:
+            raise ValidationError({'parent': errore})
+        return attrs
+
 # Serializer per il modello Cartelle genera automaticamente i campi basandosi sul modello
-class CartelleSerializer(serializers.ModelSerializer):
+class CartelleSerializer(CampiDinamiciMixin, serializers.ModelSerializer):
+    # ?expand=cataloghi / ?expand=categorie: oggetti completi oltre alle liste dei nomi
+    espansioni = {
+        'cataloghi': lambda: CatalogoSerializer(many=True, read_only=True),
+        'categorie': lambda: CategoriaSerializer(many=True, read_only=True),
+    }
+    # Con ?fields= senza file e liste di nomi non servono né JOIN sul file Filer né prefetch delle M2M
+    select_related_campi = {
+        'file_url': ('file_da_filer',),
+        'file_nome': ('file_da_filer',),
+    }
+    prefetch_related_campi = {
+        'cataloghi_list': ('cataloghi',),
+        'categorie_list': ('categorie',),
+        'cataloghi': ('cataloghi',),
+        'categorie': ('categorie__catalogo', 'categorie__parent'),
+    }
+
     # Include URL file e info relazioni many-to-many
     cataloghi_list = serializers.SerializerMethodField()
     categorie_list = serializers.SerializerMethodField()
     file_url = serializers.SerializerMethodField()
     file_nome = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    thumbnail_pending = serializers.SerializerMethodField()
 
     class Meta:
         model = Cartelle
@@ -72,39 +200,36 @@ class CartelleSerializer(serializers.ModelSerializer):
             'file_url',
             'file_nome',
             'thumbnail_url',  # Nuovo campo
+            'thumbnail_pending',  # True se la thumbnail è ancora in coda di generazione
+            'thumbnail_larghezza',
+            'thumbnail_altezza',
             'tipo_file',
             'is_active',
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'tipo_file', 'cataloghi_list', 'categorie_list', 'file_url', 'file_nome', 'thumbnail_url']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'tipo_file', 'cataloghi_list', 'categorie_list', 'file_url', 'file_nome', 'thumbnail_url', 'thumbnail_pending', 'thumbnail_larghezza', 'thumbnail_altezza']
     
     # Metodo per ottenere lista cataloghi
     def get_cataloghi_list(self, obj):
-        """Restituisce lista nomi cataloghi associati"""
-        return [catalogo.nome_it for catalogo in obj.cataloghi.all()]
+        """Restituisce lista nomi cataloghi associati (nella lingua di ?lang=, italiano di default)"""
+        lingua = self.context.get('lingua') or LINGUA_DEFAULT
+        return [catalogo.get_nome(lingua) for catalogo in obj.cataloghi.all()]
     
     # Metodo per ottenere lista categorie
     def get_categorie_list(self, obj):
-        """Restituisce lista nomi categorie associate"""
-        return [categoria.nome_it for categoria in obj.categorie.all()]
+        """Restituisce lista nomi categorie associate (nella lingua di ?lang=, italiano di default)"""
+        lingua = self.context.get('lingua') or LINGUA_DEFAULT
+        return [categoria.get_nome(lingua) for categoria in obj.categorie.all()]
     
     # Metodi per campi calcolati
     def get_file_url(self, obj):
-        """Restituisce URL del file protetto tramite autenticazione"""
+        """Restituisce URL del file protetto (firmato e a scadenza se PROTECTED_MEDIA_SIGNED_URLS)"""
         file = obj.get_file() # Usa il metodo del modello per ottenere il file
        
         if file:
-            request = self.context.get('request')
-            # Estrai il percorso relativo del file
-            file_path = file.name
-            
-            # Costruisci URL protetto
-            protected_url = f'/api/protected-media/{file_path}'
-            
-            if request:
-                return request.build_absolute_uri(protected_url)
-            return protected_url
+            # Costruisci URL protetto dal percorso relativo del file
+            return costruisci_url_protetto(file.name, self.context.get('request'), self.context.get('url_firmati'))
         return None
     
     # Metodo per ottenere il nome del file
@@ -114,52 +239,32 @@ class CartelleSerializer(serializers.ModelSerializer):
     # Metodo per ottenere l'URL della thumbnail
     def get_thumbnail_url(self, obj):
         """
-        Genera thumbnail (300x300px) per file immagine.
-        Supporta sia FilerFileField che FileField normale.
-        Restituisce None per file non-immagine (PDF, video, etc.)
+        Restituisce l'URL della thumbnail (300x300px) per file immagine.
+        Legge solo il percorso salvato sulla cartella dal worker (vedi catalogo.thumbnails):
+        nessun accesso al disco o alle tabelle di easy_thumbnails.
+        Restituisce None per file non-immagine (PDF, video, etc.) o se la thumbnail non è pronta.
         """
-        # Solo per immagini
-        if obj.tipo_file != 'Immagine':
-            return None
-        
-        try:
-            request = self.context.get('request')
-            
-            # File da Filer (FilerFileField)
-            if obj.file_da_filer:
-                # Verifica che sia un'immagine Filer
-                if hasattr(obj.file_da_filer, 'file') and obj.file_da_filer.file:
-                    # Usa easy_thumbnails integrato in filer
-                    thumbnailer = get_thumbnailer(obj.file_da_filer.file)
-                    thumbnail = thumbnailer.get_thumbnail({
-                        'size': (300, 300),
-                        'crop': True,
-                        'quality': 85,
-                        'upscale': False  # Non ingrandire immagini piccole
-                    })
-                    
-                    if thumbnail:
-                        protected_url = f'/api/protected-media/{thumbnail.name}'
-                        return request.build_absolute_uri(protected_url) if request else protected_url
-            
-            # File upload diretto (FileField)
-            elif obj.file_upload_diretto:
-                # Usa easy_thumbnails per FileField normale
-                thumbnailer = get_thumbnailer(obj.file_upload_diretto)
-                thumbnail = thumbnailer.get_thumbnail({
-                    'size': (300, 300),
-                    'crop': True,
-                    'quality': 85,
-                    'upscale': False
-                })
-                
-                # Verifica se la thumbnail è stata generata
-                if thumbnail:
-                    protected_url = f'/api/protected-media/{thumbnail.name}'
-                    return request.build_absolute_uri(protected_url) if request else protected_url
-        
-        except (InvalidImageFormatError, IOError, AttributeError, ValueError):
-            # File corrotto, formato non valido, o non è un'immagine
-            return None
-        
-        return None
\ No newline at end of file
+        if obj.thumbnail_stato == Cartelle.THUMBNAIL_PRONTA and obj.thumbnail_percorso:
+            return costruisci_url_protetto(
+                obj.thumbnail_percorso, self.context.get('request'), self.context.get('url_firmati')
+            )
+        return None
+
+    # Metodo che indica se la thumbnail di un'immagine è ancora in coda di generazione
+    def get_thumbnail_pending(self, obj):
+        return obj.thumbnail_stato == Cartelle.THUMBNAIL_IN_ATTESA
+
+
+# Righe delle tabelle ponte (posizione e ordine delle cartelle), usate dalla sincronizzazione incrementale
+class CatalogoCartellaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CatalogoCartella
+        fields = ['id', 'catalogo', 'cartella', 'ordine', 'created_at']
+        read_only_fields = fields
+
+
+class CategoriaCartellaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CategoriaCartella
+        fields = ['id', 'categoria', 'cartella', 'ordine', 'created_at']
+        read_only_fields = fields
@@ -0,0 +1,102 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete, post_migrate, pre_delete
+from django.dispatch import receiver
+
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella, Modifica
+from .ricerca import ripara_indice_ricerca
+from .sync import registra_modifiche
+from .thumbnails import accoda_thumbnail
+from .versioni import segna_modifica, cataloghi_collegati, cataloghi_di_cartelle
+
+
+# Dopo il salvataggio di una cartella immagine nuova o con file sostituito mette in coda la thumbnail
+# (on_commit: il worker deve trovare la riga già salvata nel DB; robust: un errore del pool
+# non trasforma in 500 un salvataggio già confermato, la cartella resta in attesa)
+@receiver(post_save, sender=Cartelle)
+def genera_thumbnail_cartella(sender, instance, raw=False, **kwargs):
+    if raw or instance.thumbnail_stato != Cartelle.THUMBNAIL_IN_ATTESA:
+        return
+    transaction.on_commit(lambda: accoda_thumbnail([instance.pk]), robust=True)
+
+
+# Marcatori di versione: ogni salvataggio/eliminazione incrementa la versione globale
+# e quella dei cataloghi coinvolti (usate per ETag / Last-Modified delle API)
+# Cataloghi e categorie cambiano anche la versione della struttura (scelte dei filtri admin)
+# e quella degli altri cataloghi che ne mostrano il nome tramite cartelle condivise
+
+# Prima dell'eliminazione: dopo, le righe ponte sono già cancellate e le cartelle condivise non si trovano più
+@receiver(pre_delete, sender=Catalogo)
+def collegati_catalogo(sender, instance, **kwargs):
+    instance._cataloghi_collegati = cataloghi_collegati(catalogo_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=Categoria)
+def collegati_categoria(sender, instance, **kwargs):
+    instance._cataloghi_collegati = cataloghi_collegati(categoria_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Catalogo)
+@receiver(post_delete, sender=Catalogo)
+def versione_catalogo(sender, instance, **kwargs):
+    collegati = getattr(instance, '_cataloghi_collegati', None)
+    if collegati is None:
+        collegati = cataloghi_collegati(catalogo_ids=[instance.pk])
+    segna_modifica([instance.pk, *collegati], struttura=True)
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def versione_categoria(sender, instance, **kwargs):
+    collegati = getattr(instance, '_cataloghi_collegati', None)
+    if collegati is None:
+        collegati = cataloghi_collegati(categoria_ids=[instance.pk])
+    # Se la categoria è stata spostata in un altro catalogo cambiano entrambi
+    segna_modifica(
+        [instance.catalogo_id, getattr(instance, '_catalogo_id_originale', None), *collegati], struttura=True
+    )
+
+
+@receiver(post_save, sender=Cartelle)
+@receiver(post_delete, sender=Cartelle)
+def versione_cartella(sender, instance, **kwargs):
+    # In eliminazione le righe ponte sono già state cancellate (e hanno aggiornato i loro cataloghi)
+    segna_modifica(cataloghi_di_cartelle([instance.pk]))
+
+
+@receiver(post_save, sender=CatalogoCartella)
+@receiver(post_delete, sender=CatalogoCartella)
+def versione_catalogo_cartella(sender, instance, **kwargs):
+    segna_modifica([instance.catalogo_id])
+
+
+@receiver(post_save, sender=CategoriaCartella)
+@receiver(post_delete, sender=CategoriaCartella)
+def versione_categoria_cartella(sender, instance, **kwargs):
+    catalogo_id = Categoria.objects.filter(pk=instance.categoria_id).values_list('catalogo_id', flat=True).first()
+    segna_modifica([catalogo_id])
+
+
+# Registro delle modifiche per la sincronizzazione incrementale dei client (GET /api/sync/)
+@receiver(post_save, sender=Catalogo)
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=Cartelle)
+@receiver(post_save, sender=CatalogoCartella)
+@receiver(post_save, sender=CategoriaCartella)
+def registra_salvataggio(sender, instance, **kwargs):
+    registra_modifiche(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Catalogo)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_delete, sender=Cartelle)
+@receiver(post_delete, sender=CatalogoCartella)
+@receiver(post_delete, sender=CategoriaCartella)
+def registra_eliminazione(sender, instance, **kwargs):
+    registra_modifiche(sender, [instance.pk], Modifica.OPERAZIONE_ELIMINAZIONE)
+
+
+# L'indice di ricerca è aggiornato da trigger SQL (vedi ricerca.py): dopo migrate verifica che ci siano ancora
+@receiver(post_migrate)
+def verifica_indice_ricerca(sender, using='default', **kwargs):
+    if sender.name == 'catalogo':
+        ripara_indice_ricerca(connections[using])
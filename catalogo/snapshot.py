@@ -0,0 +1,230 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    # Brotli è opzionale (pip install Brotli): senza, gli snapshot sono salvati solo in gzip
+    brotli = None
+
+from .albero import costruisci_albero
+from .models import Catalogo
+from .serializers import CatalogoSerializer
+from .worker import nel_worker
+from .versioni import chiave_catalogo, leggi_versione
+
+logger = logging.getLogger(__name__)
+
+# Codifiche salvate su disco (Content-Encoding -> estensione), in ordine di preferenza
+ESTENSIONI = {'br': 'br', 'gzip': 'gz'}
+
+
+def _percorso_indice(catalogo_id):
+    return os.path.join(settings.CATALOGO_SNAPSHOT_DIR, f'catalogo-{catalogo_id}.json')
+
+
+def _percorso_file(catalogo_id, versione, codifica):
+    return os.path.join(settings.CATALOGO_SNAPSHOT_DIR, f'catalogo-{catalogo_id}-v{versione}.json.{ESTENSIONI[codifica]}')
+
+
+#Scrittura atomica: chi legge trova sempre il file vecchio o quello nuovo completo, mai uno a metà
+def _scrivi(percorso, contenuto):
+    descrittore, temporaneo = tempfile.mkstemp(dir=os.path.dirname(percorso), suffix='.tmp')
+    try:
+        with os.fdopen(descrittore, 'wb') as file:
+            file.write(contenuto)
+        # mkstemp crea il file leggibile solo dal proprietario: serve leggibile anche dal web server (offload)
+        os.chmod(temporaneo, 0o644)
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        os.unlink(temporaneo)
+        raise
+
+
+#Indice dello snapshot su disco (versione, codifiche disponibili...), None se non ancora costruito
+def leggi_snapshot(catalogo_id):
+    try:
+        with open(_percorso_indice(catalogo_id), 'rb') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _elimina(percorso):
+    try:
+        os.unlink(percorso)
+    except FileNotFoundError:
+        pass
+
+
+def elimina_snapshot(catalogo_id):
+    _elimina(_percorso_indice(catalogo_id))
+    for percorso in glob.glob(os.path.join(settings.CATALOGO_SNAPSHOT_DIR, f'catalogo-{catalogo_id}-v*.json.*')):
+        _elimina(percorso)
+
+
+#Costruisce lo snapshot del catalogo attivo (albero, cartelle ordinate con URL di file e thumbnail, quattro lingue)
+#e lo salva compresso gzip e brotli; non fa nulla se quello su disco è già della versione corrente
+def costruisci_snapshot(catalogo_id):
+    # Versione letta prima dei dati: una modifica durante la costruzione lascia lo snapshot "vecchio" e lo fa ricostruire
+    versione, _ = leggi_versione(chiave_catalogo(catalogo_id))
+    catalogo = Catalogo.objects.filter(pk=catalogo_id, is_active=True).first()
+    if catalogo is None:
+        elimina_snapshot(catalogo_id)
+        return None
+
+    indice = leggi_snapshot(catalogo_id)
+    if indice is not None and indice['versione'] == versione:
+        return indice
+
+    # URL relativi e senza firma: lo snapshot resta valido finché il catalogo non cambia
+    contesto = {'url_firmati': False}
+    dati = {
+        'versione': versione,
+        'generato_il': timezone.now(),
+        'catalogo': CatalogoSerializer(catalogo, context=contesto).data,
+        **costruisci_albero(catalogo, includi_cartelle=True, context=contesto),
+    }
+    contenuto = json.dumps(dati, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    compressi = {'gzip': gzip.compress(contenuto, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressi['br'] = brotli.compress(contenuto, quality=11)
+
+    os.makedirs(settings.CATALOGO_SNAPSHOT_DIR, exist_ok=True)
+    for codifica, compresso in compressi.items():
+        _scrivi(_percorso_file(catalogo_id, versione, codifica), compresso)
+
+    indice = {
+        'versione': versione,
+        'generato_il': dati['generato_il'].isoformat(),
+        'dimensione': len(contenuto),
+        'codifiche': [codifica for codifica in ESTENSIONI if codifica in compressi],
+    }
+    # L'indice è scritto per ultimo: punta sempre a file già completi
+    _scrivi(_percorso_indice(catalogo_id), json.dumps(indice).encode('utf-8'))
+
+    # Versioni precedenti: le richieste che le stanno già leggendo hanno il file aperto
+    attuali = {_percorso_file(catalogo_id, versione, codifica) for codifica in compressi}
+    for percorso in glob.glob(os.path.join(settings.CATALOGO_SNAPSHOT_DIR, f'catalogo-{catalogo_id}-v*.json.*')):
+        if percorso not in attuali:
+            _elimina(percorso)
+
+    logger.info(f"Snapshot catalogo {catalogo_id} v{versione}: {len(contenuto)} byte")
+    return indice
+
+
+def _costruisci_in_background(catalogo_id):
+    close_old_connections()
+    try:
+        costruisci_snapshot(catalogo_id)
+    except Exception:
+        logger.exception(f"Snapshot del catalogo {catalogo_id} non ricostruito")
+    finally:
+        close_old_connections()
+
+
+#Programma la ricostruzione degli snapshot dei cataloghi indicati dopo CATALOGO_SNAPSHOT_RITARDO secondi:
+#le modifiche che arrivano nel frattempo (es. un import a blocchi) sono raccolte in un'unica ricostruzione
+def accoda_snapshot(catalogo_ids):
+    catalogo_ids = {pk for pk in catalogo_ids if pk}
+    if not catalogo_ids:
+        return
+
+    if not settings.CATALOGO_SNAPSHOT_ASYNC:
+        for catalogo_id in catalogo_ids:
+            costruisci_snapshot(catalogo_id)
+        return
+
+    # Nei processi del pool thumbnail non si avvia uno scheduler: la versione del catalogo è già cambiata
+    # e lo snapshot viene rimesso in coda dalla prossima richiesta che lo trova non aggiornato
+    if nel_worker():
+        return
+
+    from .jobs import get_scheduler
+    scheduler = get_scheduler()
+    esecuzione = timezone.now() + timedelta(seconds=settings.CATALOGO_SNAPSHOT_RITARDO)
+    for catalogo_id in catalogo_ids:
+        job_id = f'snapshot-{catalogo_id}'
+        # Già in programma: la ricostruzione leggerà anche questa modifica
+        if scheduler.get_job(job_id) is None:
+            scheduler.add_job(
+                _costruisci_in_background, 'date', run_date=esecuzione, args=[catalogo_id],
+                id=job_id, replace_existing=True, executor='snapshot'
+            )
+
+
+#Codifica da usare secondo Accept-Encoding tra quelle disponibili (br preferito), None se nessuna è accettata
+def scegli_codifica(accept_encoding, disponibili):
+    accettate = set()
+    for parte in accept_encoding.split(','):
+        nome, _, parametri = parte.strip().partition(';')
+        qualita = parametri.strip()
+        if qualita.startswith('q='):
+            try:
+                if float(qualita[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accettate.add(nome.strip().lower())
+    for codifica in disponibili:
+        if codifica in accettate or '*' in accettate:
+            return codifica
+    return None
+
+
+#Risposta di GET /api/cataloghi/{id}/snapshot/: lettura del file precompresso, 304 se l'ETag è ancora valido
+def risposta_snapshot(request, catalogo_id, tentativi=2):
+    versione, _ = leggi_versione(chiave_catalogo(catalogo_id))
+    indice = leggi_snapshot(catalogo_id)
+    if indice is None:
+        # Primo accesso (o snapshot cancellato): costruito subito nella richiesta
+        indice = costruisci_snapshot(catalogo_id)
+        if indice is None:
+            raise Http404('Catalogo non disponibile')
+    elif indice['versione'] != versione:
+        # Nel frattempo si serve la versione precedente
+        accoda_snapshot([catalogo_id])
+
+    codifica = scegli_codifica(request.META.get('HTTP_ACCEPT_ENCODING', ''), indice['codifiche'])
+    # ETag diverso per ogni codifica: sono rappresentazioni diverse dello stesso contenuto
+    etag = f'"snapshot-{catalogo_id}-{indice["versione"]}-{codifica or "identity"}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        percorso = _percorso_file(catalogo_id, indice['versione'], codifica or 'gzip')
+        try:
+            file = open(percorso, 'rb')
+        except FileNotFoundError:
+            # Sostituito da una ricostruzione tra la lettura dell'indice e l'apertura: si rilegge l'indice;
+            # se manca ancora l'indice punta a file cancellati e lo snapshot viene ricostruito
+            if tentativi == 0:
+                raise Http404('Snapshot non disponibile')
+            if tentativi == 1:
+                _elimina(_percorso_indice(catalogo_id))
+            return risposta_snapshot(request, catalogo_id, tentativi - 1)
+
+        if codifica:
+            response = FileResponse(file, content_type='application/json')
+            response['Content-Encoding'] = codifica
+        else:
+            # Client senza gzip né brotli (raro): contenuto decompresso
+            with file:
+                response = HttpResponse(gzip.decompress(file.read()), content_type='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
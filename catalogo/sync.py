@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella, Modifica, VersioneCatalogo
+from .serializers import (
+    CatalogoSerializer, CategoriaSerializer, CartelleSerializer,
+    CatalogoCartellaSerializer, CategoriaCartellaSerializer
+)
+
+# Modelli sincronizzati: chiave nella risposta -> (modello, queryset con le relazioni usate dal serializer, serializer)
+MODELLI_SYNC = {
+    'cataloghi': (Catalogo, Catalogo.objects.all(), CatalogoSerializer),
+    'categorie': (Categoria, Categoria.objects.select_related('catalogo', 'parent'), CategoriaSerializer),
+    'cartelle': (
+        Cartelle,
+        Cartelle.objects.select_related('file_da_filer').prefetch_related('cataloghi', 'categorie'),
+        CartelleSerializer
+    ),
+    'catalogo_cartelle': (CatalogoCartella, CatalogoCartella.objects.all(), CatalogoCartellaSerializer),
+    'categoria_cartelle': (CategoriaCartella, CategoriaCartella.objects.all(), CategoriaCartellaSerializer),
+}
+
+# Marcatore (in VersioneCatalogo) con l'id dell'ultima modifica eliminata dal registro:
+# un cursore precedente non può più essere servito e il client deve riscaricare tutto
+CHIAVE_POTATURA = 'sync:potatura'
+
+
+def _nome_modello(modello):
+    return modello._meta.model_name
+
+
+#Registra salvataggi o eliminazioni nel registro delle modifiche, nella stessa transazione dei dati:
+#se la transazione è annullata spariscono insieme, se è confermata la modifica è sempre nel registro
+#Da chiamare anche dopo bulk_create/update(), che non inviano segnali
+def registra_modifiche(modello, ids, operazione=Modifica.OPERAZIONE_SALVATAGGIO):
+    nome = _nome_modello(modello)
+    ids = [pk for pk in ids if pk]
+    if not ids:
+        return
+    Modifica.objects.bulk_create([
+        Modifica(modello=nome, oggetto_id=pk, operazione=operazione) for pk in ids
+    ])
+
+
+#Orizzonte di lettura del registro: righe inserite da meno di CATALOGO_SYNC_MARGINE secondi non sono servite.
+#Gli id sono assegnati all'inserimento ma le righe diventano visibili al commit: una transazione concorrente
+#può confermare un id più basso dopo uno più alto già visibile, e un cursore oltre quest'ultimo lo salterebbe
+def orizzonte_sync():
+    return timezone.now() - timedelta(seconds=settings.CATALOGO_SYNC_MARGINE)
+
+
+def cursore_corrente():
+    return Modifica.objects.filter(creato_il__lt=orizzonte_sync()).order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+
+
+def cursore_minimo():
+    return VersioneCatalogo.objects.filter(chiave=CHIAVE_POTATURA).values_list('versione', flat=True).first() or 0
+
+
+#Elimina le modifiche più vecchie della data indicata e ricorda fin dove è arrivata la potatura
+def pota_modifiche(prima_del):
+    ultimo = Modifica.objects.filter(creato_il__lt=prima_del).order_by('-id').values_list('id', flat=True).first()
+    if ultimo is None:
+        return 0
+    with transaction.atomic():
+        eliminate, _ = Modifica.objects.filter(id__lte=ultimo).delete()
+        VersioneCatalogo.objects.update_or_create(
+            chiave=CHIAVE_POTATURA,
+            defaults={'versione': ultimo, 'aggiornato_il': timezone.now()}
+        )
+    return eliminate
+
+
+#Modifiche successive al cursore, al massimo 'limite' righe del registro
+#Ritorna righe serializzate, tombstone, nuovo cursore e has_more: il costo dipende solo da quante righe sono cambiate
+#Le righe si fermano prima della prima più recente dell'orizzonte: il cursore non supera mai un id che
+#potrebbe avere davanti righe di transazioni non ancora confermate
+def leggi_modifiche(da_cursore, limite, contesto=None):
+    orizzonte = orizzonte_sync()
+    righe = []
+    altre = False
+    for riga in Modifica.objects.filter(id__gt=da_cursore).order_by('id').values_list(
+        'id', 'modello', 'operazione', 'oggetto_id', 'creato_il'
+    )[:limite + 1]:
+        if riga[4] >= orizzonte:
+            break
+        if len(righe) == limite:
+            altre = True
+            break
+        righe.append(riga[:4])
+
+    # Per ogni oggetto conta solo l'ultima operazione della pagina
+    ultime = {}
+    for _, modello, operazione, oggetto_id in righe:
+        ultime[(modello, oggetto_id)] = operazione
+
+    dati = {'cursor': righe[-1][0] if righe else da_cursore, 'has_more': altre}
+    eliminati = {}
+    for chiave, (modello, queryset, serializer_class) in MODELLI_SYNC.items():
+        nome = _nome_modello(modello)
+        salvati = [pk for (m, pk), op in ultime.items() if m == nome and op == Modifica.OPERAZIONE_SALVATAGGIO]
+        rimossi = [pk for (m, pk), op in ultime.items() if m == nome and op == Modifica.OPERAZIONE_ELIMINAZIONE]
+
+        oggetti = queryset.in_bulk(salvati) if salvati else {}
+        # Salvato e poi eliminato in una pagina successiva: qui è già una tombstone
+        rimossi += [pk for pk in salvati if pk not in oggetti]
+
+        dati[chiave] = serializer_class(
+            [oggetti[pk] for pk in sorted(oggetti)], many=True, context=contesto or {}
+        ).data
+        eliminati[chiave] = sorted(rimossi)
+
+    dati['eliminati'] = eliminati
+    return dati
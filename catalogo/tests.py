@@ -1,3 +1,1455 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from filer.models import File
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import thumbnails, worker
+from .albero import costruisci_albero
+from .cache import cache_risposte
+from .importazione import importa_file_filer
+from .jobs import crea_job, riprendi_job
+from .media import costruisci_url_protetto, firma_url, verifica_url_firmato
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella, CategoriaCartella, JobImportazione, Modifica, assegna_slug
+from .snapshot import accoda_snapshot, leggi_snapshot
+from .thumbnails import crea_pool
+from .sync import pota_modifiche
+from .versioni import chiave_catalogo, leggi_versione, segna_modifica
+
+# Riga di EXPLAIN QUERY PLAN che legge tutta la tabella senza indice ("SCAN tabella" / "SCAN TABLE tabella")
+# Non include "SCAN (subquery-N)", la lettura di un risultato intermedio già filtrato (es. funzioni finestra)
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?P<tabella>[^\s(]\S*)(?: AS \S+)?$')
+
+# Tabelle piccole per natura (poche righe, sempre lette per intero): una scansione qui non è una regressione
+TABELLE_PICCOLE = {'catalogo_catalogo', 'catalogo_versionecatalogo'}
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN è specifico di SQLite')
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False)
+class PianiQueryTest(TestCase):
+    """
+    Regressioni sugli indici: esegue EXPLAIN QUERY PLAN su tutte le query delle GET principali
+    e fallisce se una delle tabelle che crescono con i dati viene letta per intero.
+    """
+    NUM_CARTELLE = 400
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Bigiotteria')
+        Catalogo.objects.create(nome_it='Tessuti')
+
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Perle')
+        cls.figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Plastica')
+        Categoria.objects.create(catalogo=cls.catalogo, parent=cls.figlia, nome_it='Colorate')
+
+        # bulk_create: niente file reali né thumbnail, solo i campi usati da filtri e ordinamenti
+        tipi = ['Immagine', 'PDF', 'Video', 'Documento']
+        cartelle = Cartelle.objects.bulk_create([
+            Cartelle(
+                nome_cartella=f'A{i} Perle',
+                nome_cartella_sort=f'a{i:010d} perle',
+                tipo_file=tipi[i % len(tipi)],
+                is_active=i % 10 != 0
+            )
+            for i in range(cls.NUM_CARTELLE)
+        ])
+        CatalogoCartella.objects.bulk_create([
+            CatalogoCartella(catalogo=cls.catalogo, cartella=cartella, ordine=i)
+            for i, cartella in enumerate(cartelle[::2])
+        ])
+        CategoriaCartella.objects.bulk_create([
+            CategoriaCartella(categoria=cls.figlia, cartella=cartella, ordine=i)
+            for i, cartella in enumerate(cartelle[1::2])
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def piano(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [riga[-1] for riga in cursor.fetchall()]
+
+    def assertNessunFullScan(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200, url)
+
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            for riga in self.piano(query['sql']):
+                scan = FULL_SCAN.match(riga)
+                if scan and scan.group('tabella') not in TABELLE_PICCOLE:
+                    self.fail(f"{url}: full scan '{riga}' in\n{query['sql']}")
+
+    def test_liste_cartelle(self):
+        for url in [
+            '/api/cartelle/',
+            '/api/cartelle/?is_active=true',
+            '/api/cartelle/?tipo_file=PDF',
+            '/api/cartelle/?paginazione=cursor',
+            '/api/cartelle/?q=perle',
+        ]:
+            with self.subTest(url=url):
+                self.assertNessunFullScan(url)
+
+    def test_cartelle_filtrate_per_albero(self):
+        for url in [
+            f'/api/cartelle/?catalogo={self.catalogo.pk}',
+            f'/api/cartelle/?categoria={self.figlia.pk}',
+            f'/api/cartelle/?categoria={self.radice.pk}&sottocategorie=true',
+        ]:
+            with self.subTest(url=url):
+                self.assertNessunFullScan(url)
+
+    def test_cartelle_del_catalogo(self):
+        for url in [
+            f'/api/cataloghi/{self.catalogo.pk}/cartelle/',
+            f'/api/cataloghi/{self.catalogo.pk}/cartelle/?paginazione=cursor',
+        ]:
+            with self.subTest(url=url):
+                self.assertNessunFullScan(url)
+
+    def test_albero(self):
+        self.assertNessunFullScan(f'/api/cataloghi/{self.catalogo.pk}/albero/?cartelle=true')
+
+    def test_categorie_del_catalogo(self):
+        self.assertNessunFullScan(f'/api/categorie/?catalogo={self.catalogo.pk}')
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class AlberoCategorieTest(TestCase):
+    """Percorso materializzato delle categorie: spostamenti, cambio di catalogo e cicli"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user('editor', password='x')
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.altro_catalogo = Catalogo.objects.create(nome_it='Tessuti')
+
+    def setUp(self):
+        self.radice = Categoria.objects.create(catalogo=self.catalogo, nome_it='Vetro')
+        self.figlia = Categoria.objects.create(catalogo=self.catalogo, parent=self.radice, nome_it='Murano')
+        self.nipote = Categoria.objects.create(catalogo=self.catalogo, parent=self.figlia, nome_it='Rosse')
+        self.client = APIClient()
+        self.client.force_authenticate(self.utente)
+
+    def test_percorso_e_livello(self):
+        self.nipote.refresh_from_db()
+        self.assertEqual(self.nipote.percorso, f'/{self.radice.pk}/{self.figlia.pk}/{self.nipote.pk}/')
+        self.assertEqual(self.nipote.livello, 2)
+        self.assertEqual(self.nipote.get_antenati_ids(), [self.radice.pk, self.figlia.pk])
+
+    def test_spostamento_aggiorna_sottoalbero(self):
+        nuova_radice = Categoria.objects.create(catalogo=self.catalogo, nome_it='Legno')
+        self.figlia.parent = nuova_radice
+        self.figlia.save()
+
+        self.nipote.refresh_from_db()
+        self.assertEqual(self.nipote.percorso, f'/{nuova_radice.pk}/{self.figlia.pk}/{self.nipote.pk}/')
+        self.assertEqual(self.nipote.livello, 2)
+
+        # Figlia diventa radice: il sottoalbero risale di un livello
+        self.figlia.parent = None
+        self.figlia.save()
+        self.nipote.refresh_from_db()
+        self.assertEqual(self.nipote.percorso, f'/{self.figlia.pk}/{self.nipote.pk}/')
+        self.assertEqual(self.nipote.livello, 1)
+
+    def test_cambio_catalogo_sposta_discendenti(self):
+        self.radice.catalogo = self.altro_catalogo
+        self.radice.save()
+
+        self.assertEqual(
+            set(Categoria.objects.filter(pk__in=[self.figlia.pk, self.nipote.pk]).values_list('catalogo_id', flat=True)),
+            {self.altro_catalogo.pk}
+        )
+
+    def test_parent_di_altro_catalogo_rifiutato(self):
+        estranea = Categoria.objects.create(catalogo=self.altro_catalogo, nome_it='Lino')
+        response = self.client.patch(
+            f'/api/categorie/{self.figlia.pk}/', {'parent': estranea.pk}, format='json', HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.json())
+
+    def test_ciclo_da_api_rifiutato(self):
+        response = self.client.patch(
+            f'/api/categorie/{self.radice.pk}/', {'parent': self.nipote.pk}, format='json', HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.json())
+        self.radice.refresh_from_db()
+        self.assertIsNone(self.radice.parent_id)
+
+    def test_ciclo_da_save_rifiutato(self):
+        self.radice.parent = self.nipote
+        with self.assertRaises(ValidationError):
+            self.radice.save()
+        self.assertEqual(Categoria.objects.get(pk=self.radice.pk).percorso, f'/{self.radice.pk}/')
+
+    def test_figlia_di_categoria_da_bulk_create(self):
+        # bulk_create non calcola il percorso: lo calcola il save della prima sottocategoria
+        padre, = Categoria.objects.bulk_create([Categoria(catalogo=self.catalogo, nome_it='Ceramica', slug='ceramica')])
+        Categoria.objects.filter(pk=padre.pk).update(parent=self.radice)
+        figlia = Categoria.objects.create(catalogo=self.catalogo, parent_id=padre.pk, nome_it='Smaltata')
+
+        figlia.refresh_from_db()
+        self.assertEqual(figlia.percorso, f'/{self.radice.pk}/{padre.pk}/{figlia.pk}/')
+        self.assertEqual(figlia.livello, 2)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class CategorieBulkCreateTest(TestCase):
+    """Categorie create con bulk_create (percorso vuoto): ricalcola_percorsi e letture che lo calcolano al bisogno"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user('editor', password='x', is_staff=True, is_superuser=True)
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+
+    def setUp(self):
+        # Tre livelli creati senza save(): parent assegnati dopo, come farebbe uno script di import
+        self.radice, self.figlia, self.nipote = Categoria.objects.bulk_create([
+            Categoria(catalogo=self.catalogo, nome_it='Vetro', slug='vetro'),
+            Categoria(catalogo=self.catalogo, nome_it='Murano', slug='murano'),
+            Categoria(catalogo=self.catalogo, nome_it='Rosse', slug='rosse'),
+        ])
+        Categoria.objects.filter(pk=self.figlia.pk).update(parent=self.radice)
+        Categoria.objects.filter(pk=self.nipote.pk).update(parent=self.figlia)
+        self.cartella = Cartelle.objects.create(nome_cartella='A31')
+        CategoriaCartella.objects.create(categoria_id=self.nipote.pk, cartella=self.cartella, ordine=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.utente)
+
+    def test_ricalcola_percorsi(self):
+        self.assertEqual(Categoria.ricalcola_percorsi(), 3)
+        nipote = Categoria.objects.get(pk=self.nipote.pk)
+        self.assertEqual(nipote.percorso, f'/{self.radice.pk}/{self.figlia.pk}/{self.nipote.pk}/')
+        self.assertEqual(nipote.livello, 2)
+        self.assertEqual(Categoria.ricalcola_percorsi(), 0)
+
+    def test_discendenti_e_percorso_completo(self):
+        radice = Categoria.objects.get(pk=self.radice.pk)
+        self.assertEqual(set(radice.get_discendenti()), {self.figlia, self.nipote})
+
+        nipote = Categoria.objects.get(pk=self.nipote.pk)
+        self.assertEqual(nipote.get_full_path(), 'Perle > Vetro > Murano > Rosse')
+
+    def test_filtro_sottocategorie(self):
+        response = self.client.get(
+            f'/api/cartelle/?categoria={self.radice.pk}&sottocategorie=true', HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual([c['id'] for c in response.json()['results']], [self.cartella.pk])
+
+    def test_filtro_admin(self):
+        self.client.force_login(self.utente)
+        response = self.client.get(reverse('admin:catalogo_cartelle_changelist'), {'categoria': self.radice.pk})
+        self.assertEqual(list(response.context['cl'].result_list), [self.cartella])
+
+    def test_albero(self):
+        albero = costruisci_albero(self.catalogo, profondita=2)
+        radice, = albero['categorie']
+        self.assertEqual(radice['id'], self.radice.pk)
+        figlia, = radice['sottocategorie']
+        self.assertEqual((figlia['id'], figlia['livello']), (self.figlia.pk, 1))
+        self.assertEqual(figlia['sottocategorie'], [])
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=True, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class CacheRisposteTest(TestCase):
+    """Cache delle risposte: una modifica invalida anche i cataloghi che ne mostrano i nomi tramite cartelle condivise"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo_a = Catalogo.objects.create(nome_it='Perle')
+        cls.catalogo_b = Catalogo.objects.create(nome_it='Tessuti')
+        cls.categoria_a = Categoria.objects.create(catalogo=cls.catalogo_a, nome_it='Bianche')
+        cartella = Cartelle.objects.create(nome_cartella='Condivisa')
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_a, cartella=cartella, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_b, cartella=cartella, ordine=0)
+        CategoriaCartella.objects.create(categoria=cls.categoria_a, cartella=cartella, ordine=0)
+
+    def setUp(self):
+        cache_risposte().clear()
+        self.client = APIClient()
+        self.url = f'/api/cataloghi/{self.catalogo_b.pk}/cartelle/'
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_hit_dopo_la_prima_richiesta(self):
+        self.assertEqual(self.get(self.url)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(self.url)['X-Cache'], 'HIT')
+
+    def test_rename_catalogo_condiviso_invalida_altro_catalogo(self):
+        self.get(self.url)
+        self.catalogo_a.nome_it = 'Perle nuove'
+        self.catalogo_a.save()
+
+        response = self.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['cataloghi_list'], ['Perle nuove', 'Tessuti'])
+
+    def test_rename_categoria_condivisa_invalida_altro_catalogo(self):
+        self.get(self.url)
+        self.categoria_a.nome_it = 'Avorio'
+        self.categoria_a.save()
+
+        response = self.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['categorie_list'], ['Avorio'])
+
+    def test_filtro_categoria_di_altro_catalogo_usa_versione_globale(self):
+        # Con ?categoria= la lista dipende anche dal catalogo della categoria: una sua modifica invalida
+        url = f'/api/cartelle/?catalogo={self.catalogo_b.pk}'
+        url_categoria = f'{url}&categoria={self.categoria_a.pk}&sottocategorie=true'
+        self.get(url)
+        self.get(url_categoria)
+        segna_modifica([self.catalogo_a.pk], struttura=True)
+
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self.get(url_categoria)['X-Cache'], 'MISS')
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class RisposteCondizionaliTest(TestCase):
+    """ETag / 304 delle GET: cambiano con la versione del catalogo, anche per modifiche fatte in altri cataloghi"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo_a = Catalogo.objects.create(nome_it='Perle')
+        cls.catalogo_b = Catalogo.objects.create(nome_it='Tessuti')
+        cartella = Cartelle.objects.create(nome_cartella='Condivisa')
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_a, cartella=cartella, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_b, cartella=cartella, ordine=0)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.urls = [
+            f'/api/cataloghi/{self.catalogo_b.pk}/cartelle/',
+            f'/api/cataloghi/{self.catalogo_b.pk}/albero/?cartelle=true',
+        ]
+
+    def get(self, url, etag=None):
+        extra = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, HTTP_ACCEPT='application/json', **extra)
+
+    def test_304_se_nulla_cambia(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.get(url)['ETag']
+                response = self.get(url, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+    def test_rename_altro_catalogo_cambia_etag(self):
+        etag = {url: self.get(url)['ETag'] for url in self.urls}
+        self.catalogo_a.nome_it = 'Perle nuove'
+        self.catalogo_a.save()
+
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.get(url, etag[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag[url])
+                self.assertIn('Perle nuove', response.content.decode())
+
+
+@override_settings(CATALOGO_SYNC_MARGINE=0, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class SincronizzazioneTest(TestCase):
+    """Registro delle modifiche e GET /api/sync/: righe modificate, tombstone, cursore e orizzonte"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def sync(self, since=None):
+        url = '/api/sync/' if since is None else f'/api/sync/?since={since}'
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_salvataggi_e_tombstone(self):
+        cursore = self.sync().json()['cursor']
+        catalogo = Catalogo.objects.create(nome_it='Perle')
+
+        dati = self.sync(cursore).json()
+        self.assertEqual([riga['id'] for riga in dati['cataloghi']], [catalogo.pk])
+        self.assertFalse(dati['has_more'])
+
+        pk = catalogo.pk
+        catalogo.delete()
+        dati = self.sync(dati['cursor']).json()
+        self.assertEqual(dati['cataloghi'], [])
+        self.assertEqual(dati['eliminati']['cataloghi'], [pk])
+
+    def test_transazione_annullata_non_lascia_righe(self):
+        prima = Modifica.objects.count()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Catalogo.objects.create(nome_it='Annullato')
+            self.assertGreater(Modifica.objects.count(), prima)
+            raise RuntimeError
+        self.assertEqual(Modifica.objects.count(), prima)
+
+    def test_righe_recenti_oltre_orizzonte(self):
+        cursore = self.sync().json()['cursor']
+        Catalogo.objects.create(nome_it='Appena creato')
+        with self.settings(CATALOGO_SYNC_MARGINE=60):
+            dati = self.sync(cursore).json()
+            self.assertEqual(self.sync().json()['cursor'], cursore)
+        self.assertEqual(dati['cursor'], cursore)
+        self.assertEqual(dati['cataloghi'], [])
+        self.assertFalse(dati['has_more'])
+
+    def test_paginazione_e_cursore_potato(self):
+        cursore = self.sync().json()['cursor']
+        for i in range(3):
+            Catalogo.objects.create(nome_it=f'Catalogo {i}')
+        dati = self.client.get(f'/api/sync/?since={cursore}&limit=2').json()
+        self.assertTrue(dati['has_more'])
+        self.assertEqual(len(dati['cataloghi']), 2)
+        resto = self.sync(dati['cursor']).json()
+        self.assertEqual(len(resto['cataloghi']), 1)
+
+        pota_modifiche(timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.sync(cursore).status_code, 410)
+        self.assertEqual(self.sync('abc').status_code, 400)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False)
+class PaginazioneCursoreTest(TestCase):
+    """Paginazione keyset: pagine complete e senza duplicati anche con valori ripetuti, cursori non validi → 404"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        # Nomi ripetuti: l'ordine tra pagine dipende dallo spareggio su id
+        cls.cartelle = Cartelle.objects.bulk_create([
+            Cartelle(nome_cartella=f'A{i % 3}', nome_cartella_sort=f'a{i % 3:010d}') for i in range(10)
+        ])
+        CatalogoCartella.objects.bulk_create([
+            CatalogoCartella(catalogo=cls.catalogo, cartella=cartella, ordine=i // 2)
+            for i, cartella in enumerate(cls.cartelle)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def scorri(self, url):
+        ids = []
+        while url:
+            dati = self.client.get(url, HTTP_ACCEPT='application/json').json()
+            ids += [riga['id'] for riga in dati['results']]
+            url = dati['next']
+        return ids
+
+    def test_ordine_stabile_tra_le_pagine(self):
+        attesi = [c.pk for c in sorted(self.cartelle, key=lambda c: (c.nome_cartella_sort, c.pk))]
+        self.assertEqual(self.scorri('/api/cartelle/?paginazione=cursor&page_size=3'), attesi)
+
+        attesi = [c.pk for c in self.cartelle]  # ordine = i // 2, poi id
+        url = f'/api/cataloghi/{self.catalogo.pk}/cartelle/?paginazione=cursor&page_size=3'
+        self.assertEqual(self.scorri(url), attesi)
+
+    def test_cursore_non_valido(self):
+        def codifica(valore):
+            return base64.urlsafe_b64encode(json.dumps(valore).encode()).decode()
+
+        cursori = [
+            'non-base64!', codifica({'a': 1}), codifica(['a']), codifica(['a', '1']),
+            codifica(['a', [1]]), codifica([['a'], 1]), codifica(['a', True]), codifica(['a', 2 ** 70]),
+            codifica([None, 1]),
+        ]
+        for cursore in cursori:
+            with self.subTest(cursore=cursore):
+                response = self.client.get(f'/api/cartelle/?paginazione=cursor&cursor={cursore}')
+                self.assertEqual(response.status_code, 404)
+
+        url = f'/api/cataloghi/{self.catalogo.pk}/cartelle/?paginazione=cursor&cursor={codifica(["a", 1])}'
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class _PoolInterrotto:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('worker terminato')
+
+    def shutdown(self, **kwargs):
+        pass
+
+
+class _PoolFinto:
+    def __init__(self):
+        self.inviati = []
+
+    def submit(self, funzione, cartella_id):
+        self.inviati.append(cartella_id)
+        future = Future()
+        future.set_result((cartella_id, True))
+        return future
+
+
+@override_settings(CATALOGO_THUMBNAIL_ASYNC=True, CATALOGO_SNAPSHOT_ASYNC=False)
+class PoolThumbnailTest(TestCase):
+    """Pool di processi delle thumbnail: ricreato dopo BrokenProcessPool, errori che non diventano 500"""
+
+    def test_pool_interrotto_viene_ricreato(self):
+        nuovo = _PoolFinto()
+        with mock.patch.object(thumbnails, '_executor', _PoolInterrotto()), \
+                mock.patch.object(thumbnails, 'crea_pool', return_value=nuovo):
+            thumbnails.accoda_thumbnail([1, 2])
+            self.assertIs(thumbnails._executor, nuovo)
+        self.assertEqual(nuovo.inviati, [1, 2])
+
+    def test_errore_del_pool_non_blocca_il_salvataggio(self):
+        with mock.patch('catalogo.signals.accoda_thumbnail', side_effect=BrokenProcessPool), \
+                self.assertLogs('django', level='ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            cartella = Cartelle.objects.create(nome_cartella='Foto', file_upload_diretto='file_catalogo/foto.jpg')
+        self.assertEqual(Cartelle.objects.get(pk=cartella.pk).thumbnail_stato, Cartelle.THUMBNAIL_IN_ATTESA)
+
+    def test_initializer_segna_il_worker(self):
+        self.assertFalse(worker.nel_worker())
+        with mock.patch.object(worker, '_nel_worker', False), mock.patch('django.setup'):
+            worker.inizializza()
+            self.assertTrue(worker.nel_worker())
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Copia del database di test su file specifica di SQLite')
+class PoolThumbnailRealeTest(TransactionTestCase):
+    """
+    Pool vero (processi 'spawn'): il worker deve importare initializer e task prima di django.setup().
+    Il processo figlio legge DATABASE_NAME e MEDIA_ROOT dall'ambiente: riceve una copia su file del
+    database di test e una MEDIA_ROOT temporanea con l'immagine.
+    """
+
+    def test_worker_genera_la_thumbnail(self):
+        cartella, = Cartelle.objects.bulk_create([Cartelle(
+            nome_cartella='Foto', file_upload_diretto='file_catalogo/foto.png',
+            tipo_file='Immagine', thumbnail_stato=Cartelle.THUMBNAIL_IN_ATTESA
+        )])
+
+        cartella_tmp = self.enterContext(tempfile.TemporaryDirectory())
+        media_root = os.path.join(cartella_tmp, 'media')
+        os.makedirs(os.path.join(media_root, 'file_catalogo'))
+        Image.new('RGB', (600, 400), 'red').save(os.path.join(media_root, 'file_catalogo', 'foto.png'))
+        database = os.path.join(cartella_tmp, 'db.sqlite3')
+        connection.ensure_connection()
+        with sqlite3.connect(database) as copia:
+            connection.connection.backup(copia)
+
+        with mock.patch.dict(os.environ, {'DATABASE_NAME': database, 'MEDIA_ROOT': media_root}), crea_pool(1) as pool:
+            self.assertEqual(pool.submit(worker.genera_thumbnail, cartella.pk).result(timeout=120), (cartella.pk, True))
+
+        with sqlite3.connect(database) as copia:
+            stato, larghezza = copia.execute(
+                'SELECT thumbnail_stato, thumbnail_larghezza FROM catalogo_cartelle WHERE id = ?', (cartella.pk,)
+            ).fetchone()
+        self.assertEqual((stato, larghezza), (Cartelle.THUMBNAIL_PRONTA, 300))
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class SnapshotTest(TestCase):
+    """Snapshot precompressi: negoziazione della codifica, 304 e ricostruzione dei cataloghi collegati"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo_a = Catalogo.objects.create(nome_it='Perle')
+        cls.catalogo_b = Catalogo.objects.create(nome_it='Tessuti')
+        cartella = Cartelle.objects.create(nome_cartella='Condivisa')
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_a, cartella=cartella, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo_b, cartella=cartella, ordine=0)
+
+    def setUp(self):
+        self.enterContext(override_settings(CATALOGO_SNAPSHOT_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+        self.url = f'/api/cataloghi/{self.catalogo_b.pk}/snapshot/'
+
+    def test_gzip_se_accettato(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        dati = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(dati['catalogo']['id'], self.catalogo_b.pk)
+
+    def test_identity_senza_accept_encoding(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response['ETag'].endswith('-identity"'))
+        self.assertEqual(json.loads(response.content)['catalogo']['id'], self.catalogo_b.pk)
+
+    def test_304_con_etag_valido(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_modifica_ricostruisce_catalogo_collegato(self):
+        self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        prima = leggi_snapshot(self.catalogo_b.pk)['versione']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.catalogo_a.nome_it = 'Perle nuove'
+            self.catalogo_a.save()
+
+        indice = leggi_snapshot(self.catalogo_b.pk)
+        self.assertNotEqual(indice['versione'], prima)
+        self.assertEqual(indice['versione'], leggi_versione(chiave_catalogo(self.catalogo_b.pk))[0])
+
+    @override_settings(CATALOGO_SNAPSHOT_ASYNC=True)
+    def test_nessuno_scheduler_nei_worker(self):
+        with mock.patch.object(worker, '_nel_worker', True), mock.patch('catalogo.jobs.get_scheduler') as scheduler:
+            accoda_snapshot([self.catalogo_b.pk])
+        scheduler.assert_not_called()
+
+
+@override_settings(PROTECTED_MEDIA_SIGNED_URLS=True, PROTECTED_MEDIA_URL_TTL=3600, PROTECTED_MEDIA_OFFLOAD='')
+class MediaProtettiTest(TestCase):
+    """File protetti: Range/ETag/304, offload al web server e URL firmati (scadenza, manomissione, cache dei proxy)"""
+    CONTENUTO = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        os.makedirs(os.path.join(media_root, 'file_catalogo'))
+        with open(os.path.join(media_root, 'file_catalogo', 'scheda.pdf'), 'wb') as file:
+            file.write(self.CONTENUTO)
+        self.percorso = 'file_catalogo/scheda.pdf'
+        self.client = APIClient()
+        self.url = f'/api/protected-media/{self.percorso}'
+
+    def test_range_parziale(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.CONTENUTO)}')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENUTO[10:20])
+
+    def test_range_suffisso(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENUTO[-4:])
+
+    def test_range_oltre_la_fine(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.CONTENUTO)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.CONTENUTO)}')
+
+    def test_etag_e_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_if_range_non_corrispondente_serve_file_intero(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"vecchio"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENUTO)
+
+    @override_settings(PROTECTED_MEDIA_OFFLOAD='x-sendfile')
+    def test_offload_x_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(settings.MEDIA_ROOT, self.percorso))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(PROTECTED_MEDIA_OFFLOAD='x-accel-redirect', PROTECTED_MEDIA_INTERNAL_URL='/interno/')
+    def test_offload_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/interno/file_catalogo/scheda.pdf')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    @override_settings(PROTECTED_MEDIA_OFFLOAD='sconosciuto')
+    def test_offload_non_valido(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.url)
+
+    def test_percorso_fuori_da_media_root(self):
+        self.assertEqual(self.client.get('/api/protected-media/..%2F..%2Fmanage.py').status_code, 404)
+
+    def test_url_firmato_cacheabile_fino_alla_scadenza(self):
+        response = self.client.get(costruisci_url_protetto(self.percorso))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Cache-Control'], r'^public, max-age=\d+$')
+        max_age = int(response['Cache-Control'].rsplit('=', 1)[1])
+        self.assertTrue(3600 <= max_age <= 7200)
+
+    def test_firma_manomessa_non_vale(self):
+        scadenza = int(time.time()) + 3600
+        parametri = {'scadenza': scadenza, 'firma': firma_url(self.percorso, scadenza)}
+        self.assertIsNotNone(verifica_url_firmato(self.percorso, parametri))
+        self.assertIsNone(verifica_url_firmato('file_catalogo/altro.pdf', parametri))
+        self.assertIsNone(verifica_url_firmato(self.percorso, {**parametri, 'scadenza': scadenza + 1}))
+        self.assertIsNone(verifica_url_firmato(self.percorso, {**parametri, 'firma': '0' * 64}))
+
+        # Firma non valida: niente cache pubblica, si passa alla verifica normale
+        response = self.client.get(f'/api/protected-media/{self.percorso}?scadenza={scadenza}&firma={"0" * 64}')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_url_firmato_scaduto(self):
+        scadenza = int(time.time()) - 1
+        self.assertIsNone(verifica_url_firmato(
+            self.percorso, {'scadenza': scadenza, 'firma': firma_url(self.percorso, scadenza)}
+        ))
+
+    @override_settings(PROTECTED_MEDIA_OFFLOAD='x-accel-redirect')
+    def test_offload_con_url_firmato_resta_cacheabile(self):
+        response = self.client.get(costruisci_url_protetto(self.percorso))
+        self.assertEqual(response['X-Accel-Redirect'], '/media-protetti/file_catalogo/scheda.pdf')
+        self.assertRegex(response['Cache-Control'], r'^public, max-age=\d+$')
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class ThumbnailSalvataTest(TestCase):
+    """Thumbnail salvata sulla cartella: le liste non leggono il disco né le tabelle di easy_thumbnails"""
+
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        os.makedirs(os.path.join(media_root, 'file_catalogo'))
+        Image.new('RGB', (600, 400), 'red').save(os.path.join(media_root, 'file_catalogo', 'foto.png'))
+        self.client = APIClient()
+
+    def crea_cartella(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cartella = Cartelle.objects.create(file_upload_diretto='file_catalogo/foto.png')
+        cartella.refresh_from_db()
+        return cartella
+
+    def test_percorso_e_dimensioni_salvati(self):
+        cartella = self.crea_cartella()
+        self.assertEqual(cartella.thumbnail_stato, Cartelle.THUMBNAIL_PRONTA)
+        self.assertTrue(cartella.thumbnail_percorso)
+        self.assertEqual((cartella.thumbnail_larghezza, cartella.thumbnail_altezza), (300, 300))
+
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('catalogo.thumbnails.get_thumbnailer') as thumbnailer:
+            response = self.client.get('/api/cartelle/', HTTP_ACCEPT='application/json')
+        thumbnailer.assert_not_called()
+        self.assertFalse([q['sql'] for q in queries if 'easy_thumbnails' in q['sql']])
+        risultato = response.json()['results'][0]
+        self.assertIn(cartella.thumbnail_percorso, risultato['thumbnail_url'])
+        self.assertEqual(risultato['thumbnail_larghezza'], 300)
+
+    def test_nuovo_file_invalida_la_thumbnail(self):
+        cartella = self.crea_cartella()
+        cartella.file_upload_diretto = 'file_catalogo/altra.png'
+        with mock.patch('catalogo.signals.accoda_thumbnail'):
+            cartella.save()
+        cartella.refresh_from_db()
+        self.assertEqual(cartella.thumbnail_stato, Cartelle.THUMBNAIL_IN_ATTESA)
+        self.assertEqual(cartella.thumbnail_percorso, '')
+        self.assertIsNone(cartella.thumbnail_larghezza)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class AlberoCatalogoTest(TestCase):
+    """GET /api/cataloghi/{id}/albero/: albero annidato, categorie disattivate, profondità e numero di query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        cls.figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Murano')
+        spenta = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Boemia', is_active=False)
+        Categoria.objects.create(catalogo=cls.catalogo, parent=spenta, nome_it='Sotto spenta')
+        seconda, prima = Cartelle.objects.bulk_create([Cartelle(nome_cartella='Seconda'), Cartelle(nome_cartella='Prima')])
+        CategoriaCartella.objects.create(categoria=cls.figlia, cartella=seconda, ordine=2)
+        CategoriaCartella.objects.create(categoria=cls.figlia, cartella=prima, ordine=1)
+        cls.url = f'/api/cataloghi/{cls.catalogo.pk}/albero/'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_albero_annidato_senza_categorie_disattivate(self):
+        categorie = self.get(self.url).json()['categorie']
+        self.assertEqual([nodo['id'] for nodo in categorie], [self.radice.pk])
+        self.assertEqual([nodo['id'] for nodo in categorie[0]['sottocategorie']], [self.figlia.pk])
+        self.assertEqual(categorie[0]['num_sottocategorie'], 1)
+        self.assertEqual(categorie[0]['sottocategorie'][0]['num_cartelle'], 2)
+
+    def test_profondita(self):
+        categorie = self.get(f'{self.url}?profondita=1').json()['categorie']
+        self.assertEqual(categorie[0]['sottocategorie'], [])
+        self.assertEqual(self.get(f'{self.url}?profondita=0').status_code, 400)
+
+    def test_cartelle_ordinate(self):
+        figlia = self.get(f'{self.url}?cartelle=true').json()['categorie'][0]['sottocategorie'][0]
+        self.assertEqual([cartella['nome_cartella'] for cartella in figlia['cartelle']], ['Prima', 'Seconda'])
+
+    def test_query_costanti(self):
+        with CaptureQueriesContext(connection) as prima:
+            self.get(f'{self.url}?cartelle=true')
+        for i in range(5):
+            nodo = Categoria.objects.create(catalogo=self.catalogo, parent=self.figlia, nome_it=f'Nuova {i}')
+            CategoriaCartella.objects.create(categoria=nodo, cartella=Cartelle.objects.create(nome_cartella=f'N{i}'), ordine=0)
+        with CaptureQueriesContext(connection) as dopo:
+            self.get(f'{self.url}?cartelle=true')
+        self.assertEqual(len(dopo), len(prima))
+
+
+class SlugTest(TestCase):
+    """Slug univoci con una sola query per base, anche per blocchi da bulk_create"""
+
+    def test_suffissi_progressivi(self):
+        slug = [Catalogo.objects.create(nome_it='Accessori').slug for _ in range(3)]
+        self.assertEqual(slug, ['accessori', 'accessori-1', 'accessori-2'])
+
+    def test_una_query_per_base(self):
+        Catalogo.objects.bulk_create(
+            [Catalogo(nome_it='Accessori', slug='accessori')]
+            + [Catalogo(nome_it='Accessori', slug=f'accessori-{i}') for i in range(1, 20)]
+        )
+        with self.assertNumQueries(1):
+            istanze = assegna_slug([Catalogo(nome_it='Accessori') for _ in range(3)])
+        self.assertEqual([istanza.slug for istanza in istanze], ['accessori-20', 'accessori-21', 'accessori-22'])
+
+    def test_blocco_con_base_uguale_a_slug_riservato(self):
+        # "Varie 1" ha base "varie-1", già riservato nel blocco dal secondo "Varie"
+        istanze = assegna_slug([Catalogo(nome_it=nome) for nome in ('Varie', 'Varie', 'Varie 1')])
+        self.assertEqual([istanza.slug for istanza in istanze], ['varie', 'varie-1', 'varie-1-1'])
+        Catalogo.objects.bulk_create(istanze)
+
+    def test_slug_invariato_al_salvataggio(self):
+        catalogo = Catalogo.objects.create(nome_it='Accessori')
+        catalogo.nome_en = 'Accessories'
+        catalogo.save()
+        catalogo.refresh_from_db()
+        self.assertEqual(catalogo.slug, 'accessori')
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False)
+class CartelleCatalogoTest(TestCase):
+    """GET /api/cataloghi/{id}/cartelle/: pagine ordinate per 'ordine', totale e query che non crescono con la pagina"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        altra = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        cartelle = Cartelle.objects.bulk_create([
+            Cartelle(nome_cartella=f'C{i}', is_active=i != 7) for i in range(30)
+        ])
+        # 'ordine' inverso rispetto agli id: la pagina deve seguire l'ordine della tabella ponte
+        CatalogoCartella.objects.bulk_create([
+            CatalogoCartella(catalogo=cls.catalogo, cartella=cartella, ordine=30 - i)
+            for i, cartella in enumerate(cartelle)
+        ])
+        CategoriaCartella.objects.bulk_create([
+            CategoriaCartella(categoria=altra, cartella=cartella, ordine=i) for i, cartella in enumerate(cartelle)
+        ])
+        cls.url = f'/api/cataloghi/{cls.catalogo.pk}/cartelle/'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_pagina_ordinata_con_totale(self):
+        dati = self.get(f'{self.url}?page_size=5').json()
+        self.assertEqual(dati['count'], 29)
+        self.assertEqual([cartella['nome_cartella'] for cartella in dati['results']], ['C29', 'C28', 'C27', 'C26', 'C25'])
+
+    def test_query_indipendenti_dalla_pagina(self):
+        with CaptureQueriesContext(connection) as piccola:
+            self.get(f'{self.url}?page_size=2')
+        with CaptureQueriesContext(connection) as grande:
+            self.get(f'{self.url}?page_size=25')
+        self.assertEqual(len(grande), len(piccola))
+        # Totale nella query della pagina: nessuna SELECT COUNT separata
+        self.assertFalse([q['sql'] for q in grande if q['sql'].startswith('SELECT COUNT(')])
+
+    def test_oltre_ultima_pagina(self):
+        self.assertEqual(self.get(f'{self.url}?page_size=10&page=4').status_code, 404)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Indice FTS5 specifico di SQLite')
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False)
+class RicercaTest(TestCase):
+    """Ricerca full-text ?q=: prefissi, accenti, tutti i termini, ordinamento per rilevanza e indice allineato"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Cartelle.objects.bulk_create([
+            Cartelle(nome_cartella='Perle rosse con bordo dorato e fermaglio'),
+            Cartelle(nome_cartella='Perle rosse'),
+            Cartelle(nome_cartella='Perle blu'),
+            Cartelle(nome_cartella='Bottoni'),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def cerca(self, testo):
+        response = self.client.get('/api/cartelle/', {'q': testo}, HTTP_ACCEPT='application/json')
+        return [cartella['nome_cartella'] for cartella in response.json()['results']]
+
+    def test_rilevanza(self):
+        self.assertEqual(self.cerca('rosse'), ['Perle rosse', 'Perle rosse con bordo dorato e fermaglio'])
+
+    def test_tutti_i_termini_anche_come_prefisso(self):
+        self.assertEqual(self.cerca('per blu'), ['Perle blu'])
+
+    def test_accenti_ignorati(self):
+        self.assertEqual(self.cerca('bottòni'), ['Bottoni'])
+
+    def test_indice_aggiornato_dai_trigger(self):
+        Cartelle.objects.filter(nome_cartella='Bottoni').update(nome_cartella='Spille')
+        self.assertEqual(self.cerca('bottoni'), [])
+        self.assertEqual(self.cerca('spille'), ['Spille'])
+
+    def test_ordering_esplicito_prevale(self):
+        response = self.client.get(
+            '/api/cartelle/', {'q': 'perle', 'ordering': '-nome_cartella'}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(
+            [cartella['nome_cartella'] for cartella in response.json()['results']],
+            ['Perle rosse con bordo dorato e fermaglio', 'Perle rosse', 'Perle blu']
+        )
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False)
+class FiltriCartelleTest(TestCase):
+    """CartelleFilter: catalogo (root + categorie) e categoria con sottocategorie, senza righe duplicate"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        altro = Catalogo.objects.create(nome_it='Tessuti')
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Murano')
+        cls.root, cls.in_radice, cls.in_figlia, cls.ovunque, cls.estranea = Cartelle.objects.bulk_create([
+            Cartelle(nome_cartella='Root', tipo_file='PDF'),
+            Cartelle(nome_cartella='Radice', tipo_file='Immagine'),
+            Cartelle(nome_cartella='Figlia', tipo_file='PDF'),
+            Cartelle(nome_cartella='Ovunque', tipo_file='PDF'),
+            Cartelle(nome_cartella='Estranea', tipo_file='PDF'),
+        ])
+        CatalogoCartella.objects.bulk_create([
+            CatalogoCartella(catalogo=cls.catalogo, cartella=cls.root, ordine=0),
+            CatalogoCartella(catalogo=cls.catalogo, cartella=cls.ovunque, ordine=1),
+            CatalogoCartella(catalogo=altro, cartella=cls.estranea, ordine=0),
+        ])
+        CategoriaCartella.objects.bulk_create([
+            CategoriaCartella(categoria=cls.radice, cartella=cls.in_radice, ordine=0),
+            CategoriaCartella(categoria=figlia, cartella=cls.in_figlia, ordine=0),
+            CategoriaCartella(categoria=cls.radice, cartella=cls.ovunque, ordine=1),
+            CategoriaCartella(categoria=figlia, cartella=cls.ovunque, ordine=1),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def ids(self, **parametri):
+        response = self.client.get('/api/cartelle/', parametri, HTTP_ACCEPT='application/json')
+        return sorted(cartella['id'] for cartella in response.json()['results'])
+
+    def test_catalogo_senza_duplicati(self):
+        self.assertEqual(
+            self.ids(catalogo=self.catalogo.pk),
+            sorted([self.root.pk, self.in_radice.pk, self.in_figlia.pk, self.ovunque.pk])
+        )
+
+    def test_categoria_diretta(self):
+        self.assertEqual(self.ids(categoria=self.radice.pk), sorted([self.in_radice.pk, self.ovunque.pk]))
+
+    def test_categoria_con_sottocategorie(self):
+        self.assertEqual(
+            self.ids(categoria=self.radice.pk, sottocategorie='true'),
+            sorted([self.in_radice.pk, self.in_figlia.pk, self.ovunque.pk])
+        )
+
+    def test_filtri_combinati(self):
+        self.assertEqual(
+            self.ids(catalogo=self.catalogo.pk, tipo_file='PDF'),
+            sorted([self.root.pk, self.in_figlia.pk, self.ovunque.pk])
+        )
+
+    def test_nessun_distinct(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.ids(categoria=self.radice.pk, sottocategorie='true')
+        self.assertFalse([q['sql'] for q in queries if 'DISTINCT' in q['sql']])
+
+
+#File Filer senza contenuto su disco: all'import serve solo la riga (nome e id)
+def crea_file_filer(nomi):
+    return [File.objects.create(original_filename=nome, file=f'filer_public/{nome}') for nome in nomi]
+
+
+@override_settings(CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class ImportazioneTest(TestCase):
+    """Import da Filer: tutto in una transazione, 'ordine' in coda all'esistente, file mancanti segnalati"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.categoria = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        esistente = Cartelle.objects.create(nome_cartella='Esistente')
+        CatalogoCartella.objects.create(catalogo=cls.catalogo, cartella=esistente, ordine=4)
+        cls.files = crea_file_filer(['uno.pdf', 'due.pdf', 'tre.pdf'])
+
+    def test_import_in_coda_con_errori(self):
+        ids = [file.pk for file in self.files] + [999999]
+        cartelle, errori = importa_file_filer(ids, self.catalogo.pk, self.categoria.pk)
+
+        self.assertEqual([cartella.nome_cartella for cartella in cartelle], ['uno', 'due', 'tre'])
+        self.assertEqual(errori, [(999999, 'File non trovato')])
+        self.assertEqual(
+            list(CatalogoCartella.objects.filter(cartella__in=cartelle).order_by('ordine').values_list('ordine', flat=True)),
+            [5, 6, 7]
+        )
+        self.assertEqual(CategoriaCartella.objects.filter(categoria=self.categoria).count(), 3)
+
+    def test_errore_annulla_tutto(self):
+        prima = Cartelle.objects.count()
+        with mock.patch.object(CategoriaCartella.objects, 'bulk_create', side_effect=DatabaseError('disco pieno')):
+            with self.assertRaises(DatabaseError):
+                importa_file_filer([file.pk for file in self.files], self.catalogo.pk, self.categoria.pk)
+        self.assertEqual(Cartelle.objects.count(), prima)
+        self.assertFalse(CatalogoCartella.objects.filter(cartella__file_da_filer__in=self.files).exists())
+
+    def test_categoria_inesistente(self):
+        with self.assertRaises(ValueError):
+            importa_file_filer([self.files[0].pk], self.catalogo.pk, 999999)
+        self.assertFalse(Cartelle.objects.filter(file_da_filer=self.files[0]).exists())
+
+
+@override_settings(
+    CATALOGO_IMPORT_ASYNC=False, CATALOGO_IMPORT_BATCH=2, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False
+)
+class JobImportazioneTest(TestCase):
+    """Job di import a blocchi: avanzamento salvato per blocco e ripresa dal primo blocco non completato"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.files = crea_file_filer([f'file{i}.pdf' for i in range(5)])
+
+    def setUp(self):
+        # L'import eseguito dopo il commit ricostruisce lo snapshot del catalogo: fuori dalla cartella del progetto
+        self.enterContext(override_settings(CATALOGO_SNAPSHOT_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def avvia(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = crea_job([file.pk for file in self.files], self.catalogo.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_completato_a_blocchi(self):
+        job = self.avvia()
+        self.assertEqual(job.stato, JobImportazione.STATO_COMPLETATO)
+        self.assertEqual((job.totale, job.elaborati, job.importati), (5, 5, 5))
+        self.assertEqual(job.get_riepilogo()['percentuale'], 100)
+
+    def test_ripresa_dopo_interruzione(self):
+        originale = importa_file_filer
+        chiamate = []
+
+        # Il secondo blocco fallisce con un errore non di database: il job si ferma dopo il primo
+        def importa(blocco, *args, **kwargs):
+            chiamate.append(blocco)
+            if len(chiamate) == 2:
+                raise RuntimeError('worker interrotto')
+            return originale(blocco, *args, **kwargs)
+
+        with mock.patch('catalogo.jobs.importa_file_filer', side_effect=importa), self.assertLogs('catalogo.jobs'):
+            job = self.avvia()
+        self.assertEqual(job.stato, JobImportazione.STATO_ERRORE)
+        self.assertEqual((job.elaborati, job.importati), (2, 2))
+        self.assertTrue(job.is_riprendibile())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(riprendi_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.stato, JobImportazione.STATO_COMPLETATO)
+        self.assertEqual((job.elaborati, job.importati), (5, 5))
+        # Nessun file importato due volte
+        self.assertEqual(Cartelle.objects.filter(file_da_filer__in=self.files).count(), 5)
+
+    def test_job_completato_non_riprendibile(self):
+        job = self.avvia()
+        self.assertFalse(riprendi_job(job))
+
+    def test_job_in_coda_perso_al_riavvio(self):
+        # Callback on_commit mai eseguito: come un job accodato in memoria da un processo poi riavviato
+        job = crea_job([file.pk for file in self.files], self.catalogo.pk)
+        self.assertFalse(job.is_riprendibile())
+
+        scaduto = timezone.now() - timedelta(seconds=settings.CATALOGO_IMPORT_TIMEOUT + 1)
+        JobImportazione.objects.filter(pk=job.pk).update(updated_at=scaduto)
+        job.refresh_from_db()
+        self.assertTrue(job.is_riprendibile())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(riprendi_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.importati), (JobImportazione.STATO_COMPLETATO, 5))
+
+    def test_ripresa_da_admin_richiede_permesso_di_modifica(self):
+        job = crea_job([file.pk for file in self.files], self.catalogo.pk)
+        JobImportazione.objects.filter(pk=job.pk).update(stato=JobImportazione.STATO_ERRORE)
+        url = reverse('admin:catalogo_jobimportazione_riprendi', args=[job.pk])
+
+        utente = User.objects.create_user('operatore', password='x', is_staff=True)
+        utente.user_permissions.add(Permission.objects.get(codename='view_jobimportazione'))
+        self.client.force_login(utente)
+        self.assertEqual(self.client.post(url).status_code, 403)
+        job.refresh_from_db()
+        self.assertEqual(job.stato, JobImportazione.STATO_ERRORE)
+
+        utente.user_permissions.add(Permission.objects.get(codename='change_jobimportazione'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url).status_code, 302)
+        job.refresh_from_db()
+        self.assertEqual(job.stato, JobImportazione.STATO_COMPLETATO)
+
+
+class SelettoreFileTest(TestCase):
+    """Selettore file della pagina di import: pagine JSON, filtri e anteprima solo per le immagini"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='x')
+        cls.files = crea_file_filer(['uno.pdf', 'due.jpg', 'tre.pdf'])
+        Cartelle.objects.create(nome_cartella='Importato', file_da_filer=cls.files[0])
+        cls.url = reverse('admin:catalogo_cartelle_import_file')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_pagine_dal_piu_recente(self):
+        dati = self.client.get(self.url, {'page_size': 2}).json()
+        self.assertEqual((dati['count'], dati['num_pages']), (3, 2))
+        self.assertEqual([file['id'] for file in dati['results']], [self.files[2].pk, self.files[1].pk])
+
+    def test_solo_non_importati_e_ricerca(self):
+        dati = self.client.get(self.url, {'solo_non_importati': '1'}).json()
+        self.assertNotIn(self.files[0].pk, [file['id'] for file in dati['results']])
+        dati = self.client.get(self.url, {'q': 'due'}).json()
+        self.assertEqual([file['id'] for file in dati['results']], [self.files[1].pk])
+
+    def test_anteprima_solo_per_immagini(self):
+        risultati = {file['id']: file for file in self.client.get(self.url).json()['results']}
+        self.assertIsNone(risultati[self.files[0].pk]['anteprima_url'])
+        self.assertEqual(
+            risultati[self.files[1].pk]['anteprima_url'],
+            reverse('admin:catalogo_cartelle_import_anteprima', args=[self.files[1].pk])
+        )
+
+    def test_query_indipendenti_dalla_pagina(self):
+        with CaptureQueriesContext(connection) as piccola:
+            self.client.get(self.url, {'page_size': 1})
+        with CaptureQueriesContext(connection) as grande:
+            self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(len(grande), len(piccola))
+
+    def test_riservato_allo_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=True, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class AdminCartelleTest(TestCase):
+    """Changelist admin delle cartelle: numero di query costante al crescere delle righe"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='x')
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        cls.figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Murano')
+        cls.url = reverse('admin:catalogo_cartelle_changelist')
+
+    def setUp(self):
+        cache_risposte().clear()
+        self.client.force_login(self.admin)
+
+    def aggiungi_cartelle(self, numero):
+        inizio = Cartelle.objects.count()
+        for i in range(inizio, inizio + numero):
+            categoria = Categoria.objects.create(catalogo=self.catalogo, parent=self.figlia, nome_it=f'Sotto {i}')
+            cartella = Cartelle.objects.create(nome_cartella=f'C{i}', updated_by=self.admin)
+            CatalogoCartella.objects.create(catalogo=self.catalogo, cartella=cartella, ordine=i)
+            CategoriaCartella.objects.create(categoria=categoria, cartella=cartella, ordine=0)
+
+    def conta_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_costanti(self):
+        self.aggiungi_cartelle(3)
+        # Prima richiesta a vuoto: riempie la cache delle scelte dei filtri
+        self.conta_query()
+        poche = self.conta_query()
+        self.aggiungi_cartelle(20)
+        self.conta_query()
+        self.assertEqual(self.conta_query(), poche)
+
+    def test_posizione_con_percorso_completo(self):
+        self.aggiungi_cartelle(1)
+        self.assertContains(self.client.get(self.url), 'Perle &gt; Vetro &gt; Murano &gt; Sotto 0 | Perle')
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=True, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class AdminFiltriTest(TestCase):
+    """Filtri della changelist admin: EXISTS senza DISTINCT, sottoalbero, valori non validi e scelte in cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='x')
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.altro = Catalogo.objects.create(nome_it='Tessuti')
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Murano')
+        cls.in_figlia = Cartelle.objects.create(nome_cartella='In figlia')
+        cls.root = Cartelle.objects.create(nome_cartella='Root')
+        cls.estranea = Cartelle.objects.create(nome_cartella='Estranea')
+        CategoriaCartella.objects.create(categoria=figlia, cartella=cls.in_figlia, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo, cartella=cls.root, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo, cartella=cls.in_figlia, ordine=1)
+        CatalogoCartella.objects.create(catalogo=cls.altro, cartella=cls.estranea, ordine=0)
+        cls.url = reverse('admin:catalogo_cartelle_changelist')
+
+    def setUp(self):
+        cache_risposte().clear()
+        self.client.force_login(self.admin)
+
+    def ids(self, **parametri):
+        response = self.client.get(self.url, parametri)
+        return sorted(cartella.pk for cartella in response.context['cl'].result_list)
+
+    def test_catalogo_senza_duplicati(self):
+        with CaptureQueriesContext(connection) as queries:
+            ids = self.ids(catalogo=self.catalogo.pk)
+        self.assertEqual(ids, sorted([self.root.pk, self.in_figlia.pk]))
+        self.assertFalse([q['sql'] for q in queries if 'DISTINCT' in q['sql'] and 'catalogo_catalogocartella' in q['sql']])
+
+    def test_categoria_comprende_sottoalbero(self):
+        self.assertEqual(self.ids(categoria=self.radice.pk), [self.in_figlia.pk])
+
+    def test_valore_non_numerico(self):
+        response = self.client.get(self.url, {'catalogo': 'abc'})
+        self.assertRedirects(response, f'{self.url}?e=1', fetch_redirect_response=False)
+
+    def test_scelte_in_cache_invalidate_dalle_modifiche(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        # Le scelte leggono solo id e nome: nessuna di queste query alla seconda richiesta
+        self.assertFalse([
+            q['sql'] for q in queries
+            if q['sql'].startswith('SELECT "catalogo_catalogo"."id" AS "id", "catalogo_catalogo"."nome_it" AS "nome_it" FROM')
+        ])
+
+        self.altro.nome_it = 'Lini'
+        self.altro.save()
+        self.assertContains(self.client.get(self.url), 'Lini')
+
+
+@override_settings(CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class ArchivioZipTest(TestCase):
+    """ZIP in streaming di catalogo e categoria: archivio valido, percorsi, nomi ripetuti e file mancanti"""
+
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        os.makedirs(os.path.join(media_root, 'file_catalogo'))
+        for nome, contenuto in (('a.pdf', b'%PDF a'), ('b.pdf', b'%PDF b'), ('c.txt', b'testo ' * 1000)):
+            with open(os.path.join(media_root, 'file_catalogo', nome), 'wb') as file:
+                file.write(contenuto)
+
+        self.catalogo = Catalogo.objects.create(nome_it='Perle')
+        self.radice = Categoria.objects.create(catalogo=self.catalogo, nome_it='Vetro')
+        figlia = Categoria.objects.create(catalogo=self.catalogo, parent=self.radice, nome_it='Murano')
+        cartelle = [
+            (None, 'Scheda', 'file_catalogo/a.pdf'),
+            (self.radice, 'Scheda', 'file_catalogo/a.pdf'),
+            (self.radice, 'Scheda', 'file_catalogo/b.pdf'),
+            (figlia, 'Note', 'file_catalogo/c.txt'),
+            (figlia, 'Persa', 'file_catalogo/persa.pdf'),
+        ]
+        for ordine, (categoria, nome, percorso) in enumerate(cartelle):
+            cartella = Cartelle.objects.create(nome_cartella=nome, file_upload_diretto=percorso)
+            if categoria is None:
+                CatalogoCartella.objects.create(catalogo=self.catalogo, cartella=cartella, ordine=ordine)
+            else:
+                CategoriaCartella.objects.create(categoria=categoria, cartella=cartella, ordine=ordine)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='x'))
+
+    def scarica(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        # Il file mancante è segnalato mentre l'archivio viene scritto
+        with self.assertLogs('catalogo.archivio', level='WARNING'):
+            contenuto = b''.join(response.streaming_content)
+        archivio = zipfile.ZipFile(io.BytesIO(contenuto))
+        self.assertIsNone(archivio.testzip())
+        return archivio
+
+    def test_zip_catalogo(self):
+        archivio = self.scarica(f'/api/cataloghi/{self.catalogo.pk}/zip/')
+        self.assertEqual(archivio.namelist(), [
+            'Perle/Scheda.pdf',
+            'Perle/Vetro/Scheda.pdf',
+            'Perle/Vetro/Scheda (2).pdf',
+            'Perle/Vetro/Murano/Note.txt',
+            'FILE_MANCANTI.txt',
+        ])
+        self.assertEqual(archivio.read('Perle/Vetro/Scheda (2).pdf'), b'%PDF b')
+        self.assertEqual(archivio.getinfo('Perle/Scheda.pdf').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archivio.getinfo('Perle/Vetro/Murano/Note.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertIn('persa.pdf', archivio.read('FILE_MANCANTI.txt').decode())
+
+    def test_zip_categoria(self):
+        archivio = self.scarica(f'/api/categorie/{self.radice.pk}/zip/')
+        self.assertEqual(archivio.namelist()[:3], [
+            'Perle/Vetro/Scheda.pdf',
+            'Perle/Vetro/Scheda (2).pdf',
+            'Perle/Vetro/Murano/Note.txt',
+        ])
+
+    def test_riservato_allo_staff(self):
+        self.client.force_authenticate(User.objects.create_user('editor', password='x'))
+        self.assertEqual(self.client.get(f'/api/cataloghi/{self.catalogo.pk}/zip/').status_code, 403)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=True, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class LinguaTest(TestCase):
+    """?lang=: un solo 'nome' nella lingua richiesta (italiano se manca), Accept-Language con ?lang=auto"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle', nome_en='Beads', nome_fr='Perles')
+        cls.categoria = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro', nome_en='Glass')
+        cartella = Cartelle.objects.create(nome_cartella='Scheda')
+        CategoriaCartella.objects.create(categoria=cls.categoria, cartella=cartella, ordine=0)
+        CatalogoCartella.objects.create(catalogo=cls.catalogo, cartella=cartella, ordine=0)
+
+    def setUp(self):
+        cache_risposte().clear()
+        self.client = APIClient()
+
+    def get(self, url, **extra):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **extra)
+
+    def test_nome_compatto(self):
+        dati = self.get(f'/api/cataloghi/{self.catalogo.pk}/?lang=en').json()
+        self.assertEqual(dati['nome'], 'Beads')
+        self.assertFalse({'nome_it', 'nome_en', 'nome_fr', 'nome_es'} & set(dati))
+
+    def test_fallback_italiano(self):
+        self.assertEqual(self.get(f'/api/cataloghi/{self.catalogo.pk}/?lang=es').json()['nome'], 'Perle')
+
+    def test_relazioni_nella_stessa_lingua(self):
+        categoria = self.get(f'/api/categorie/{self.categoria.pk}/?lang=en').json()
+        self.assertEqual((categoria['nome'], categoria['catalogo_nome']), ('Glass', 'Beads'))
+        cartella = self.get('/api/cartelle/?lang=fr').json()['results'][0]
+        self.assertEqual((cartella['cataloghi_list'], cartella['categorie_list']), (['Perles'], ['Vetro']))
+
+    def test_albero(self):
+        nodo = self.get(f'/api/cataloghi/{self.catalogo.pk}/albero/?lang=en').json()['categorie'][0]
+        self.assertEqual(nodo['nome'], 'Glass')
+        self.assertNotIn('nome_it', nodo)
+
+    def test_accept_language(self):
+        response = self.get(f'/api/cataloghi/{self.catalogo.pk}/?lang=auto', HTTP_ACCEPT_LANGUAGE='de-DE, fr-CH;q=0.9')
+        self.assertEqual(response.json()['nome'], 'Perles')
+        self.assertIn('Accept-Language', response['Vary'])
+        # Stessa URL con un'altra lingua: la cache non deve restituire la risposta francese
+        response = self.get(f'/api/cataloghi/{self.catalogo.pk}/?lang=auto', HTTP_ACCEPT_LANGUAGE='en')
+        self.assertEqual(response.json()['nome'], 'Beads')
+
+    def test_lingua_non_supportata(self):
+        self.assertEqual(self.get('/api/cataloghi/?lang=de').status_code, 400)
+
+    def test_senza_lang_tutti_i_nomi(self):
+        dati = self.get(f'/api/cataloghi/{self.catalogo.pk}/').json()
+        self.assertEqual((dati['nome_it'], dati['nome_en']), ('Perle', 'Beads'))
+        self.assertNotIn('nome', dati)
+
+
+@override_settings(CATALOGO_CACHE_RISPOSTE=False, CATALOGO_THUMBNAIL_ASYNC=False, CATALOGO_SNAPSHOT_ASYNC=False)
+class CampiDinamiciTest(TestCase):
+    """?fields= e ?expand=: campi restituiti, errori sui nomi sconosciuti e query solo per i campi richiesti"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogo = Catalogo.objects.create(nome_it='Perle')
+        cls.radice = Categoria.objects.create(catalogo=cls.catalogo, nome_it='Vetro')
+        cls.figlia = Categoria.objects.create(catalogo=cls.catalogo, parent=cls.radice, nome_it='Murano')
+        for i in range(3):
+            cartella = Cartelle.objects.create(nome_cartella=f'C{i}')
+            CatalogoCartella.objects.create(catalogo=cls.catalogo, cartella=cartella, ordine=i)
+            CategoriaCartella.objects.create(categoria=cls.figlia, cartella=cartella, ordine=i)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT='application/json')
+
+    def test_solo_campi_richiesti_senza_relazioni(self):
+        with CaptureQueriesContext(connection) as queries:
+            risultati = self.get('/api/cartelle/?fields=id,nome_cartella').json()['results']
+        self.assertEqual(set(risultati[0]), {'id', 'nome_cartella'})
+        # Nessuna JOIN sul file Filer né prefetch di cataloghi e categorie
+        self.assertFalse([
+            q['sql'] for q in queries
+            if 'filer_file' in q['sql'] or 'catalogo_catalogocartella' in q['sql'] or 'catalogo_categoriacartella' in q['sql']
+        ])
+
+    def test_nomi_sconosciuti(self):
+        self.assertIn('fields', self.get('/api/cartelle/?fields=id,inesistente').json())
+        self.assertIn('expand', self.get('/api/cartelle/?expand=inesistente').json())
+        self.assertEqual(self.get('/api/categorie/?expand=figli').status_code, 400)
+
+    def test_espansione_al_posto_dell_id(self):
+        figlia = self.get(f'/api/categorie/{self.figlia.pk}/?expand=catalogo,parent').json()
+        self.assertEqual(figlia['catalogo']['nome_it'], 'Perle')
+        self.assertEqual(figlia['parent']['id'], self.radice.pk)
+        radice = self.get(f'/api/categorie/{self.radice.pk}/?expand=parent').json()
+        self.assertIsNone(radice['parent'])
+
+    def test_espansione_con_campi(self):
+        cartella = self.get('/api/cartelle/?fields=id&expand=cataloghi').json()['results'][0]
+        self.assertEqual(set(cartella), {'id', 'cataloghi'})
+        self.assertEqual(cartella['cataloghi'][0]['slug'], 'perle')
+
+    def test_espansione_a_query_costanti(self):
+        with CaptureQueriesContext(connection) as poche:
+            self.get('/api/cartelle/?expand=cataloghi,categorie&page_size=1')
+        with CaptureQueriesContext(connection) as tutte:
+            self.get('/api/cartelle/?expand=cataloghi,categorie&page_size=3')
+        self.assertEqual(len(tutte), len(poche))
+
+    def test_campi_nelle_cartelle_del_catalogo(self):
+        risultati = self.get(f'/api/cataloghi/{self.catalogo.pk}/cartelle/?fields=id,thumbnail_url').json()['results']
+        self.assertEqual(set(risultati[0]), {'id', 'thumbnail_url'})
@@ -0,0 +1,162 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from easy_thumbnails.exceptions import InvalidImageFormatError
+from easy_thumbnails.files import get_thumbnailer
+
+from . import worker
+
+logger = logging.getLogger(__name__)
+
+# Opzioni della thumbnail restituita dalle API (300x300px)
+OPZIONI_THUMBNAIL = {
+    'size': (300, 300),
+    'crop': True,
+    'quality': 85,
+    'upscale': False  # Non ingrandire immagini piccole
+}
+
+# Pool di processi condiviso, creato alla prima richiesta e ricreato se un worker muore
+_executor = None
+_executor_lock = threading.Lock()
+
+
+#Ritorna il thumbnailer del file effettivo della cartella (Filer o upload diretto), None se non c'è file
+def get_thumbnailer_cartella(cartella):
+    if cartella.file_da_filer:
+        if hasattr(cartella.file_da_filer, 'file') and cartella.file_da_filer.file:
+            return get_thumbnailer(cartella.file_da_filer.file)
+    elif cartella.file_upload_diretto:
+        return get_thumbnailer(cartella.file_upload_diretto)
+    return None
+
+
+#Genera (o rigenera con forza=True) la thumbnail di una cartella immagine
+def genera_thumbnail(cartella, forza=False):
+    if cartella.tipo_file != 'Immagine':
+        return None
+    try:
+        thumbnailer = get_thumbnailer_cartella(cartella)
+        if thumbnailer is None:
+            return None
+        if forza:
+            thumbnail = thumbnailer.generate_thumbnail(OPZIONI_THUMBNAIL)
+            thumbnailer.save_thumbnail(thumbnail)
+            return thumbnail
+        return thumbnailer.get_thumbnail(OPZIONI_THUMBNAIL)
+    except (InvalidImageFormatError, IOError, AttributeError, ValueError) as e:
+        # File corrotto, formato non valido, o non è un'immagine
+        logger.warning(f"Thumbnail non generata per cartella {cartella.pk}: {e}")
+        return None
+
+
+# Funzione eseguita nel processo worker: riceve solo l'id, rilegge la cartella dal DB
+# e salva percorso e dimensioni della thumbnail sulla cartella
+def genera_thumbnail_da_id(cartella_id, forza=False):
+    from .models import Cartelle
+
+    try:
+        cartella = Cartelle.objects.select_related('file_da_filer').get(pk=cartella_id)
+    except Cartelle.DoesNotExist:
+        return cartella_id, False
+    if cartella.tipo_file != 'Immagine':
+        return cartella_id, False
+
+    thumbnail = genera_thumbnail(cartella, forza=forza)
+    if thumbnail is not None:
+        valori = {
+            'thumbnail_stato': Cartelle.THUMBNAIL_PRONTA,
+            'thumbnail_percorso': thumbnail.name,
+            'thumbnail_larghezza': thumbnail.width,
+            'thumbnail_altezza': thumbnail.height,
+        }
+    else:
+        valori = {'thumbnail_stato': Cartelle.THUMBNAIL_ERRORE}
+
+    # update() mirato: non cambia updated_at e non sovrascrive un file sostituito nel frattempo
+    nome_upload, file_da_filer_id = cartella.get_file_chiave()
+    if nome_upload:
+        stesso_upload = Q(file_upload_diretto=nome_upload)
+    else:
+        stesso_upload = Q(file_upload_diretto='') | Q(file_upload_diretto__isnull=True)
+    # update() non invia segnali: la thumbnail cambia le risposte API, quindi aggiorna versioni e registro
+    # nella stessa transazione dell'update
+    from .sync import registra_modifiche
+    from .versioni import segna_modifica, cataloghi_di_cartelle
+    with transaction.atomic():
+        aggiornate = Cartelle.objects.filter(
+            stesso_upload,
+            pk=cartella_id,
+            file_da_filer_id=file_da_filer_id
+        ).update(**valori)
+        if aggiornate:
+            segna_modifica(cataloghi_di_cartelle([cartella_id]))
+            registra_modifiche(Cartelle, [cartella_id])
+
+    return cartella_id, thumbnail is not None
+
+
+# Pool di processi per la generazione: i worker sono avviati con 'spawn' (nessuna connessione DB
+# ereditata dal padre) e inizializzano Django prima di ricevere il primo task
+# Initializer e task stanno in catalogo.worker, importabile prima di django.setup()
+def crea_pool(max_workers=None):
+    return ProcessPoolExecutor(
+        max_workers=max_workers or settings.CATALOGO_THUMBNAIL_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=worker.inizializza
+    )
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = crea_pool()
+        return _executor
+
+
+# Un worker terminato di colpo (es. OOM su un'immagine enorme) rompe tutto il pool (BrokenProcessPool):
+# lo si scarta e il prossimo invio ne crea uno nuovo
+def _scarta_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _log_risultato(future):
+    try:
+        future.result()
+    except BrokenProcessPool:
+        logger.exception("Pool thumbnail interrotto: verrà ricreato al prossimo invio")
+    except Exception:
+        logger.exception("Errore nel worker thumbnail")
+
+
+#Mette in coda la generazione delle thumbnail nel pool di processi (in sincrono se CATALOGO_THUMBNAIL_ASYNC=False)
+def accoda_thumbnail(cartella_ids):
+    cartella_ids = list(cartella_ids)
+    if not cartella_ids:
+        return
+
+    if not settings.CATALOGO_THUMBNAIL_ASYNC:
+        for cartella_id in cartella_ids:
+            genera_thumbnail_da_id(cartella_id)
+        return
+
+    # Le cartelle non generate per un pool interrotto restano in attesa (vedi rigenera_thumbnail)
+    for cartella_id in cartella_ids:
+        executor = _get_executor()
+        try:
+            future = executor.submit(worker.genera_thumbnail, cartella_id)
+        except BrokenProcessPool:
+            _scarta_executor(executor)
+            future = _get_executor().submit(worker.genera_thumbnail, cartella_id)
+        future.add_done_callback(_log_risultato)
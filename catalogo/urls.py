@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter #DefaultRouter genera automaticamente anche la root view (/)
-from .views import CatalogoViewSet, CategoriaViewSet, CartelleViewSet, serve_protected_media
+from .views import CatalogoViewSet, CategoriaViewSet, CartelleViewSet, serve_protected_media, statistiche_cache, sincronizza
 
 #Crea istanza del router
 router =DefaultRouter()
@@ -17,4 +17,6 @@ router.register(r'cartelle', CartelleViewSet, basename='cartelle')
 urlpatterns = [
     path('', include(router.urls)),
     path('protected-media/<path:file_path>', serve_protected_media, name='protected_media'),
+    path('cache/statistiche/', statistiche_cache, name='statistiche_cache'),
+    path('sync/', sincronizza, name='sync'),
 ]
\ No newline at end of file
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import VersioneCatalogo, Cartelle, CatalogoCartella, CategoriaCartella
+
+# Chiave del marcatore che cambia a ogni modifica di qualsiasi catalogo
+CHIAVE_GLOBALE = 'globale'
+
+# Chiave del marcatore che cambia solo quando cambiano cataloghi o categorie (non le cartelle)
+CHIAVE_STRUTTURA = 'struttura'
+
+
+def chiave_catalogo(catalogo_id):
+    return f"catalogo:{catalogo_id}"
+
+
+#Incrementa il marcatore globale e quelli dei cataloghi indicati (una UPDATE + eventuale INSERT)
+#struttura=True anche quello di cataloghi e categorie
+#Da chiamare anche dopo bulk_create/update(), che non inviano segnali
+def segna_modifica(catalogo_ids=(), struttura=False):
+    chiavi = {CHIAVE_GLOBALE} | {chiave_catalogo(pk) for pk in catalogo_ids if pk}
+    if struttura:
+        chiavi.add(CHIAVE_STRUTTURA)
+    adesso = timezone.now()
+
+    aggiornate = VersioneCatalogo.objects.filter(chiave__in=chiavi).update(
+        versione=F('versione') + 1,
+        aggiornato_il=adesso
+    )
+    if aggiornate < len(chiavi):
+        esistenti = set(VersioneCatalogo.objects.filter(chiave__in=chiavi).values_list('chiave', flat=True))
+        VersioneCatalogo.objects.bulk_create(
+            [VersioneCatalogo(chiave=chiave, versione=1, aggiornato_il=adesso) for chiave in chiavi - esistenti],
+            ignore_conflicts=True
+        )
+
+    # Snapshot compressi dei cataloghi modificati ricostruiti in background, a transazione confermata
+    from .snapshot import accoda_snapshot
+    catalogo_ids = [pk for pk in catalogo_ids if pk]
+    transaction.on_commit(lambda: accoda_snapshot(catalogo_ids))
+
+
+#Ritorna (versione, aggiornato_il) del marcatore con una sola query; (0, None) se mai modificato
+def leggi_versione(chiave):
+    riga = VersioneCatalogo.objects.filter(chiave=chiave).values_list('versione', 'aggiornato_il').first()
+    return riga or (0, None)
+
+
+#Cataloghi in cui compaiono le cartelle indicate (come root o tramite categoria), con una sola query
+def cataloghi_di_cartelle(cartella_ids):
+    root = CatalogoCartella.objects.filter(cartella_id__in=cartella_ids).order_by().values_list(
+        'catalogo_id', flat=True
+    )
+    categorie = CategoriaCartella.objects.filter(cartella_id__in=cartella_ids).order_by().values_list(
+        'categoria__catalogo_id', flat=True
+    )
+    return set(root.union(categorie))
+
+
+#Cataloghi che mostrano i nomi dei cataloghi e delle categorie indicati attraverso cartelle condivise
+#(cataloghi_list / categorie_list): un rename deve invalidare anche le loro risposte. Una sola query
+def cataloghi_collegati(catalogo_ids=(), categoria_ids=()):
+    catalogo_ids = [pk for pk in catalogo_ids if pk]
+    categoria_ids = [pk for pk in categoria_ids if pk]
+    if not catalogo_ids and not categoria_ids:
+        return set()
+    cartelle = Cartelle.objects.filter(
+        Q(pk__in=CatalogoCartella.objects.filter(catalogo_id__in=catalogo_ids).values('cartella_id'))
+        | Q(pk__in=CategoriaCartella.objects.filter(
+            Q(categoria_id__in=categoria_ids) | Q(categoria__catalogo_id__in=catalogo_ids)
+        ).values('cartella_id'))
+    ).values('pk')
+    return cataloghi_di_cartelle(cartelle)
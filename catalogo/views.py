@@ -1,20 +1,29 @@
-from rest_framework import viewsets #importa classe base ViewSet
-from rest_framework.permissions import IsAuthenticatedOrReadOnly #Permessi
+from rest_framework import viewsets, status #importa classe base ViewSet
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser #Permessi
 
-from .models import Catalogo, Categoria, Cartelle
+from django.conf import settings
+from .models import Catalogo, Categoria, Cartelle, CatalogoCartella
 from .serializers import CatalogoSerializer, CategoriaSerializer, CartelleSerializer
 
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
-from .filters import CatalogoFilter, CategoriaFilter
+from .filters import CatalogoFilter, CategoriaFilter, CartelleFilter, RilevanzaOrderingFilter
+from .albero import costruisci_albero
+from .pagination import (
+    PaginazioneSelezionabileMixin, CartelleKeysetPagination, OrdineKeysetPagination, ConteggioFinestraPagination
+)
 
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from django.http import FileResponse, Http404
-from django.conf import settings
-import os
+from .mixins import CacheRispostaMixin, CampiRichiestiMixin, LinguaMixin, campi_richiesti
+from .cache import statistiche, azzera_statistiche
+from .sync import cursore_corrente, cursore_minimo, leggi_modifiche
+from .snapshot import risposta_snapshot
+from .archivio import risposta_zip, voci_catalogo, voci_categoria
+from .versioni import CHIAVE_GLOBALE, chiave_catalogo
+from .media import risolvi_percorso, risposta_file, risposta_offload, verifica_url_firmato
 
-class CatalogoViewSet(viewsets.ModelViewSet): #ViewSet per gestire operazioni CRUD su Catalogo
+class CatalogoViewSet(CampiRichiestiMixin, LinguaMixin, CacheRispostaMixin, viewsets.ModelViewSet): #ViewSet per gestire operazioni CRUD su Catalogo
      """
      Endpoint generati:
     - GET    /api/cataloghi/       → Lista tutti i cataloghi
@@ -23,17 +32,31 @@ class CatalogoViewSet(viewsets.ModelViewSet): #ViewSet per gestire operazioni CR
     - PUT    /api/cataloghi/{id}/  → Modifica completa catalogo
     - PATCH  /api/cataloghi/{id}/  → Modifica parziale catalogo
     - DELETE /api/cataloghi/{id}/  → Elimina catalogo
+    - GET    /api/cataloghi/{id}/albero/ → Albero completo delle categorie
+    - GET    /api/cataloghi/{id}/snapshot/ → Catalogo completo precompresso (gzip/brotli)
+    - GET    /api/cataloghi/{id}/zip/ → Archivio ZIP dei file del catalogo (solo staff)
+
+    Le GET rispondono 304 se il catalogo (o la lista) non è cambiato da If-None-Match / If-Modified-Since.
+    Con ?lang=it|en|fr|es (o ?lang=auto per Accept-Language) un solo campo 'nome' al posto dei nome_*.
+    Lista e dettaglio accettano ?fields= (solo i campi indicati) e ?expand=categorie.
     """
 
      queryset = Catalogo.objects.all() #Recupera tutti gli oggetti Catalogo
      serializer_class= CatalogoSerializer #Specifica il serializer da usare per convertire Model in JSON e viceversa
      permission_classes=[IsAuthenticatedOrReadOnly] #Lettura pubblica, scrittura solo autenticati
      # Filtri
-     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+     # Ricerca (?q= / ?search=) nel filterset tramite indice full-text, ordinata per rilevanza
+     filter_backends = [DjangoFilterBackend, RilevanzaOrderingFilter]
      filterset_class = CatalogoFilter
-     search_fields = ['nome_it', 'nome_en', 'nome_fr', 'nome_es', 'slug']
      ordering_fields = ['nome_it', 'created_at', 'is_active']
      ordering = ['-created_at']  # Ordinamento default
+     azioni_condizionali = ('list', 'retrieve', 'cartelle', 'albero')
+
+     # Dettaglio e azioni del singolo catalogo dipendono solo dalla sua versione, la lista da quella globale
+     def get_chiave_versione(self):
+         if self.detail:
+             return chiave_catalogo(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+         return CHIAVE_GLOBALE
 
      @action(detail=True, methods=['get'], permission_classes=[IsAuthenticatedOrReadOnly])
      def cartelle(self, request, pk=None):
@@ -42,24 +65,109 @@ class CatalogoViewSet(viewsets.ModelViewSet): #ViewSet per gestire operazioni CR
          
          GET /api/cataloghi/{id}/cartelle/
          
-         Restituisce le cartelle associate al catalogo, ordinate per campo 'ordine'
+         Restituisce le cartelle attive associate al catalogo, ordinate per campo 'ordine'
          della tabella intermedia CatalogoCartella.
+
+         Risposta paginata (?page=N&page_size=M): il totale è letto nella stessa query della pagina.
+         Con ?paginazione=cursor la risposta è paginata a cursore su (ordine, id).
+         Accetta ?fields= e ?expand= come /api/cartelle/.
          """
          catalogo = self.get_object()
-         
-         # Filtra cartelle attive associate al catalogo, ordinate per CatalogoCartella.ordine
-         cartelle = catalogo.cartelle_root.filter(
-             is_active=True
-         ).order_by('cataloghi_root__ordine')
-         
-         serializer = CartelleSerializer(cartelle, many=True, context={'request': request})
-         
+
+         # Parte dalla tabella ponte: WHERE catalogo = X ORDER BY ordine, id
+         # e carica in anticipo solo quello che usano i campi richiesti (?fields= / ?expand=) del serializer
+         context = {**self.get_serializer_context(), **campi_richiesti(request)}
+         righe = CartelleSerializer(context=context).ottimizza_queryset(
+             CatalogoCartella.objects.filter(
+                 catalogo=catalogo,
+                 cartella__is_active=True
+             ).select_related('cartella').order_by('ordine', 'id'),
+             prefisso='cartella__'
+         )
+
+         if request.query_params.get('paginazione') == 'cursor':
+             paginator = OrdineKeysetPagination()
+         else:
+             paginator = ConteggioFinestraPagination()
+
+         pagina = paginator.paginate_queryset(righe, request, view=self)
+         serializer = CartelleSerializer([riga.cartella for riga in pagina], many=True, context=context)
+         return paginator.get_paginated_response(serializer.data)
+
+     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticatedOrReadOnly])
+     def albero(self, request, pk=None):
+         """
+         Endpoint custom per ottenere l'albero completo delle categorie di un catalogo in una sola richiesta.
+
+         GET /api/cataloghi/{id}/albero/
+
+         Query param opzionali:
+         - profondita=N    → restituisce solo i primi N livelli (per caricare alberi grandi a step)
+         - cartelle=true   → include per ogni nodo le cartelle attive ordinate per 'ordine'
+
+         Solo categorie attive: le sottocategorie di una categoria disattivata vengono escluse.
+         L'albero è costruito in memoria con un numero costante di query.
+         """
+         catalogo = self.get_object()
+
+         profondita = request.query_params.get('profondita')
+         if profondita is not None:
+             try:
+                 profondita = int(profondita)
+                 if profondita < 1:
+                     raise ValueError
+             except ValueError:
+                 return Response(
+                     {'profondita': 'Deve essere un numero intero maggiore di 0.'},
+                     status=status.HTTP_400_BAD_REQUEST
+                 )
+
+         includi_cartelle = request.query_params.get('cartelle', '').lower() in ('1', 'true')
+
+         albero = costruisci_albero(
+             catalogo,
+             profondita=profondita,
+             includi_cartelle=includi_cartelle,
+             context=self.get_serializer_context()
+         )
+
          return Response({
-             'count': cartelle.count(),
-             'results': serializer.data
+             'catalogo': self.get_serializer(catalogo).data,
+             **albero
          })
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticatedOrReadOnly])
+     def snapshot(self, request, pk=None):
+         """
+         Catalogo attivo completo in un unico JSON: albero delle categorie, cartelle ordinate
+         (root e di ogni categoria) con URL di file e thumbnail, nomi nelle quattro lingue.
+
+         GET /api/cataloghi/{id}/snapshot/
+
+         Il JSON è precalcolato su disco e ricostruito in background dopo ogni modifica del catalogo:
+         la richiesta legge un file già compresso (Content-Encoding br o gzip secondo Accept-Encoding)
+         e risponde 304 se l'ETag è ancora valido. Gli URL dei file sono relativi e senza firma.
+         """
+         catalogo = self.get_object()
+         if not catalogo.is_active:
+             raise NotFound('Catalogo non attivo.')
+         return risposta_snapshot(request, catalogo.pk)
+
+     @action(detail=True, methods=['get'], permission_classes=[IsAdminUser], url_path='zip')
+     def archivio_zip(self, request, pk=None):
+         """
+         Scarica in un unico ZIP i file delle cartelle attive del catalogo: le root nella cartella
+         del catalogo, le altre in cartelle che seguono il percorso delle categorie.
+
+         GET /api/cataloghi/{id}/zip/
+
+         L'archivio è scritto in streaming mentre i file vengono letti (ZIP64, immagini e video
+         senza ricompressione): nessun file temporaneo, memoria costante anche per cataloghi grandi.
+         """
+         catalogo = self.get_object()
+         return risposta_zip(voci_catalogo(catalogo), catalogo.slug)
+
+class CategoriaViewSet(CampiRichiestiMixin, LinguaMixin, CacheRispostaMixin, viewsets.ModelViewSet):
         """
         Endpoint generati:
         - GET    /api/categorie/       → Lista tutte le categorie
@@ -68,21 +176,42 @@ class CategoriaViewSet(viewsets.ModelViewSet):
         - PUT    /api/categorie/{id}/  → Modifica completa categoria
         - PATCH  /api/categorie/{id}/  → Modifica parziale categoria
         - DELETE /api/categorie/{id}/  → Elimina categoria
+        - GET    /api/categorie/{id}/zip/ → Archivio ZIP dei file della categoria e sottocategorie (solo staff)
 
         Include filtro per catalogo tramite query param:
         - GET /api/categorie/?catalogo=1 → Filtra categorie per catalogo con id=1
+
+        Le GET rispondono 304 se nulla è cambiato da If-None-Match / If-Modified-Since.
+        Con ?lang=it|en|fr|es (o ?lang=auto per Accept-Language) un solo campo 'nome' al posto dei nome_*.
+        Lista e dettaglio accettano ?fields= (solo i campi indicati) e ?expand=catalogo,parent.
         """
-        #Fa una sola query ottimizzata per recuperare catalogo e parent associati
-        #Fa un SQL JOIN e prende anche i dati del catalogo e del parent
-        queryset = Categoria.objects.select_related('catalogo', 'parent').all()
+        #Catalogo e parent sono caricati con un JOIN solo se la risposta li usa (vedi CampiRichiestiMixin)
+        queryset = Categoria.objects.all()
         serializer_class = CategoriaSerializer
         permission_classes = [IsAuthenticatedOrReadOnly] #Lettura pubblica, scrittura solo autenticati
-        filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+        filter_backends = [DjangoFilterBackend, RilevanzaOrderingFilter]
         filterset_class = CategoriaFilter
-        search_fields = ['nome_it', 'nome_en', 'nome_fr', 'nome_es', 'slug']
         ordering_fields = ['nome_it', 'created_at']
 
-class CartelleViewSet(viewsets.ModelViewSet):
+        # Lista filtrata per catalogo: basta la versione di quel catalogo
+        def get_chiave_versione(self):
+            catalogo_id = self.request.query_params.get('catalogo', '')
+            if self.action == 'list' and catalogo_id.isdigit():
+                return chiave_catalogo(catalogo_id)
+            return CHIAVE_GLOBALE
+
+        @action(detail=True, methods=['get'], permission_classes=[IsAdminUser], url_path='zip')
+        def archivio_zip(self, request, pk=None):
+            """
+            Scarica in un unico ZIP (in streaming, vedi CatalogoViewSet.archivio_zip) i file delle
+            cartelle attive della categoria e di tutte le sottocategorie attive.
+
+            GET /api/categorie/{id}/zip/
+            """
+            categoria = self.get_object()
+            return risposta_zip(voci_categoria(categoria), categoria.slug)
+
+class CartelleViewSet(CampiRichiestiMixin, LinguaMixin, CacheRispostaMixin, PaginazioneSelezionabileMixin, viewsets.ModelViewSet):
         """
         Endpoint generati:
         - GET    /api/cartelle/       → Lista tutte le cartelle
@@ -92,41 +221,138 @@ class CartelleViewSet(viewsets.ModelViewSet):
         - PATCH  /api/cartelle/{id}/  → Modifica parziale cartella
         - DELETE /api/cartelle/{id}/  → Elimina cartella
 
-        Include filtro per categoria e tipo_file. 
-        Ottimizzazione: prefetch delle relazioni many-to-many.
+        Filtri (vedi CartelleFilter):
+        - GET /api/cartelle/?catalogo=1                      → Root e categorie del catalogo 1
+        - GET /api/cartelle/?categoria=5&sottocategorie=true → Categoria 5 e discendenti
+        - GET /api/cartelle/?tipo_file=PDF&is_active=true&created_after=2025-01-01
+        Ricerca full-text nel nome cartella con ?q= (risultati ordinati per rilevanza).
+
+        Campi a richiesta: ?fields=id,nome_cartella,thumbnail_url restituisce solo quei campi
+        e ?expand=cataloghi,categorie aggiunge gli oggetti completi; JOIN e prefetch seguono i campi scelti.
+
+        Paginazione: di default a numero di pagina, con ?paginazione=cursor
+        a cursore su (nome_cartella_sort, id) per scorrere liste molto grandi.
+
+        Le GET rispondono 304 se nulla è cambiato da If-None-Match / If-Modified-Since.
         """
-        # Ottimizza query prefetchando le relazioni ManyToMany con cataloghi e categorie
-        queryset = Cartelle.objects.prefetch_related(
-            'cataloghi',      # Relazione M2M con Catalogo
-            'categorie',      # Relazione M2M con Categoria
-            'categorie__catalogo'  # Catalogo associato alle categorie
-        ).all()
+        # File Filer e relazioni M2M (cataloghi, categorie) sono caricati solo per i campi richiesti
+        queryset = Cartelle.objects.all()
         serializer_class = CartelleSerializer
         permission_classes = [IsAuthenticatedOrReadOnly] #Lettura pubblica, scrittura solo autenticati
+        filter_backends = [DjangoFilterBackend, RilevanzaOrderingFilter]
+        filterset_class = CartelleFilter
+        cursor_pagination_class = CartelleKeysetPagination
+
+        # Lista filtrata per catalogo: basta la versione di quel catalogo, purché nessun altro filtro dipenda
+        # dall'albero (?categoria= può indicare una categoria di un altro catalogo, con versione propria)
+        def get_chiave_versione(self):
+            params = self.request.query_params
+            catalogo_id = params.get('catalogo', '')
+            if (
+                self.action == 'list' and catalogo_id.isdigit()
+                and not any(params.get(nome) for nome in ('categoria', 'sottocategorie'))
+            ):
+                return chiave_catalogo(catalogo_id)
+            return CHIAVE_GLOBALE
 
 
 # View per servire file media protetti
-@api_view(['GET'])
-@permission_classes([IsAuthenticatedOrReadOnly])
 def serve_protected_media(request, file_path):
     """
     Serve file media protetti da autenticazione.
     
     GET /protected-media/file_catalogo/nome_file.pdf
+    GET /protected-media/file_catalogo/nome_file.pdf?scadenza=...&firma=...  (URL firmato)
+
+    Gli URL firmati (generati dai serializer con PROTECTED_MEDIA_SIGNED_URLS=True) sono verificati
+    con HMAC senza autenticazione DRF né query al DB, e sono cacheabili dai proxy fino alla scadenza.
+    Firma assente, errata o scaduta → normale verifica di autenticazione.
+    """
+    if request.method in ('GET', 'HEAD') and 'firma' in request.GET:
+        rimanenti = verifica_url_firmato(file_path, request.GET)
+        if rimanenti is not None:
+            full_path = risolvi_percorso(file_path)
+            cache_control = f'public, max-age={rimanenti}'
+            return risposta_offload(full_path, cache_control=cache_control) or risposta_file(
+                request, full_path, cache_control=cache_control
+            )
+
+    return serve_protected_media_autenticato(request, file_path=file_path)
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def serve_protected_media_autenticato(request, file_path):
+    """
+    Serve file media protetti da autenticazione.
     
     Solo utenti autenticati possono scaricare file.
     Supporta tutti i tipi di file (PDF, immagini, video, etc.)
+
+    Supporta richieste parziali (Range → 206, utile per video e PDF) e condizionali
+    (ETag/Last-Modified → 304 se il file non è cambiato).
+
+    Con PROTECTED_MEDIA_OFFLOAD configurato il trasferimento è delegato al web server
+    (X-Accel-Redirect / X-Sendfile) e il worker Python si libera subito.
     """
-    # Costruisci il percorso completo del file
-    full_path = os.path.join(settings.MEDIA_ROOT, file_path)
-    
-    # Verifica che il file esista
-    if not os.path.exists(full_path):
-        raise Http404("File non trovato")
-    
-    # Verifica che il percorso sia sicuro (previene path traversal attacks)
-    if not os.path.abspath(full_path).startswith(os.path.abspath(settings.MEDIA_ROOT)):
-        raise Http404("Accesso negato")
+    # Costruisci il percorso completo del file (404 se non esiste o è fuori da MEDIA_ROOT)
+    full_path = risolvi_percorso(file_path)
+
+    # Trasferimento affidato al web server, se configurato
+    response = risposta_offload(full_path)
+    if response is not None:
+        return response
     
     # Restituisci il file con il content-type appropriato
-    return FileResponse(open(full_path, 'rb'))
\ No newline at end of file
+    return risposta_file(request, full_path)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def statistiche_cache(request):
+    """
+    Contatori della cache delle risposte API (solo staff).
+
+    GET    /api/cache/statistiche/ → hit, miss, richieste, hit_ratio
+    DELETE /api/cache/statistiche/ → azzera i contatori
+    """
+    if request.method == 'DELETE':
+        azzera_statistiche()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(statistiche())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def sincronizza(request):
+    """
+    Sincronizzazione incrementale per i client offline.
+
+    GET /api/sync/                     → solo il cursore corrente (da leggere PRIMA del download completo)
+    GET /api/sync/?since=123           → modifiche successive al cursore 123
+    GET /api/sync/?since=123&limit=100 → al massimo 100 modifiche del registro per risposta
+
+    La risposta contiene le righe create o modificate (cataloghi, categorie, cartelle,
+    catalogo_cartelle, categoria_cartelle), le tombstone degli oggetti eliminati in 'eliminati',
+    il nuovo 'cursor' e 'has_more' (true = richiamare subito con since=cursor).
+    Un cursore più vecchio del registro mantenuto risponde 410: serve un nuovo download completo.
+    Le modifiche degli ultimi CATALOGO_SYNC_MARGINE secondi arrivano alla richiesta successiva.
+    """
+    since = request.query_params.get('since')
+    if since is None:
+        return Response({'cursor': cursore_corrente()})
+    if not since.isdigit():
+        return Response({'detail': 'Parametro since non valido.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    since = int(since)
+    if since < cursore_minimo():
+        return Response(
+            {'detail': 'Cursore troppo vecchio: riscaricare il catalogo completo.', 'cursor': cursore_corrente()},
+            status=status.HTTP_410_GONE
+        )
+
+    limite = request.query_params.get('limit', '')
+    limite = int(limite) if limite.isdigit() and int(limite) > 0 else settings.CATALOGO_SYNC_LIMITE
+    limite = min(limite, settings.CATALOGO_SYNC_LIMITE_MASSIMO)
+
+    return Response(leggi_modifiche(since, limite, contesto={'request': request}))
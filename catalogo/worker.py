@@ -0,0 +1,27 @@
+# Punti di ingresso dei processi del pool thumbnail (avviati con 'spawn')
+# Il processo figlio importa questo modulo per leggere l'initializer PRIMA di django.setup():
+# qui non vanno import di Django, easy_thumbnails o dei moduli dell'app a livello di modulo
+# (easy_thumbnails.files importa i suoi modelli e fallirebbe con AppRegistryNotReady)
+
+# True solo nei processi del pool (impostato da inizializza)
+_nel_worker = False
+
+
+#Initializer dei processi del pool: segna il processo come worker e configura Django
+def inizializza():
+    global _nel_worker
+    _nel_worker = True
+
+    import django
+    django.setup()
+
+
+#True se il codice gira in un processo del pool thumbnail (lì non si avviano scheduler né altri pool)
+def nel_worker():
+    return _nel_worker
+
+
+#Task eseguito nel worker: import rimandato a dopo django.setup()
+def genera_thumbnail(cartella_id, forza=False):
+    from .thumbnails import genera_thumbnail_da_id
+    return genera_thumbnail_da_id(cartella_id, forza=forza)
@@ -98,7 +98,7 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': BASE_DIR / config('DATABASE_NAME', default='db.sqlite3'),
     }
 }
 
@@ -141,7 +141,39 @@ STATIC_URL = 'static/'
 
 # Media files (User uploads)
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = BASE_DIR / config('MEDIA_ROOT', default='media')
+
+# File protetti (/api/protected-media/): dopo i controlli di Django il trasferimento può essere delegato al web server
+# '' = servito da Python (default), 'x-accel-redirect' = nginx, 'x-sendfile' = Apache/lighttpd (mod_xsendfile)
+PROTECTED_MEDIA_OFFLOAD = config('PROTECTED_MEDIA_OFFLOAD', default='')
+# Location interna di nginx che punta a MEDIA_ROOT (solo per x-accel-redirect)
+PROTECTED_MEDIA_INTERNAL_URL = config('PROTECTED_MEDIA_INTERNAL_URL', default='/media-protetti/')
+
+# URL firmati (HMAC) e a scadenza per file e thumbnail restituiti dalle API: verificati senza query al DB
+# e cacheabili dai proxy per tutta la loro durata (in secondi)
+PROTECTED_MEDIA_SIGNED_URLS = config('PROTECTED_MEDIA_SIGNED_URLS', default=False, cast=bool)
+PROTECTED_MEDIA_URL_TTL = config('PROTECTED_MEDIA_URL_TTL', default=3600, cast=int)
+
+# Cache delle risposte GET delle API del catalogo (alias 'catalogo'). Le chiavi contengono la versione
+# del catalogo (catalogo/versioni.py) aggiornata dai segnali: una modifica rende subito obsolete le voci,
+# il TIMEOUT serve solo a liberare spazio. CACHE_BACKEND: 'locmem' (per processo), 'file', 'redis'
+CATALOGO_CACHE_RISPOSTE = config('CATALOGO_CACHE_RISPOSTE', default=True, cast=bool)
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'catalogo-api'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),  # richiede il pacchetto redis
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=_CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'TIMEOUT': config('CATALOGO_CACHE_TIMEOUT', default=86400, cast=int),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -169,6 +201,36 @@ THUMBNAIL_ALIASES = {
     },
 }
 
+# Generazione thumbnail in background (pool di processi) dopo il salvataggio o l'import delle cartelle
+# Con CATALOGO_THUMBNAIL_ASYNC=False vengono generate subito nella richiesta (utile in sviluppo)
+# Il pool nasce in ogni processo web (N worker gunicorn = N pool, ognuno con django.setup() per processo):
+# pochi processi qui, la generazione massiva va fatta con 'manage.py rigenera_thumbnail' (tutte le CPU)
+CATALOGO_THUMBNAIL_ASYNC = config('CATALOGO_THUMBNAIL_ASYNC', default=True, cast=bool)
+CATALOGO_THUMBNAIL_WORKERS = config('CATALOGO_THUMBNAIL_WORKERS', default=1, cast=int)
+
+# Import multiplo da Filer eseguito in background (APScheduler) a blocchi di CATALOGO_IMPORT_BATCH file
+# Con CATALOGO_IMPORT_ASYNC=False il job viene eseguito subito nella richiesta (utile in sviluppo)
+# Un job in corso o in coda che non avanza da CATALOGO_IMPORT_TIMEOUT secondi è considerato interrotto e può essere ripreso
+CATALOGO_IMPORT_ASYNC = config('CATALOGO_IMPORT_ASYNC', default=True, cast=bool)
+CATALOGO_IMPORT_BATCH = config('CATALOGO_IMPORT_BATCH', default=500, cast=int)
+CATALOGO_IMPORT_TIMEOUT = config('CATALOGO_IMPORT_TIMEOUT', default=600, cast=int)
+
+# Sincronizzazione incrementale (GET /api/sync/?since=): modifiche per risposta (default e massimo)
+# e giorni di registro mantenuti da 'manage.py pota_modifiche' (oltre serve un download completo)
+CATALOGO_SYNC_LIMITE = config('CATALOGO_SYNC_LIMITE', default=500, cast=int)
+CATALOGO_SYNC_LIMITE_MASSIMO = config('CATALOGO_SYNC_LIMITE_MASSIMO', default=2000, cast=int)
+CATALOGO_SYNC_GIORNI = config('CATALOGO_SYNC_GIORNI', default=90, cast=int)
+# Secondi prima che una riga del registro sia servita: deve superare la durata di una transazione
+# tra la scrittura del registro e il commit (id confermati fuori ordine da transazioni concorrenti)
+CATALOGO_SYNC_MARGINE = config('CATALOGO_SYNC_MARGINE', default=10, cast=int)
+
+# Snapshot compressi dei cataloghi (GET /api/cataloghi/{id}/snapshot/), ricostruiti in background
+# CATALOGO_SNAPSHOT_RITARDO secondi dopo una modifica; con CATALOGO_SNAPSHOT_ASYNC=False subito nella richiesta
+# Il formato brotli richiede il pacchetto opzionale Brotli, altrimenti solo gzip
+CATALOGO_SNAPSHOT_DIR = config('CATALOGO_SNAPSHOT_DIR', default=str(BASE_DIR / 'snapshot'))
+CATALOGO_SNAPSHOT_ASYNC = config('CATALOGO_SNAPSHOT_ASYNC', default=True, cast=bool)
+CATALOGO_SNAPSHOT_RITARDO = config('CATALOGO_SNAPSHOT_RITARDO', default=10, cast=int)
+
 # Organizzazione file Filer per data (Anno/Mese/Giorno)
 FILER_STORAGES = {
     'public': {